@@ -0,0 +1,38 @@
+import sys
+import json
+import logging
+import argparse
+
+import benchmarks.mpd
+import benchmarks.convert
+import benchmarks.tts
+import benchmarks.tones
+import benchmarks.mqtt
+import benchmarks.e2e
+import benchmarks.http
+import benchmarks.bank
+
+BENCHMARKS = {
+    "mpd": benchmarks.mpd,
+    "convert": benchmarks.convert,
+    "tts": benchmarks.tts,
+    "tones": benchmarks.tones,
+    "mqtt": benchmarks.mqtt,
+    "e2e": benchmarks.e2e,
+    "http": benchmarks.http,
+    "bank": benchmarks.bank,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soundboard benchmarks, results are printed as json")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    for name, module in BENCHMARKS.items():
+        module.add_arguments(subparsers.add_parser(name, help=module.__doc__))
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    result = BENCHMARKS[args.benchmark].run(args)
+    json.dump({"benchmark": args.benchmark, "result": result}, sys.stdout, indent=2)
+    print()
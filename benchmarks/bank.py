@@ -0,0 +1,88 @@
+""" Loading and playing ingested samples, from their wav files vs views on the sample bank"""
+import os
+import time
+import types
+import random
+import logging
+import tempfile
+import tracemalloc
+
+from soundboard import ingest, loudness, mixer, output, samplebank, sampleindex
+from benchmarks.e2e import library
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--samples", type=int, default=40, help="Size of the library")
+    parser.add_argument("--runs", type=int, default=200, help="Samples loaded per path")
+    parser.add_argument("--seed", type=int, default=1)
+
+def measure(function, runs:int) -> dict:
+    """ Median time and the peak memory allocated by a single call"""
+    times, peaks = [], []
+    for _ in range(runs):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+
+    times.sort()
+    peaks.sort()
+    return {"us_median": times[len(times) // 2] * 1000000, "us_max": times[-1] * 1000000,
+            "peak_bytes_median": peaks[len(peaks) // 2]}
+
+def playback(soundboard, pcm, copy:bool) -> None:
+    """ Play one voice through the mixer like mix_thread, without pacing"""
+    soundboard.mixer.play(pcm)
+    while soundboard.mixer.active():
+        chunk = soundboard.mixer.mix(soundboard.mixer.period)
+        soundboard.pulse.write(chunk.tobytes() if copy else memoryview(chunk).cast("B"))
+
+def run(args) -> dict:
+    logging.getLogger("Ingest").setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="soundboard-bank-") as root:
+        samples = [os.path.join(root, "samples", f"{name}.wav") for name in library(root, args.samples, rng)]
+        soundboard = types.SimpleNamespace(config={"sample_path": os.path.join(root, "samples"),
+            "loudness": {"database": os.path.join(root, "loudness.sqlite")}})
+        soundboard.pulse = output.nullOutput(pacing=False)
+        soundboard.mixer = mixer.mixer(soundboard)
+        soundboard.sampleIndex = sampleindex.sampleIndex(soundboard)
+        soundboard.loudness = loudness.loudnessIndex(soundboard)
+        soundboard.ingest = ingest.sampleIngest(soundboard)
+        soundboard.ingest.reingest_all()
+
+        soundboard.sampleBank = bank = samplebank.sampleBank(soundboard)
+        picks = [rng.choice(samples) for _ in range(args.runs)]
+        pcm = soundboard.ingest.read_pcm(picks[0])
+
+        # Measured before packing, the converted wavs are removed once they're in the bank
+        tracemalloc.start()
+        try:
+            wav = measure(lambda: soundboard.ingest.read_pcm(rng.choice(picks)), args.runs)
+        finally:
+            tracemalloc.stop()
+
+        start = time.perf_counter()
+        bank.sync()
+        directory = os.path.join(root, "samples", ingest.INGEST_DIR)
+        result = {"samples": len(bank.entries), "bank_bytes": bank.size,
+                  "pack_ms": (time.perf_counter() - start) * 1000,
+                  "wavs_left": len([file for file in os.listdir(directory) if file.endswith(".wav")])}
+
+        tracemalloc.start()
+        try:
+            result["load"] = {"wav": wav, "bank": measure(lambda: bank.get(rng.choice(picks)), args.runs)}
+
+            passthrough = soundboard.mixer.passthrough
+            # Every period mixed and copied, like before the bank
+            soundboard.mixer.passthrough = lambda *args: False
+            copied = measure(lambda: playback(soundboard, pcm, True), 20)
+            soundboard.mixer.passthrough = passthrough
+            result["play"] = {"seconds": len(pcm) / 4 / 44100, "copied": copied,
+                              "zero_copy": measure(lambda: playback(soundboard, bank.get(picks[0]), False), 20)}
+        finally:
+            tracemalloc.stop()
+
+    return result
@@ -0,0 +1,63 @@
+""" Converting synthesized float32 speech to PCM, in memory vs through sox"""
+import io
+import os
+import time
+import types
+import shutil
+import tempfile
+
+import numpy
+import soundfile
+
+from soundboard import audio_format
+from generators.speech import speechGenerator
+from generators.samples import decode_file
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=3.0, help="Length of the utterance")
+    parser.add_argument("--rate", type=int, default=22050, help="Sample rate of the TTS output")
+    parser.add_argument("--sox", default="sox", help="sox binary")
+
+def utterance(seconds:float, rate:int) -> bytes:
+    """ A float32 wav like 15.ai returns it"""
+    t = numpy.arange(int(seconds * rate)) / rate
+    signal = (numpy.sin(2 * numpy.pi * 220 * t) * 0.5).astype(numpy.float32)
+    buffer = io.BytesIO()
+    soundfile.write(buffer, signal, rate, subtype="FLOAT", format="WAV")
+    return buffer.getvalue()
+
+def timed(convert, runs:int) -> dict:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        pcm = convert()
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return {"ms_median": times[len(times) // 2] * 1000, "ms_max": times[-1] * 1000, "bytes": len(pcm)}
+
+def run(args) -> dict:
+    data = utterance(args.seconds, args.rate)
+    result = {"input_bytes": len(data),
+              "in_memory": timed(lambda: audio_format.decode_to_pcm(data), args.runs)}
+
+    if shutil.which(args.sox) is None:
+        result["sox"] = "unavailable"
+        return result
+
+    with tempfile.TemporaryDirectory() as cache:
+        soundboard = types.SimpleNamespace(config={"binaries": {"sox": args.sox}, "speech": {"cache": cache}})
+        speech = speechGenerator(soundboard)
+
+        def sox():
+            # The old path, always through sox and temp files
+            with tempfile.TemporaryDirectory(dir=cache) as workdir:
+                with open(os.path.join(workdir, "in.wav"), "wb") as f:
+                    f.write(data)
+                speech.convert_bitdepth_sox(os.path.join(workdir, "in.wav"), os.path.join(workdir, "out.wav"))
+                return decode_file(os.path.join(workdir, "out.wav"))
+
+        result["sox"] = timed(sox, args.runs)
+
+    return result
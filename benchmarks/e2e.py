@@ -0,0 +1,201 @@
+""" Scripted workloads through the whole soundboard with a fake pulse, MPD and TTS service"""
+import os
+import json
+import time
+import wave
+import random
+import shutil
+import resource
+import tempfile
+import threading
+import importlib.util
+
+from http.server import ThreadingHTTPServer
+
+import numpy
+import paho.mqtt.client as mqtt
+
+from benchmarks.fakempd import fakeMPD
+from benchmarks.tts import standInHandler
+from benchmarks.convert import utterance
+from soundboard.output import nullOutput
+
+WORKLOADS = ("sample_storm", "speech_burst", "doorbell_during_themesong")
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--samples", type=int, default=20, help="Samples in the library")
+    parser.add_argument("--storm", type=int, default=200, help="Messages in the sample storm")
+    parser.add_argument("--no-pacing", dest="pacing", action="store_false",
+                        help="Consume audio as fast as it's mixed instead of in real time")
+    parser.add_argument("--mpd-latency", type=float, default=0.002, help="Seconds per MPD round trip")
+    parser.add_argument("--tts-handshake", type=float, default=0.02, help="Seconds per TTS connection")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for a workload to drain")
+    parser.add_argument("--seed", type=int, default=1)
+
+def write_wav(path:str, seconds:float, freq:float, rate:int=44100, channels:int=2) -> None:
+    t = numpy.arange(int(seconds * rate)) / rate
+    signal = (numpy.sin(2 * numpy.pi * freq * t) * 16000).astype(numpy.int16)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(numpy.repeat(signal, channels).tobytes())
+
+def library(root:str, count:int, rng:random.Random) -> list:
+    """ Create samples, theme songs and door sounds, returns the sample names"""
+    for path in ("samples", "themes", "door/doorbell", "cache"):
+        os.makedirs(os.path.join(root, path), exist_ok=True)
+
+    names = []
+    for i in range(count):
+        names.append(f"sample{i:03d}")
+        # A mix of the playback format and files that need converting
+        rate, channels = ((44100, 2), (22050, 1))[i % 2]
+        write_wav(os.path.join(root, "samples", f"{names[-1]}.wav"), rng.uniform(0.3, 1.5), 220 + i * 20, rate, channels)
+
+    write_wav(os.path.join(root, "themes", "alice.wav"), 5.0, 330)
+    write_wav(os.path.join(root, "door", "door_open.wav"), 0.5, 550)
+    write_wav(os.path.join(root, "door", "door_closed.wav"), 0.5, 440)
+    write_wav(os.path.join(root, "door", "doorbell", "bell.wav"), 1.0, 880)
+    return names
+
+def load_soundboard():
+    """ soundboard.py has the same name as the soundboard package, load it by path"""
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "soundboard.py")
+    spec = importlib.util.spec_from_file_location("soundboard_main", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def config(root:str, mpd:fakeMPD) -> dict:
+    return {"sample_path": os.path.join(root, "samples"),
+            "themesongs": os.path.join(root, "themes"),
+            "door": {"samples": os.path.join(root, "door"), "open_close_sound": True},
+            "webserver": 0,
+            "mqtt": {"host": "localhost", "port": 1883, "subscribe": []},
+            "binaries": {"sox": "sox"},
+            "speech": {"cache": os.path.join(root, "cache"), "defaultMethod": "15ai",
+                       "http": {"retries": 0}},
+            "mpd": {"host": mpd.host, "port": mpd.port, "ramp": {"delay": 0.005, "hold": 0.2}},
+            "upload": {"temp_path": os.path.join(root, "cache", "uploads")},
+            "loudness": {"database": os.path.join(root, "cache", "loudness.sqlite")}}
+
+def percentiles(values:list) -> dict:
+    if not values:
+        return {"count": 0}
+
+    values = sorted(values)
+    pick = lambda p: values[min(int(len(values) * p), len(values) - 1)] * 1000
+    return {"count": len(values), "ms_p50": pick(0.5), "ms_p90": pick(0.9),
+            "ms_p99": pick(0.99), "ms_max": values[-1] * 1000}
+
+class harness():
+    """ A soundboard on fakes, messages are injected into on_mqtt_message"""
+
+    def __init__(self, args, root:str) -> None:
+        self.rng = random.Random(args.seed)
+        self.names = library(root, args.samples, self.rng)
+        self.mpd = fakeMPD(latency=args.mpd_latency).start()
+
+        self.tts = ThreadingHTTPServer(("127.0.0.1", 0), standInHandler)
+        self.tts.daemon_threads = True
+        self.tts.handshake = args.tts_handshake
+        self.tts.connections = 0
+        self.tts.audio = utterance(1.0, 22050)
+        threading.Thread(target=self.tts.serve_forever, daemon=True).start()
+
+        self.pulse = nullOutput(pacing=args.pacing)
+        self.board = load_soundboard().soundBoard(config(root, self.mpd), pulse=self.pulse)
+        base = f"http://127.0.0.1:{self.tts.server_address[1]}"
+        self.board.speech.fifteen.tts_url = f"{base}/tts"
+        self.board.speech.fifteen.audio_url = f"{base}/audio/"
+
+        # Collect the latency of every voice when its first period is written
+        self.latencies = []
+        trace_started = self.board.mixer.trace_started
+        def traced():
+            now = time.monotonic()
+            self.latencies += [now - voice.trace['start'] for voice in self.board.mixer.started]
+            trace_started()
+        self.board.mixer.trace_started = traced
+
+        self.board.start_threads(webserver=False)
+        self.board.running = True
+
+    def inject(self, topic:str, payload:str) -> None:
+        message = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+        message.payload = payload.encode("utf-8")
+        self.board.on_mqtt_message(self.board.mqtt, None, message)
+
+    def idle(self) -> bool:
+        board = self.board
+        return (board.scheduler.pending() == 0 and board.mixer.active() == 0
+                and board.speechPool.jobQueue.empty() and not board.speechPool.inflight
+                and board.toneGenerator.toneQueue.empty())
+
+    def drain(self, timeout:float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.idle():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def script(self, workload:str) -> list:
+        """ (seconds from the start, topic, payload) of every message"""
+        if workload == "sample_storm":
+            return [(i * 0.01, "soundboard/play", " ".join(self.rng.choice(self.names) for _ in range(self.rng.randint(1, 3))))
+                    for i in range(self.args.storm)]
+
+        if workload == "speech_burst":
+            texts = [f"Announcement number {i}" for i in range(10)]
+            return [(i * 0.02, "soundboard/speech", json.dumps({"method": "15ai", "name": "GLaDOS", "text": self.rng.choice(texts)}))
+                    for i in range(30)]
+
+        return [(0.0, "space/door/front", json.dumps({"name": "alice"})),
+                (0.5, "deurbel", "pressed"),
+                (0.7, "deurbel", "pressed")]
+
+    def run(self, workload:str) -> dict:
+        self.board.stop()
+        self.drain(5.0)
+        self.latencies = []
+        before = self.board.scheduler.stats()
+        round_trips = self.mpd.round_trips
+
+        script = self.script(workload)
+        start = time.monotonic()
+        handle = []
+        for offset, topic, payload in script:
+            if (delay := start + offset - time.monotonic()) > 0:
+                time.sleep(delay)
+            sent = time.perf_counter()
+            self.inject(topic, payload)
+            handle.append(time.perf_counter() - sent)
+
+        drained = self.drain(self.args.timeout)
+        elapsed = time.monotonic() - start
+        after = self.board.scheduler.stats()
+
+        return {"messages": len(script),
+                "seconds": elapsed,
+                "drained": drained,
+                "messages_per_second": len(script) / sum(handle),
+                "handle": percentiles(handle),
+                "latency": percentiles(self.latencies),
+                "jobs": {key: sum(after[p][key] - before[p][key] for p in after)
+                         for key in ("submitted", "played", "dropped", "coalesced", "preempted")},
+                "mpd_round_trips": self.mpd.round_trips - round_trips,
+                "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+def run(args) -> dict:
+    root = tempfile.mkdtemp(prefix="soundboard-e2e-")
+    try:
+        bench = harness(args, root)
+        bench.args = args
+        return {"pacing": args.pacing,
+                "workloads": {workload: bench.run(workload) for workload in args.workloads},
+                "pulse": bench.pulse.stats()}
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,123 @@
+import time
+import socket
+import logging
+import threading
+import socketserver
+
+class fakeMPDHandler(socketserver.StreamRequestHandler):
+    """ Speaks just enough of the MPD protocol for the soundboard"""
+
+    def handle(self) -> None:
+        server = self.server.mpd
+        server.connections += 1
+        with server.lock:
+            server.clients.add(self.connection)
+        self.wfile.write(b"OK MPD 0.23.5\n")
+
+        try:
+            self.serve(server)
+        except OSError:
+            pass # Dropped by kick()
+        finally:
+            with server.lock:
+                server.clients.discard(self.connection)
+
+    def serve(self, server) -> None:
+        command_list = None
+        for line in self.rfile:
+            command, _, args = line.decode("utf-8").strip().partition(" ")
+            args = args.strip('"')
+
+            if command in ("command_list_begin", "command_list_ok_begin"):
+                command_list = (command == "command_list_ok_begin", [])
+                continue
+
+            if command_list is not None and command != "command_list_end":
+                command_list[1].append((command, args))
+                continue
+
+            server.simulate_latency()
+            server.round_trips += 1
+
+            if command == "close":
+                return
+
+            if command == "command_list_end":
+                list_ok, commands = command_list
+                command_list = None
+                response = b""
+                for queued, queued_args in commands:
+                    response += server.run(queued, queued_args)
+                    if list_ok:
+                        response += b"list_OK\n"
+                self.wfile.write(response + b"OK\n")
+            else:
+                self.wfile.write(server.run(command, args) + b"OK\n")
+
+class fakeMPDServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class fakeMPD():
+    """
+        An in-process MPD stand-in that keeps track of the volume and play
+        state and counts connections, commands and round trips. latency
+        is added to every round trip to simulate a remote MPD.
+    """
+    log = logging.getLogger("Fake MPD")
+
+    def __init__(self, host:str="127.0.0.1", port:int=0, latency:float=0.0) -> None:
+        self.latency = latency
+        self.volume = 80
+        self.state = "play"
+        self.connections = 0
+        self.round_trips = 0
+        self.commands = {}
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.server = fakeMPDServer((host, port), fakeMPDHandler)
+        self.server.mpd = self
+        self.host, self.port = self.server.server_address
+
+    def start(self) -> "fakeMPD":
+        threading.Thread(name="Fake MPD", target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def kick(self) -> None:
+        """ Drop every client connection, like MPD restarting"""
+        with self.lock:
+            for client in self.clients:
+                client.shutdown(socket.SHUT_RDWR)
+
+    def reset(self) -> None:
+        self.connections = 0
+        self.round_trips = 0
+        self.commands = {}
+
+    def simulate_latency(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def run(self, command:str, args:str) -> bytes:
+        with self.lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+
+            if command == "status":
+                return f"volume: {self.volume}\nrepeat: 0\nrandom: 0\nstate: {self.state}\n".encode("utf-8")
+
+            if command == "setvol":
+                self.volume = int(args)
+
+            elif command == "pause":
+                if args == "" :
+                    self.state = {"play": "pause", "pause": "play"}.get(self.state, self.state)
+                elif args == "1" and self.state == "play":
+                    self.state = "pause"
+                elif args == "0" and self.state == "pause":
+                    self.state = "play"
+
+            return b""
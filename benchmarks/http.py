@@ -0,0 +1,120 @@
+""" Concurrent webserver throughput per backend, with slow uploads hogging connections"""
+import time
+import socket
+import logging
+import threading
+import http.client
+
+from types import SimpleNamespace
+
+from soundboard.webserver import webserver
+from soundboard.wsgiserver import server_adapter
+
+ASSET = "/assets/css/bootstrap-utilities.css"
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--servers", nargs="+", default=["wsgiref", "threaded"],
+                        help="Backends to compare, threaded, wsgiref or a bottle backend")
+    parser.add_argument("--workers", type=int, default=8, help="Worker threads of the threaded backends")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds per backend")
+    parser.add_argument("--slow-uploads", type=int, default=1, help="Clients trickling an upload the whole time")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def request(port:int, path:str, headers:dict) -> tuple:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        return response.status, len(response.read())
+    finally:
+        connection.close()
+
+def slow_upload(port:int, stop:threading.Event) -> None:
+    """ Send a multipart body a few bytes at a time until stopped"""
+    body = b"--b\r\nContent-Disposition: form-data; name=\"padding\"\r\n\r\n" + b"x" * 4096 + b"\r\n--b--\r\n"
+    while not stop.is_set():
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            s.sendall(b"POST /upload HTTP/1.1\r\nHost: bench\r\nContent-Type: multipart/form-data; boundary=b\r\n"
+                      + f"Content-Length: {len(body)}\r\n\r\n".encode())
+            for i in range(0, len(body), 64):
+                if stop.is_set():
+                    break
+                s.sendall(body[i:i + 64])
+                time.sleep(0.05)
+
+def client(port:int, deadline:float, results:dict, lock:threading.Lock) -> None:
+    # The web interface: API calls, a stylesheet and revalidating it
+    mix = (("api", "/api/threads", {}),
+           ("asset", ASSET, {"Accept-Encoding": "gzip"}),
+           ("revalidate", ASSET, {"Accept-Encoding": "gzip", "If-None-Match": results['etag']}))
+    i = 0
+    while time.perf_counter() < deadline:
+        kind, path, headers = mix[i % len(mix)]
+        i += 1
+        start = time.perf_counter()
+        status, size = request(port, path, headers)
+        elapsed = time.perf_counter() - start
+
+        with lock:
+            results['latency'].setdefault(kind, []).append(elapsed)
+            results['bytes'] += size
+            results['status'][status] = results['status'].get(status, 0) + 1
+
+def percentile(values:list, fraction:float) -> float:
+    return sorted(values)[min(int(len(values) * fraction), len(values) - 1)] * 1000 if values else None
+
+def measure(board, name:str, args) -> dict:
+    port = free_port()
+    server = server_adapter(name, "127.0.0.1", port, args.workers)
+    site = webserver("127.0.0.1", port, board)
+    threading.Thread(target=site._app.run, kwargs={"server": server, "quiet": True}, daemon=True).start()
+
+    for _ in range(100):
+        try:
+            status, _ = request(port, "/api/threads", {})
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    item = site.assets.assets[("css", ASSET.rsplit("/", 1)[1])]
+    results = {"latency": {}, "bytes": 0, "status": {}, "etag": item.etag[:-1] + '-gz"'}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    for _ in range(args.slow_uploads):
+        threading.Thread(target=slow_upload, args=(port, stop), daemon=True).start()
+    time.sleep(0.1) # Let the uploads get in first
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(port, start + args.duration, results, lock))
+               for _ in range(args.clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    if (srv := getattr(server, "srv", None)) is not None:
+        threading.Thread(target=srv.shutdown, daemon=True).start()
+
+    completed = sum(len(times) for times in results['latency'].values())
+    return {"requests": completed, "requests_per_second": completed / elapsed,
+            "status": results['status'], "kbytes_per_request": results['bytes'] / max(completed, 1) / 1024,
+            "ms": {kind: {"p50": percentile(times, 0.5), "p99": percentile(times, 0.99)}
+                   for kind, times in results['latency'].items()}}
+
+def run(args) -> dict:
+    logging.getLogger("Assets").setLevel(logging.WARNING)
+    board = SimpleNamespace(config={"webserver": {"debug": False}}, threads=[])
+
+    results = {name: measure(board, name, args) for name in args.servers}
+    if "wsgiref" in results and "threaded" in results and results["wsgiref"]["requests_per_second"]:
+        results["speedup"] = results["threaded"]["requests_per_second"] / results["wsgiref"]["requests_per_second"]
+
+    return results
@@ -0,0 +1,73 @@
+""" Round trips and time spent on MPD per played sample, legacy clients vs the ducking controller"""
+import time
+import types
+
+from mpd import MPDClient
+
+from benchmarks.fakempd import fakeMPD
+from soundboard.ducking import duckingController
+from soundboard.mpdclient import mpdclient
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--samples", type=int, default=20, help="Samples to play")
+    parser.add_argument("--latency", type=float, default=0.002, help="Simulated round trip time in seconds")
+    parser.add_argument("--steps", type=int, default=10, help="Steps per volume ramp")
+    parser.add_argument("--delay", type=float, default=0.05,
+                        help="Seconds between ramp steps, like mpd.ramp.delay (0 sends a ramp as one command list)")
+
+def legacy_play(host:str, port:int, amount:int, steps:int, delay:float) -> None:
+    """ The MPD traffic of one sample with a new connection for every call"""
+    def call(command):
+        client = MPDClient()
+        client.connect(host, port)
+        try:
+            return command(client)
+        finally:
+            client.close()
+            client.disconnect()
+
+    status = call(lambda client: client.status())
+
+    def ramp(client, end):
+        start = int(client.status()['volume'])
+        for i in range(steps):
+            client.setvol(int(start + (end - start) / (steps - 1) * i))
+            time.sleep(delay)
+        return int(client.status()['volume'])
+
+    call(lambda client: ramp(client, amount))
+    call(lambda client: ramp(client, int(status['volume'])))
+
+def ducking_play(ducking:duckingController, amount:int, steps:int) -> None:
+    """ The MPD traffic of one sample as the ducking thread sends it"""
+    status = ducking.soundboard.mpd.mpd_status()
+    ducking.current = int(status['volume'])
+    ducking.ramp_to(amount, steps, False)
+    ducking.ramp_to(int(status['volume']), steps, True)
+
+def measure(server:fakeMPD, play, samples:int) -> dict:
+    server.reset()
+    start = time.perf_counter()
+    for _ in range(samples):
+        play()
+    elapsed = time.perf_counter() - start
+
+    return {"round_trips_per_sample": server.round_trips / samples,
+            "connections_per_sample": server.connections / samples,
+            "ms_per_sample": elapsed / samples * 1000}
+
+def run(args) -> dict:
+    server = fakeMPD(latency=args.latency).start()
+    amount = 20
+
+    try:
+        legacy = measure(server, lambda: legacy_play(server.host, server.port, amount, args.steps, args.delay), args.samples)
+
+        config = {"mpd": {"host": server.host, "port": server.port, "ramp": {"amount": amount, "delay": args.delay}}}
+        soundboard = types.SimpleNamespace(config=config)
+        soundboard.mpd = mpdclient(soundboard)
+        ducking = measure(server, lambda: ducking_play(duckingController(soundboard), amount, args.steps), args.samples)
+    finally:
+        server.stop()
+
+    return {"delay": args.delay, "legacy": legacy, "ducking": ducking}
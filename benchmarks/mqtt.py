@@ -0,0 +1,66 @@
+""" Routing MQTT messages and parsing soundboard/play payloads"""
+import re
+import time
+import logging
+
+from soundboard.mqttrouter import mqttRouter
+from soundboard.commands import parse_play
+
+TOPICS = ("space/door/front", "deurbel", "door/door_closed", "soundboard/play", "soundboard/stop", "soundboard/skip",
+          "soundboard/dtmf", "soundboard/morse", "soundboard/rtttl")
+
+MESSAGES = [("soundboard/play", b"airhorn 440hzsq0.2 100hzsw wow"),
+            ("soundboard/speech/glados", b'{"method": "15ai", "text": "Hello", "name": "GlaDOS"}'),
+            ("space/door/front", b'{"name": "someone"}'),
+            ("soundboard/morse", b"SOS"),
+            ("sensors/temperature", b"21.5")]
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--messages", type=int, default=200000)
+
+def legacy_play(payload:str) -> list:
+    """ How on_mqtt_message_handle used to parse soundboard/play"""
+    commands = []
+    for payload_split in payload.split(" "):
+        if freq_match := re.search("([0-9]+)hz", payload_split, re.IGNORECASE):
+            tone = {"freq": freq_match.group(1), "type": "sine", "duration": 1.0}
+            if wave_match := re.search("[0-9]+.hz(sw|si|tri|sq)", payload_split, re.IGNORECASE):
+                tone['type'] = wave_match.group(1)
+            if durr_match := re.search("[0-9]+.hz(sw|si|tri|sq)([0-9]+\\.[0-9]+)", payload_split, re.IGNORECASE):
+                tone['duration'] = min(float(durr_match.group(2)), 5.0)
+            commands.append(tone)
+        commands.append(payload_split)
+    return commands
+
+def rate(function, count:int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        function(i)
+    return count / (time.perf_counter() - start)
+
+def run(args) -> dict:
+    handler = lambda payload: None
+    router = mqttRouter()
+    for topic in TOPICS:
+        router.register(topic, handler)
+    # Like speechPool, the if chain matched these with startswith
+    router.register("soundboard/speech/#", handler)
+
+    log = logging.getLogger("Soundboard")
+    def legacy_route(i):
+        # on_mqtt_message_handle, formatting its debug line and decoding the payload in every matching branch
+        topic, payload = MESSAGES[i % len(MESSAGES)]
+        log.debug(f"MQTT {topic} >> {payload.decode('utf-8')}")
+        for candidate in TOPICS:
+            if topic == candidate:
+                handler(payload.decode("utf-8"))
+        if topic.startswith("soundboard/speech"):
+            handler(payload.decode("utf-8"))
+
+    payloads = [payload.decode("utf-8") for topic, payload in MESSAGES if topic == "soundboard/play"]
+
+    return {"messages": args.messages,
+            "router_per_second": rate(lambda i: router.route(*MESSAGES[i % len(MESSAGES)]), args.messages),
+            "if_chain_per_second": rate(legacy_route, args.messages),
+            "play_parser_per_second": rate(lambda i: parse_play(payloads[0]), args.messages),
+            "legacy_play_parser_per_second": rate(lambda i: legacy_play(payloads[0]), args.messages)}
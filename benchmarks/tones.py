@@ -0,0 +1,48 @@
+""" Rendering tone tokens with toneSynth vs tones.mixer"""
+import time
+import types
+
+from tones.mixer import Mixer
+from tones import SINE_WAVE, SAWTOOTH_WAVE, TRIANGLE_WAVE, SQUARE_WAVE
+
+from generators.synth import toneSynth
+
+WAVES = {"sine": SINE_WAVE, "saw": SAWTOOTH_WAVE, "triangle": TRIANGLE_WAVE, "square": SQUARE_WAVE}
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=1.0, help="Seconds per tone")
+    parser.add_argument("--freq", type=float, default=440.0)
+
+def timed(render, runs:int) -> dict:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        render()
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return {"ms_median": times[len(times) // 2] * 1000, "ms_max": times[-1] * 1000}
+
+def run(args) -> dict:
+    synth = toneSynth(types.SimpleNamespace(config={}))
+    result = {}
+
+    for name, wave in WAVES.items():
+        def mixer():
+            # How toneGenerator.play_tone used to render a token
+            mixer = Mixer(44100, 1.0)
+            mixer.create_track(0, wave)
+            mixer.add_tone(0, frequency=args.freq, duration=args.duration, decay=0.1)
+            return mixer.sample_data()
+
+        def uncached():
+            synth.cache.clear()
+            return synth.tone(name, args.freq, args.duration)
+
+        result[name] = {"tones.mixer": timed(mixer, args.runs),
+                        "synth": timed(uncached, args.runs),
+                        "synth_cached": timed(lambda: synth.tone(name, args.freq, args.duration), args.runs)}
+
+    result["cache"] = synth.cache.stats()
+    return result
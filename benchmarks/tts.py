@@ -0,0 +1,89 @@
+""" TTS round trips against a local stand-in server, bare requests vs the pooled transport"""
+import json
+import time
+import socket
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from generators.speech import FifteenAPI
+from generators.ttstransport import ttsTransport
+
+AUDIO = b"RIFF" + bytes(256 * 1024)
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--handshake", type=float, default=0.02,
+                        help="Simulated connection setup (TCP + TLS) time in seconds")
+
+class standInHandler(BaseHTTPRequestHandler):
+    """ Answers like the 15.ai API, every new connection pays the handshake"""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        time.sleep(self.server.handshake)
+        self.server.connections += 1
+        # Headers and body are separate writes, don't let Nagle delay the body
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def reply(self, body:bytes, content_type:str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply(json.dumps({"wavNames": ["utterance.wav"]}).encode("utf-8"), "application/json")
+
+    def do_GET(self) -> None:
+        self.reply(getattr(self.server, "audio", AUDIO), "audio/wav")
+
+def measure(server, api:FifteenAPI, count:int) -> dict:
+    server.connections = 0
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        assert api.get_tts_raw("GLaDOS", "Hello world")["status"] == "OK"
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return {"ms_median": times[len(times) // 2] * 1000, "ms_p95": times[int(len(times) * 0.95)] * 1000,
+            "connections_per_request": server.connections / count}
+
+class bareTransport(ttsTransport):
+    """ Behaves like the old bare requests.post/requests.get calls"""
+
+    def request(self, method:str, url:str, **kwargs) -> requests.Response:
+        kwargs.pop("stream", None)
+        with requests.Session() as session:
+            response = session.request(method, url, **kwargs)
+            response.content
+            return response
+
+def run(args) -> dict:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), standInHandler)
+    server.daemon_threads = True
+    server.handshake = args.handshake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    results = {}
+    try:
+        for name, transport in (("bare", bareTransport("bare")), ("pooled", ttsTransport("pooled"))):
+            api = FifteenAPI(transport=transport)
+            api.tts_url = f"{base}/tts"
+            api.audio_url = f"{base}/audio/"
+            results[name] = measure(server, api, args.requests)
+    finally:
+        server.shutdown()
+
+    results["ms_saved_per_request"] = results["bare"]["ms_median"] - results["pooled"]["ms_median"]
+    return results
@@ -10,26 +10,27 @@ class door():
  
     def __init__(self, soundboard) -> None:
         self.soundboard = soundboard
+
+    def register_mqtt(self, router) -> None:
+        router.register("deurbel", self.doorbell_mqtt_trigger)
+        router.register("door/door_closed", self.door_mqtt_trigger)
     
     def doorbell_mqtt_trigger(self, payload):
-        samples = os.listdir(os.path.join(self.soundboard.config['door']['samples'], "doorbell"))
+        samples = self.soundboard.sampleIndex.files("doorbell")
 
-        #self.soundboard.samplePlayer.sampleQueue.put(
-        self.soundboard.samplePlayer.sampleQueue.put({"sample": 
-            os.path.join(self.soundboard.config['door']['samples'], "doorbell", random.choice(samples)),
-            "pause": True})
+        self.soundboard.scheduler.submit(random.choice(samples)['path'], "doorbell", pause=True)
 
     def door_mqtt_trigger(self, payload):
         
         if self.soundboard.config['door']['open_close_sound'] == True:
             if payload == "False" : # door is open
                 if not self.doorState == False and self.soundboard.running == True:
-                    self.soundboard.samplePlayer.sampleQueue.put(
-                        os.path.join(self.soundboard.config['door']['samples'], "door_open.wav"))
+                    self.soundboard.scheduler.submit(
+                        os.path.join(self.soundboard.config['door']['samples'], "door_open.wav"), "door")
                 self.doorState = False
         
             elif payload == "True": # door is closed
                 if not self.doorState == True and self.soundboard.running == True:
-                    self.soundboard.samplePlayer.sampleQueue.put(
-                        os.path.join(self.soundboard.config['door']['samples'], "door_closed.wav"))
+                    self.soundboard.scheduler.submit(
+                        os.path.join(self.soundboard.config['door']['samples'], "door_closed.wav"), "door")
                 self.doorState = True
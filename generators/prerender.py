@@ -0,0 +1,132 @@
+import sys
+import yaml
+import types
+import logging
+import argparse
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+class speechPrerender():
+    """
+        Renders a list of (method, name, text) entries into the speech
+        cache ahead of time, so that announcements that matter don't wait
+        for the TTS service the first time they are played. The cache keys
+        are the same ones speechGenerator uses for soundboard/speech.
+    """
+    log = logging.getLogger("Prerender")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        self.parallelism = self.soundboard.config['speech'].get('prerender_parallelism', 4)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def load(self, path:str) -> list:
+        """ Load entries from a yaml or json file"""
+        with open(path, "r") as f:
+            return yaml.safe_load(f)
+
+    def validate(self, entries) -> list:
+        if not isinstance(entries, list):
+            raise ValueError("Expected a list of entries")
+
+        for entry in entries:
+            if not isinstance(entry, dict) or not {"method", "name", "text"} <= entry.keys():
+                raise ValueError(f"Entry {entry} needs a method, name and text")
+
+        return entries
+
+    def key(self, entry:dict) -> str:
+        return self.soundboard.speech.hashtext(f"{entry['text']}_{entry['name']}_{entry['method']}")
+
+    def render_entry(self, entry:dict) -> str:
+        """ Render a single entry, returns rendered, cached or failed"""
+        if self.soundboard.speechCache.contains(self.key(entry)):
+            return "cached"
+
+        try:
+            speech = self.soundboard.speech.generate(entry['method'], entry['name'], entry['text'])
+        except Exception as e:
+            self.log.error(f"Failed to render {entry} ({e})")
+            return "failed"
+
+        return "rendered" if speech is not None else "failed"
+
+    def render(self, entries:list, parallelism:int=None, progress=None) -> dict:
+        """ Render entries concurrently, progress(status) is called per entry"""
+        status = {"total": len(entries), "done": 0, "rendered": 0, "cached": 0, "failed": 0}
+
+        def render_one(entry):
+            result = self.render_entry(entry)
+            with self.lock:
+                status[result] += 1
+                status['done'] += 1
+            if progress:
+                progress(status, entry, result)
+
+        with ThreadPoolExecutor(max_workers=parallelism or self.parallelism) as executor:
+            list(executor.map(render_one, self.validate(entries)))
+
+        return status
+
+    def start(self, entries:list, parallelism:int=None) -> int:
+        """
+            Render in the background, returns the job id for job().
+            parallelism can lower the configured prerender_parallelism,
+            never raise it.
+        """
+        self.validate(entries)
+        if parallelism is not None:
+            if not isinstance(parallelism, int) or isinstance(parallelism, bool) or parallelism < 1:
+                raise ValueError("parallelism must be a positive number")
+            parallelism = min(parallelism, self.parallelism)
+
+        with self.lock:
+            job = len(self.jobs) + 1
+            self.jobs[job] = {"total": len(entries), "done": 0, "finished": False}
+
+        def update(status, entry, result):
+            self.jobs[job].update(status)
+
+        def render():
+            self.render(entries, parallelism, update)
+            self.jobs[job]['finished'] = True
+
+        threading.Thread(name=f"Prerender {job}", target=render, daemon=True).start()
+        return job
+
+    def job(self, job:int) -> dict:
+        return self.jobs.get(job)
+
+if __name__ == "__main__":
+    from soundboard.ingest import sampleIngest
+    from soundboard.loudness import loudnessIndex
+    from generators.samples import samplePlayer
+    from generators.speech import speechGenerator
+    from generators.speechcache import speechCache
+
+    parser = argparse.ArgumentParser(description="Render speech into the cache ahead of time")
+    parser.add_argument("entries", help="yaml or json list of {method, name, text}")
+    parser.add_argument("--config", default="config.yml")
+    parser.add_argument("--parallelism", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    with open(args.config, "r") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    soundboard = types.SimpleNamespace(config=config)
+    soundboard.loudness = loudnessIndex(soundboard)
+    soundboard.ingest = sampleIngest(soundboard)
+    soundboard.samplePlayer = samplePlayer(soundboard)
+    soundboard.speechCache = speechCache(soundboard)
+    soundboard.speech = speechGenerator(soundboard)
+
+    def progress(status, entry, result):
+        print(f"[{status['done']}/{status['total']}] {result}: {entry['name']} \"{entry['text']}\"", flush=True)
+
+    prerender = speechPrerender(soundboard)
+    status = prerender.render(prerender.load(args.entries), args.parallelism, progress)
+    print(f"Rendered {status['rendered']}, already cached {status['cached']}, failed {status['failed']}")
+    sys.exit(1 if status['failed'] else 0)
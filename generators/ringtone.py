@@ -0,0 +1,105 @@
+import numpy
+import rtttl
+import logging
+
+from soundboard import metrics
+from soundboard.samplecache import pcmCache
+from generators.synth import RATE, shape, to_pcm
+
+# (detune in Hz, amplitude, decay in seconds) of every track, a square wave
+# with two slightly detuned ones next to it for a fatter sound
+TRACKS = ((-6, 0.3, 0.2), (0, 0.5, 0.1), (6, 0.3, 0.2))
+
+class ringtonePlayer():
+    """
+        Plays RTTTL ringtones. A ringtone is parsed once and all detuned
+        tracks are rendered in batched NumPy passes, the first notes start
+        playing while the rest of the melody is still being rendered.
+        Rendered melodies are cached by their ringtone string.
+    """
+    log = logging.getLogger("Ringtone")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('tones', {})
+        self.cache = pcmCache(int(config.get('rtttl_cache_size', 16) * 1024 * 1024))
+        metrics.REGISTRY.collector(metrics.cache_collector("rtttl", self.cache.stats))
+        self.batch = config.get('rtttl_batch', 8)
+        self.wave = config.get('rtttl_wave', "square")
+
+    def parse(self, ringtone:str) -> tuple:
+        """ Return the frequencies and lengths in frames of every note"""
+        try:
+            notes = rtttl.parse_rtttl(ringtone.strip())['notes']
+        except Exception as e:
+            # The parser raises AttributeError on some invalid defaults
+            raise ValueError(f"Invalid RTTTL ({e})")
+
+        if not notes:
+            raise ValueError("RTTTL without notes")
+
+        freqs = numpy.array([note['frequency'] for note in notes], dtype=numpy.float64)
+        frames = numpy.array([int(note['duration'] / 1000 * RATE) for note in notes], dtype=numpy.int64)
+        return freqs, frames
+
+    def render(self, freqs:numpy.ndarray, frames:numpy.ndarray, phases:list=None) -> tuple:
+        """
+            Render notes into float32 mono in one pass per track. The phase
+            of every track is carried over between calls, so a melody can
+            be rendered in batches without clicks. Returns the signal and
+            the phases to continue with.
+        """
+        total = int(frames.sum())
+        phases = list(phases or [0.0] * len(TRACKS))
+        starts = numpy.repeat(numpy.cumsum(frames) - frames, frames)
+        position = numpy.arange(total) - starts
+        length = numpy.repeat(frames, frames)
+        silent = numpy.repeat(freqs <= 0, frames)
+
+        mixed = numpy.zeros(total, dtype=numpy.float64)
+        for i, (detune, amplitude, decay) in enumerate(TRACKS):
+            step = numpy.repeat(numpy.where(freqs > 0, freqs + detune, 0.0) / RATE, frames)
+            cycles = phases[i] + numpy.cumsum(step) - step
+            phases[i] = float((phases[i] + step.sum()) % 1.0)
+
+            signal = shape(self.wave, cycles)
+
+            # Linear decay at the end of every note, like tones.mixer does
+            envelope = numpy.minimum(1.0, (length - 1 - position) / max(int(decay * RATE), 1))
+            mixed += signal * envelope * amplitude
+
+        # tones.mixer averages its tracks
+        mixed[silent] = 0.0
+        return (mixed / len(TRACKS)).astype(numpy.float32), phases
+
+    def pcm(self, ringtone:str) -> bytes:
+        """ Render a whole ringtone as s16 stereo, from the cache when possible"""
+        if (pcm := self.cache.get(ringtone)) is None:
+            pcm = to_pcm(self.render(*self.parse(ringtone))[0])
+            self.cache.put(ringtone, pcm)
+
+        return pcm
+
+    def play(self, ringtone:str) -> None:
+        """ Play a ringtone, streaming it while it renders when it isn't cached"""
+        if (pcm := self.cache.get(ringtone)) is not None:
+            self.soundboard.mixer.play(pcm, name="rtttl")
+            return
+
+        freqs, frames = self.parse(ringtone)
+        stream = self.soundboard.mixer.stream(name="rtttl")
+        rendered = []
+        phases = None
+
+        try:
+            for start in range(0, len(freqs), self.batch):
+                signal, phases = self.render(freqs[start:start + self.batch], frames[start:start + self.batch], phases)
+                rendered.append(to_pcm(signal))
+                stream.feed(rendered[-1])
+
+                if stream.finished:
+                    return # Stopped or skipped while rendering
+        finally:
+            stream.close()
+
+        self.cache.put(ringtone, b"".join(rendered))
@@ -1,83 +1,123 @@
 import os
-import queue
+import time
 import pydub
 import logging
 
 from pydub.playback import play
 
+from soundboard import metrics
+from soundboard.scheduler import STAGE_SECONDS
+from soundboard.samplecache import sampleCache
+from soundboard.commands import parse_play, toneCommand
+
+DECODE_SECONDS = metrics.histogram_metric("soundboard_decode_seconds", "Time to decode a sample per format", ("format",))
+
+def decode_file(path:str) -> bytes:
+    """ Decode any file pydub can read to 44.1 kHz stereo s16 PCM, as it is"""
+    sound = pydub.AudioSegment.from_file(path, os.path.splitext(path)[-1].split(".")[-1])
+
+    if sound.channels == 1:
+        sound = sound.set_channels(2)
+
+    if sound.frame_rate != 44100:
+        sound = sound.set_frame_rate(44100)
+
+    if sound.sample_width != 2:
+        sound = sound.set_sample_width(2)
+
+    return sound.raw_data
+
 class samplePlayer():
-    sampleQueue = queue.Queue()
     log = logging.getLogger("sample player")
 
     def __init__(self, soundboard):
         self.soundboard = soundboard
+        cache_config = self.soundboard.config.get('samplecache', {})
+        self.cache = sampleCache(self.decode,
+            int(cache_config.get('size', 64) * 1024 * 1024))
+        metrics.REGISTRY.collector(metrics.cache_collector("samples", self.cache.stats))
+
+    def decode(self, sample:str) -> bytes:
+        """
+            Decode a sample to 44.1 kHz stereo s16 PCM, ready for pulse.
+            Leading and trailing silence is left out, the loudness gain is
+            applied by the mixer when it's played.
+        """
+        start = time.monotonic()
+        if (pcm := self.soundboard.ingest.read_pcm(sample)) is not None:
+            pcm = self.soundboard.loudness.prepare(sample, pcm)
+            DECODE_SECONDS.observe(time.monotonic() - start, "ingested")
+            return pcm
+
+        # Not converted yet, decode it now and let the ingest worker store it
+        if self.soundboard.ingest.in_library(sample):
+            self.soundboard.ingest.submit(sample)
+
+        pcm = self.soundboard.loudness.prepare(sample, decode_file(sample))
+        DECODE_SECONDS.observe(time.monotonic() - start, os.path.splitext(sample)[-1].lstrip(".").lower())
+        return pcm
+
+    def load(self, sample:str):
+        """ Return the PCM of a sample, a view on the sample bank when it's packed"""
+        start = time.monotonic()
+        if (pcm := self.soundboard.sampleBank.get(sample)) is not None:
+            pcm = self.soundboard.loudness.prepare(sample, pcm)
+            DECODE_SECONDS.observe(time.monotonic() - start, "bank")
+            return pcm
+
+        return self.cache.get(sample)
 
     def preload(self, sample):
         """
-            Allow you to preload samples before adding them to the queue,
-            should speed up playing multiple samples at once a bit more
-            since the next once gets loaded while the previous one still plays
+            Allow you to preload samples into the cache before adding them
+            to the queue, should speed up playing multiple samples at once a
+            bit more since the next once gets decoded while the previous one
+            still plays
         """
-        self.log.info(f"Queuing: {sample}")
-        self.sampleQueue.put(pydub.AudioSegment.from_file(sample, os.path.splitext(sample)[-1].split(".")[-1]))
+        self.log.info(f"Preloading: {sample}")
+        if self.soundboard.sampleBank.get(sample) is None:
+            self.cache.warm(sample)
 
     def sample_thread(self):
         while True:
-            sample = self.sampleQueue.get()
-            self.soundboard.playlock.acquire()
-            sample_dict = {"pause": False}
-            is_raw = False
+            job = self.soundboard.scheduler.next()
+            dequeued = time.monotonic()
 
             try:
-                if type(sample) == str:
-                    self.log.info(f"Playing: {sample}")
-                    sound = pydub.AudioSegment.from_file(sample, os.path.splitext(sample)[-1].split(".")[-1])
-
-                elif type(sample) == dict:
-                    sample_dict = sample
-                    sample = sample["sample"]
-                    sound = pydub.AudioSegment.from_file(sample, os.path.splitext(sample)[-1].split(".")[-1])
+                if type(job.sample) == str:
+                    self.log.info(f"Playing: {job.sample} ({job.priority})")
+                    sound = self.load(job.sample)
+                    gain = job.gain if job.gain is not None else self.soundboard.loudness.sample_gain(job.sample)
 
                 else: # Raw pcm
-                    is_raw = True
-                    sound = sample
-                    self.log.info(f"Playing: {type(sample)}")
+                    sound = job.sample
+                    gain = job.gain if job.gain is not None else 1.0
+                    self.log.info(f"Playing: {type(job.sample)} ({job.priority})")
 
-                status = self.soundboard.mpd.mpd_status()
+                decoded = time.monotonic()
+                STAGE_SECONDS.observe(decoded - dequeued, "decode")
 
-                if sample_dict['pause'] == True:
-                   self.soundboard.mpd.mpd_should_pause()
-
-                elif "volume" in status:
-                   self.soundboard.mpd.volume_ramp_down(self.soundboard.config['mpd']['ramp']['amount'])
-
-                if not is_raw:
-                   
-                    if sound.channels == 1:
-                        sound = sound.set_channels(2)
-
-                    if sound.frame_rate != 44100:
-                        sound = sound.set_frame_rate(44100)
-
-                    sound = pydub.effects.normalize(sound)
-                    self.soundboard.pulse.write(sound.raw_data)
-                else:
-                    self.soundboard.pulse.write(sample)
-
-                if self.sampleQueue.empty and "volume" in status and not sample_dict['pause'] == True:
-                   self.soundboard.mpd.volume_ramp_up(int(status['volume']))
-
-                elif sample_dict['pause'] == True:
-                   self.soundboard.mpd.mpd_should_resume()
+                # Ducking happens on its own thread, don't wait for MPD
+                self.soundboard.ducking.duck(job.pause)
+                trace = {"start": job.received or job.enqueued, "decoded": decoded}
+                self.soundboard.scheduler.started(job, self.soundboard.mixer.play(sound, gain, name=job.name, trace=trace))
 
             except Exception as e:
                 import traceback
-                self.log.error(f"Exception happened while playing {sample} ({e})")
+                self.log.error(f"Exception happened while playing {job.name} ({e})")
                 traceback.print_exc()
 
-            finally:
-                self.samplePlaying = None
-                self.soundboard.playlock.release()
-
     def play_sample(self, file):
-        self.sampleQueue.put_nowait(file)
\ No newline at end of file
+        self.soundboard.scheduler.submit(file, "play")
+
+    def register_mqtt(self, router) -> None:
+        router.register("soundboard/play", self.mqtt_play)
+
+    def mqtt_play(self, payload:str) -> None:
+        """ Play samples and tones, multiple can be separated by spaces"""
+        for command in parse_play(payload):
+            if isinstance(command, toneCommand):
+                self.soundboard.toneGenerator.toneQueue.put(command.as_tone())
+
+            elif sample := self.soundboard.find_sample(command.name):
+                self.soundboard.scheduler.submit(sample, "play")
\ No newline at end of file
@@ -4,22 +4,43 @@ import subprocess
 import os
 import re
 import json
-import pydub
-import shutil
 import urllib
 import string
 import random
+import time
 import hashlib
 import logging
+import tempfile
 import requests
+import threading
 
 from urllib import parse
+from typing import NamedTuple
+
+from soundboard import metrics
+from soundboard import audio_format
+from generators import ttstransport
+from generators.samples import decode_file
+
+TTS_SECONDS = metrics.histogram_metric("soundboard_tts_seconds", "Time the TTS backends take", ("method", "success"))
+
+class speechAudio(NamedTuple):
+    audio: object # PCM, or the path of cached speech
+    gain: float # Loudness gain, measured whichever way the speech is delivered
 
 class speechGenerator():
     log = logging.getLogger("speech")
 
     def __init__(self, soundboard):
         self.soundboard = soundboard
+        http = self.soundboard.config.get('speech', {}).get('http', {})
+        transport_config = {"timeout": http.get('timeout', 10.0), "retries": http.get('retries', 2),
+                            "backoff": http.get('backoff', 0.3)}
+
+        # Created once so sessions, the voice map and the nonce are reused
+        self.acapela = AcapelaGroup(http.get('nonce_ttl', 600),
+            ttstransport.transport("acapela", **transport_config))
+        self.fifteen = FifteenAPI(transport=ttstransport.transport("15ai", **transport_config))
 
     def hashtext(self, text:str) -> str:
         """ hash text as sha1"""
@@ -35,34 +56,74 @@ class speechGenerator():
             locally generated. As such, caching will automatically
             not be used for those that are local.
         """
+        speech = self.generate(method, name, text, cache, regenCache)
+        if speech is not None:
+            self.soundboard.scheduler.submit(speech.audio, "speech", name=text, gain=speech.gain)
 
-        if cache or regenCache:
-            hashed_text = self.hashtext(f"{text}_{name}_{method}")
-            hashed_file = os.path.join(self.soundboard.config['speech']['cache'],
-                                    f"{hashed_text}.wav")
+    def generate(self, method:str, name:str, text:str, cache=True, regenCache=False) -> speechAudio:
+        """
+            Generate speech and return something the sample player can
+            play, the PCM of freshly generated speech or whatever the
+            cache returns for cached speech, with the gain that brings
+            it to the same loudness as samples.
+        """
+        hashed_text = self.hashtext(f"{text}_{name}_{method}")
+
+        # regenCache skips the lookup so the cached file gets replaced
+        if cache and not regenCache:
+            if (cached := self.soundboard.speechCache.lookup(hashed_text)) is not None:
+                self.log.info(f"Playing cached speech {hashed_text} ({method})")
+                return speechAudio(cached, self.soundboard.speechCache.gain(hashed_text))
 
-            if os.path.exists(hashed_file):
-                # Play the file if it's found in cache
-                self.log.info(f"Playing cached speech {os.path.basename(hashed_file)} ({method})")
-                return self.soundboard.samplePlayer.sampleQueue.put(hashed_file)
+        start = time.monotonic()
 
         # AcapelaGroup
         if method == "apg":
-            audioFile = self.acapellaGroup(name, text)
+            pcm = self.acapellaGroup(name, text)
 
         elif method == "15ai":
-            audioFile = self.fifteen_ai(name, text)
+            pcm = self.fifteen_ai(name, text)
 
         else:
             return self.log.error(f"Unknown method {method}")
 
-        if audioFile:
-            self.soundboard.samplePlayer.sampleQueue.put(audioFile)
-            hashed_text = self.hashtext(f"{text}_{name}_{method}")
-            if cache:
-                # Save file if caching enabled
-                self.log.info(f"Saving speech to cache as {os.path.basename(hashed_file)} ({method})")
-                shutil.copy(audioFile, hashed_file)
+        TTS_SECONDS.observe(time.monotonic() - start, method, "true" if pcm else "false")
+
+        if not pcm:
+            return None
+
+        if cache or regenCache:
+            # Save file if caching enabled
+            self.log.info(f"Saving speech to cache as {hashed_text} ({method})")
+            cached = self.soundboard.speechCache.store(hashed_text, pcm, name, method)
+            analysis = self.soundboard.loudness.analyse(cached, pcm)
+        else:
+            analysis = self.soundboard.loudness.measure(pcm)
+
+        return speechAudio(self.soundboard.loudness.trimmed(pcm, analysis), self.soundboard.loudness.gain(analysis))
+
+    def convert(self, data:bytes, ext:str) -> bytes:
+        """
+            Convert downloaded audio to PCM in the playback format. This
+            is done in memory, sox is only used for formats libsndfile
+            can't decode. Every sox conversion works in its own temporary
+            directory so that concurrent generations don't collide.
+        """
+        try:
+            return audio_format.decode_to_pcm(data)
+        except RuntimeError as e:
+            self.log.debug(f"Can't decode {ext} in memory, falling back to sox ({e})")
+
+        with tempfile.TemporaryDirectory(dir=self.soundboard.config['speech']['cache']) as workdir:
+            cacheFile = os.path.join(workdir, f"input.{ext}")
+            cacheFileOutput = os.path.join(workdir, "output16.wav")
+
+            with open(cacheFile, "wb") as fout:
+                fout.write(data)
+
+            self.convert_bitdepth_sox(cacheFile, cacheFileOutput)
+            # Not through the sample player, the file is gone before it could be analysed
+            return decode_file(cacheFileOutput)
 
     def convert_bitdepth_sox(self, input, output):
         """
@@ -81,51 +142,34 @@ class speechGenerator():
             raise FileNotFoundError(f"Failed to find {output}")
 
     def acapellaGroup(self, voice, text):
-        apg = AcapelaGroup()
         self.log.info(f"Generate \"{text}\" with {voice} (AcapellaGroup)")
 
-        data = apg.generate(voice, text)
-        cacheFile = os.path.join(self.soundboard.config['speech']['cache'], "acapellagroup.mp3")
-        cacheFileOutput = os.path.join(self.soundboard.config['speech']['cache'], "acapellagroup16.wav")
-        
-        with open(cacheFile, "wb") as fout:
-            fout.write(data)
-        
-        self.convert_bitdepth_sox(cacheFile, cacheFileOutput)
-        return cacheFileOutput
+        data = self.acapela.generate(voice, text)
+        if data is None:
+            self.log.error(f"Failed to generate \"{text}\" with {voice} (AcapellaGroup)")
+            return None
+
+        return self.convert(data, "mp3")
 
     def fifteen_ai(self, character, text):
         """
             Uses the 15ai api to generate voices using machine learning,
             check their website to see possible voices (case sensetive)
         """
-        fifteen = FifteenAPI()
-
-
         # 15ai does not support numbers (such as 1, 2, 3 etc)
         # Therefor we convert numbers<int> to actual words first
         self.log.info(f"Generate \"{text}\" with {character} (15ai)")
-        tts = fifteen.get_tts_raw(character, re.sub("[0-9]+", lambda num:self.numbers_to_words(int(num.group(0))), text))
+        tts = self.fifteen.get_tts_raw(character, re.sub("[0-9]+", lambda num:self.numbers_to_words(int(num.group(0))), text))
 
         if tts["status"] == "OK" and tts["data"] is not None:
             self.log.info(f"Got {len(tts['data'])} bytes from fifteen.ai")
 
-            # 15ai returns the data as float32 wav, so we use sox
-            # to convert this to "signed 16-bit little endian PCM so
-            # that we can play it with pydub
-            
-            cacheFile = os.path.join(self.soundboard.config['speech']['cache'], "tmp15ai32.wav")
-            cacheFileOutput = os.path.join(self.soundboard.config['speech']['cache'], "tmp15ai16.wav")
-
-            with open(cacheFile, "wb") as fout:
-                fout.write(tts["data"])
-
-            self.convert_bitdepth_sox(cacheFile, cacheFileOutput)
-            #self.soundboard.samplePlayer.sampleQueue.put(cacheFileOutput)
-            return cacheFileOutput
+            # 15ai returns the data as float32 wav, convert it to
+            # signed 16-bit little endian PCM so that we can play it
+            return self.convert(tts["data"], "wav")
 
         self.log.error(f"Failed to generate \"{text}\" with {character} (15ai)")
-        return None, None
+        return None
 
     def numbers_to_words(self, num,join=True):
         """
@@ -187,24 +231,47 @@ class AcapelaGroup():
     """
         Based on https://github.com/weespin/WillFromAfarDownloader
     """
-    def __init__(self):
-        with open("acapellagroup.json", "r") as fin:
-            self.voices = json.load(fin)
+    voices = None
+    nonce_url = "https://acapelavoices.acapela-group.com/index/getnonce/"
+    synthesizer_url = "http://www.acapela-group.com:8080/webservices/1-34-01-Mobility/Synthesizer"
+
+    def __init__(self, nonce_ttl=600, transport=None):
+        if AcapelaGroup.voices is None:
+            with open("acapellagroup.json", "r") as fin:
+                AcapelaGroup.voices = {name.lower(): voice for name, voice in json.load(fin).items()}
+
+        self.transport = transport or ttstransport.transport("acapela")
+        self.nonce_ttl = nonce_ttl
+        self.nonce = (None, None)
+        self.nonce_expires = 0.0
+        self.nonce_lock = threading.Lock()
 
     def generate(self, voice, text) -> None:
-        token, email = self.update_nonce_token()
-        return self.get_file(self.get_sound_link(self.map_voice(voice), text, token, email))
+        token, email = self.cached_nonce_token()
+        if token is None:
+            return None
+
+        link = self.get_sound_link(self.map_voice(voice), text, token, email)
+        if link is None:
+            # The nonce might have expired early, get a new one next time
+            self.nonce_expires = 0.0
+            return None
+
+        return self.get_file(link)
 
     def map_voice(self, voice):
-        if voice in self.voices:
-            return self.voices[voice.lower()]
-        return voice
+        return self.voices.get(voice.lower(), voice)
 
     def get_file(self, url):
-        r = requests.get(url)
-        if r.status_code == 200:
-            return r.content
-        return None
+        return self.transport.download(url)
+
+    def cached_nonce_token(self):
+        """ Reuse the nonce until it expires instead of fetching one per utterance"""
+        with self.nonce_lock:
+            if time.monotonic() >= self.nonce_expires:
+                self.nonce = self.update_nonce_token()
+                self.nonce_expires = time.monotonic() + self.nonce_ttl if self.nonce[0] else 0.0
+            return self.nonce
 
     def return_fake_gmail(self):
         generatorString = string.ascii_letters + string.digits
@@ -213,8 +280,8 @@ class AcapelaGroup():
     def update_nonce_token(self):
         email = self.return_fake_gmail()
         data = {"googleid": email}
-        r = requests.post("https://acapelavoices.acapela-group.com/index/getnonce/", data=data)
         try:
+            r = self.transport.post(self.nonce_url, data=data)
             return r.json()['nonce'], email
         except:
             return None, None
@@ -226,10 +293,10 @@ class AcapelaGroup():
                 "req_text": urllib.parse.quote(text, safe=''),
                 "cl_env": "ACAPELA_VOICES", "prot_vers": "2",
                 "cl_app": "AcapelaGroup_WebDemo_Android"}
-        r = requests.post("http://www.acapela-group.com:8080/webservices/1-34-01-Mobility/Synthesizer", data=data)
+        r = self.transport.post(self.synthesizer_url, data=data)
         if r.status_code == 200:
             response = r.content.decode("utf-8")
-            return dict(parse.parse_qs(response))['snd_url'][0]
+            return dict(parse.parse_qs(response)).get('snd_url', [None])[0]
 
 
 class FifteenAPI:
@@ -255,7 +322,8 @@ class FifteenAPI:
     tts_url = "https://api.15.ai/app/getAudioFile5"
     audio_url = "https://cdn.15.ai/audio/"
 
-    def __init__(self, show_debug = False):
+    def __init__(self, show_debug = False, transport=None):
+        self.transport = transport or ttstransport.transport("15ai")
         if show_debug:
             self.logger.setLevel(logging.DEBUG)
         else:
@@ -284,8 +352,8 @@ class FifteenAPI:
         self.logger.info('Waiting for 15.ai response...')
 
         try:
-            response = requests.post(self.tts_url, data=data, headers=self.tts_headers)
-        except requests.exceptions.ConnectionError as e:
+            response = self.transport.post(self.tts_url, data=data, headers=self.tts_headers)
+        except requests.exceptions.RequestException as e:
             resp["status"] = f"ConnectionError ({e})"
             self.logger.error(f"ConnectionError ({e})")
             return resp
@@ -295,12 +363,11 @@ class FifteenAPI:
             resp["audio_uri"] = resp["response"]["wavNames"][0]
 
             try:
-                responseAudio = requests.get(self.audio_url+resp["audio_uri"], headers=self.tts_headers)
-                resp["status"] = "OK"
-                resp["data"] = responseAudio.content
+                resp["data"] = self.transport.download(self.audio_url+resp["audio_uri"], headers=self.tts_headers)
+                resp["status"] = "OK" if resp["data"] is not None else "Download failed"
                 self.logger.info(f"15.ai API response success")
                 return resp
-            except requests.exceptions.ConnectionError as e:
+            except requests.exceptions.RequestException as e:
                 resp["status"] = f"ConnectionError ({e})"
                 self.logger.error(f"ConnectionError ({e})")
                 return resp
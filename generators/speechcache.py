@@ -0,0 +1,177 @@
+import os
+import re
+import json
+import time
+import wave
+import logging
+import threading
+
+from soundboard import metrics
+from soundboard.samplecache import sampleCache
+
+INDEX_FILE = "index.json"
+KEY = re.compile(r"[0-9a-f]{40}") # speechGenerator.hashtext
+
+class speechCache():
+    """
+        Keeps generated speech on disk within a byte budget. A persistent
+        index records voice, method, size, hits and when an entry was last
+        played so that the least recently played entries are evicted first.
+        The phrases that are played most often are also kept as decoded
+        PCM in memory.
+    """
+    log = logging.getLogger("Speech Cache")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config['speech']
+        self.path = config['cache']
+        self.max_bytes = int(config.get('cache_size', 256) * 1024 * 1024)
+        self.hot_hits = config.get('hot_hits', 3)
+        self.memory = sampleCache(lambda path: self.soundboard.samplePlayer.decode(path),
+            int(config.get('memory_size', 16) * 1024 * 1024))
+
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_save = 0.0
+        self.entries = self.load()
+
+        metrics.REGISTRY.collector(metrics.cache_collector("speech", self.stats))
+        metrics.REGISTRY.collector(metrics.cache_collector("speech_memory", self.memory.stats))
+
+    def file(self, key:str) -> str:
+        return os.path.join(self.path, f"{key}.wav")
+
+    def load(self) -> dict:
+        """ Load the index and adopt cached speech that isn't in it"""
+        os.makedirs(self.path, exist_ok=True)
+
+        try:
+            with open(os.path.join(self.path, INDEX_FILE), "r") as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            entries = {}
+
+        entries = {key: entry for key, entry in entries.items() if os.path.exists(self.file(key))}
+
+        for file in os.listdir(self.path):
+            key, ext = os.path.splitext(file)
+            # The directory may be shared, only wavs named like a key are ours
+            if ext == ".wav" and key not in entries and KEY.fullmatch(key):
+                entries[key] = self.file_entry(key)
+
+        self.log.info(f"{len(entries)} cached speech files")
+        return entries
+
+    def save(self, force:bool=True) -> None:
+        """ Write the index, hits are only written every few seconds"""
+        with self.lock:
+            if not force and time.time() - self.last_save < 10:
+                return
+
+            index = os.path.join(self.path, INDEX_FILE)
+            with open(f"{index}.tmp", "w") as f:
+                json.dump(self.entries, f)
+            os.replace(f"{index}.tmp", index)
+            self.last_save = time.time()
+
+    def size(self) -> int:
+        return sum(entry['bytes'] for entry in self.entries.values())
+
+    def file_entry(self, key:str) -> dict:
+        """ Index entry for a file that was cached without the index"""
+        stat = os.stat(self.file(key))
+        return {"voice": None, "method": None, "bytes": stat.st_size,
+                "created": stat.st_mtime, "last_played": stat.st_mtime, "hits": 0}
+
+    def contains(self, key:str) -> bool:
+        return os.path.exists(self.file(key))
+
+    def lookup(self, key:str):
+        """ Return the cached speech as PCM or path, None when it isn't cached"""
+        with self.lock:
+            if not os.path.exists(self.file(key)):
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            if (entry := self.entries.get(key)) is None:
+                # Cached by another process, like the prerender command
+                entry = self.entries[key] = self.file_entry(key)
+
+            self.hits += 1
+            entry['hits'] += 1
+            entry['last_played'] = time.time()
+            self.save(force=False)
+
+        if entry['hits'] >= self.hot_hits:
+            return self.memory.get(self.file(key))
+
+        return self.file(key)
+
+    def gain(self, key:str) -> float:
+        """ The loudness gain of cached speech, measured the first time it's played"""
+        path = self.file(key)
+        try:
+            if (analysis := self.soundboard.loudness.lookup(path)) is None:
+                with wave.open(path, "rb") as f:
+                    analysis = self.soundboard.loudness.analyse(path, f.readframes(f.getnframes()))
+        except (FileNotFoundError, wave.Error) as e:
+            self.log.warning(f"Couldn't measure {key} ({e})")
+            return 1.0
+
+        return self.soundboard.loudness.gain(analysis)
+
+    def store(self, key:str, pcm:bytes, voice:str, method:str) -> str:
+        """ Write generated PCM to the cache, returns its path"""
+        cached = self.file(key)
+
+        with wave.open(f"{cached}.tmp", "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(44100)
+            f.writeframes(pcm)
+
+        # Rename is atomic, a file that's being played is never half written
+        os.replace(f"{cached}.tmp", cached)
+        self.memory.invalidate(cached)
+
+        with self.lock:
+            now = time.time()
+            self.entries[key] = {"voice": voice, "method": method, "bytes": os.path.getsize(cached),
+                                 "created": now, "last_played": now, "hits": 0}
+            self.evict(keep=key)
+            self.save()
+
+        return cached
+
+    def evict(self, keep:str=None) -> None:
+        """ Remove the least recently played entries until we're within budget"""
+        with self.lock:
+            size = self.size()
+            for key in sorted(self.entries, key=lambda k: self.entries[k]['last_played']):
+                if size <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+
+                self.log.info(f"Evicting {key} from the speech cache")
+                size -= self.entries.pop(key)['bytes']
+                self.memory.invalidate(self.file(key))
+                self.evictions += 1
+
+                try:
+                    os.remove(self.file(key))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": self.size(),
+                    "max_bytes": self.max_bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0,
+                    "memory": self.memory.stats()}
@@ -0,0 +1,107 @@
+import json
+import queue
+import logging
+import threading
+
+from concurrent.futures import Future
+
+from soundboard import metrics
+
+class speechPool():
+    """
+        Generates speech on a fixed amount of worker threads with a bounded
+        queue. Requests for the same (method, name, text) and cache options
+        that are already queued or being generated share that generation
+        instead of hitting the TTS service again.
+    """
+    log = logging.getLogger("Speech Pool")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        self.workers = self.soundboard.config['speech'].get('workers', 2)
+        self.jobQueue = queue.Queue(maxsize=self.soundboard.config['speech'].get('queue_depth', 16))
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+        metrics.REGISTRY.collector(self.collect)
+
+    def submit(self, method:str, name:str, text:str, cache:bool=True, regenCache:bool=False, play:bool=True) -> Future:
+        """ Queue speech, returns a future with the result or None when the queue is full"""
+        # A regenCache request can't be served by a render that used the cache
+        key = (method, name, text, cache, regenCache)
+
+        with self.lock:
+            if key in self.inflight:
+                self.coalesced += 1
+                future = self.inflight[key]
+            else:
+                future = Future()
+                try:
+                    self.jobQueue.put_nowait((key, future))
+                except queue.Full:
+                    self.rejected += 1
+                    self.log.warning(f"Speech queue is full, dropping \"{text}\" ({method})")
+                    return None
+
+                self.inflight[key] = future
+                self.submitted += 1
+
+        if play:
+            future.add_done_callback(lambda future: self.play(future, text))
+
+        return future
+
+    def play(self, future:Future, text:str=None) -> None:
+        if future.exception() is None and (speech := future.result()) is not None:
+            self.soundboard.scheduler.submit(speech.audio, "speech", name=text, gain=speech.gain)
+
+    def worker_thread(self) -> None:
+        while True:
+            key, future = self.jobQueue.get()
+
+            try:
+                result = self.soundboard.speech.generate(*key)
+                self.completed += 1
+            except Exception as e:
+                self.log.error(f"Failed to generate speech {key} ({e})")
+                self.failed += 1
+                result = None
+
+            with self.lock:
+                del self.inflight[key]
+
+            future.set_result(result)
+
+    def register_mqtt(self, router) -> None:
+        router.register("soundboard/speech/#", self.mqtt_trigger)
+
+    def mqtt_trigger(self, payload:str) -> None:
+        """
+            Takes a json dict with the following parameters
+             {"method": "15ai", "text": "Hello World", "name": "GlaDOS"}
+            and optionally cache and regenCache
+        """
+        payload = json.loads(payload)
+        if "method" in payload and "text" in payload and "name" in payload:
+            self.submit(payload['method'], payload['name'], payload['text'],
+                bool(payload.get('cache', True)), bool(payload.get('regenCache', False)))
+
+    def collect(self) -> list:
+        stats = self.stats()
+        return [("soundboard_speech_queue_depth", "gauge", "Speech waiting for a worker", [({}, stats['queue_depth'])])] + \
+               [(f"soundboard_speech_{key}_total", "counter", f"Speech requests {key}", [({}, stats[key])])
+                for key in ("submitted", "coalesced", "rejected", "completed", "failed")]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"workers": self.workers, "queue_depth": self.jobQueue.qsize(),
+                    "queue_size": self.jobQueue.maxsize, "inflight": len(self.inflight),
+                    "submitted": self.submitted, "coalesced": self.coalesced,
+                    "rejected": self.rejected, "completed": self.completed,
+                    "failed": self.failed}
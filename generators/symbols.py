@@ -0,0 +1,100 @@
+import numpy
+import logging
+
+from generators.synth import RATE, oscillator, to_stereo
+
+DTMF_FREQS = {'1': (1209, 697), '2': (1336, 697), '3': (1477, 697), 'A': (1633, 697),
+              '4': (1209, 770), '5': (1336, 770), '6': (1477, 770), 'B': (1633, 770),
+              '7': (1209, 852), '8': (1336, 852), '9': (1477, 852), 'C': (1633, 852),
+              '*': (1209, 941), '0': (1336, 941), '#': (1477, 941), 'D': (1633, 941)}
+
+MORSE_CODE = {'A': '.-', 'B': '-...', 'C': '-.-.', 'D': '-..', 'E': '.', 'F': '..-.',
+              'G': '--.', 'H': '....', 'I': '..', 'J': '.---', 'K': '-.-', 'L': '.-..',
+              'M': '--', 'N': '-.', 'O': '---', 'P': '.--.', 'Q': '--.-', 'R': '.-.',
+              'S': '...', 'T': '-', 'U': '..-', 'V': '...-', 'W': '.--', 'X': '-..-',
+              'Y': '-.--', 'Z': '--..', '0': '-----', '1': '.----', '2': '..---',
+              '3': '...--', '4': '....-', '5': '.....', '6': '-....', '7': '--...',
+              '8': '---..', '9': '----.', '.': '.-.-.-', ',': '--..--', '?': '..--..',
+              "'": '.----.', '!': '-.-.--', '/': '-..-.', '(': '-.--.', ')': '-.--.-',
+              '&': '.-...', ':': '---...', ';': '-.-.-.', '=': '-...-', '+': '.-.-.',
+              '-': '-....-', '_': '..--.-', '"': '.-..-.', '$': '...-..-', '@': '.--.-.'}
+
+def encode_morse(text:str) -> str:
+    """
+        Encode text as morse, letters are separated by a space and words
+        by a slash. Text that already is morse is returned as is.
+    """
+    text = " ".join(text.split())
+    if text and set(text) <= set(".-/ "):
+        return text
+
+    return " / ".join(" ".join(MORSE_CODE[char] for char in word if char in MORSE_CODE)
+                      for word in text.upper().split(" "))
+
+class symbolBank():
+    """
+        DTMF digits and morse symbols rendered once as faded s16 stereo
+        buffers. A sequence is a list of views on those buffers which the
+        mixer plays back to back, so nothing is synthesized per message.
+    """
+    log = logging.getLogger("Symbol Bank")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('tones', {})
+        dtmf = config.get('dtmf', {})
+        morse = config.get('morse', {})
+
+        self.fade = dtmf.get('fade', 200)
+        self.dtmf = {digit: self.render([low, high], dtmf.get('length', 0.2), dtmf.get('amplitude', 0.25))
+                     for digit, (low, high) in DTMF_FREQS.items()}
+        self.dtmf_gap = self.silence(dtmf.get('gap', 0.05))
+
+        unit = morse.get('unit', 0.1)
+        freq = morse.get('freq', 440)
+        amplitude = morse.get('amplitude', 0.5)
+        self.morse = {".": self.render([freq], unit, amplitude),
+                      "-": self.render([freq], unit * 3, amplitude)}
+
+        self.symbol_gap = self.silence(unit)
+        self.letter_gap = self.silence(unit * 3)
+        self.word_gap = self.silence(unit * 7)
+
+    def render(self, freqs:list, length:float, amplitude:float) -> numpy.ndarray:
+        """ Render the average of sines with a fade in and out"""
+        frames = int(length * RATE)
+        signal = sum(oscillator("sine", freq, frames) for freq in freqs) / len(freqs) * amplitude
+
+        fade = min(self.fade, frames // 2)
+        signal[:fade] *= numpy.linspace(0.0, 1.0, fade, endpoint=False, dtype=numpy.float32)
+        signal[frames - fade:] *= numpy.linspace(1.0, 0.0, fade, endpoint=False, dtype=numpy.float32)
+        return to_stereo(signal)
+
+    def silence(self, length:float) -> numpy.ndarray:
+        return numpy.zeros((int(length * RATE), 2), dtype=numpy.int16)
+
+    def dtmf_sequence(self, digits:str) -> list:
+        """ Return the buffers for a string of DTMF digits, other characters are skipped"""
+        sequence = []
+        for digit in str(digits).upper():
+            if digit in self.dtmf:
+                sequence += [self.dtmf_gap, self.dtmf[digit]] if sequence else [self.dtmf[digit]]
+
+        return sequence
+
+    def morse_sequence(self, text:str) -> list:
+        """ Return the buffers for text or morse code"""
+        sequence = []
+        gap = None
+
+        for word in encode_morse(text).split("/"):
+            for letter in word.split():
+                for symbol in letter:
+                    if gap is not None:
+                        sequence.append(gap)
+                    sequence.append(self.morse[symbol])
+                    gap = self.symbol_gap
+                gap = self.letter_gap if gap is not None else None
+            gap = self.word_gap if gap is not None else None
+
+        return sequence
@@ -0,0 +1,83 @@
+import numpy
+import logging
+
+from tones import SINE_WAVE, SAWTOOTH_WAVE, TRIANGLE_WAVE, SQUARE_WAVE
+
+from soundboard import metrics
+from soundboard.samplecache import pcmCache
+
+RATE = 44100
+
+# The tones library constants are accepted as well as names
+WAVES = {"sine": "sine", "saw": "saw", "triangle": "triangle", "square": "square",
+         SINE_WAVE: "sine", SAWTOOTH_WAVE: "saw", TRIANGLE_WAVE: "triangle", SQUARE_WAVE: "square"}
+
+def shape(wave, cycles:numpy.ndarray) -> numpy.ndarray:
+    """ Turn a running phase in cycles into a waveform between -1.0 and 1.0"""
+    wave = WAVES[wave]
+    if wave == "sine":
+        signal = numpy.sin(2 * numpy.pi * cycles)
+    elif wave == "square":
+        signal = numpy.where(numpy.sin(2 * numpy.pi * cycles) > 0, 1.0, -1.0)
+    elif wave == "triangle":
+        signal = 1.0 - 4.0 * numpy.abs(numpy.mod(cycles + 0.25, 1.0) - 0.5)
+    else:
+        signal = 2.0 * (cycles - numpy.floor(cycles + 0.5))
+
+    return signal
+
+def oscillator(wave, freq:float, frames:int, rate:int=RATE, phase:float=0.0) -> numpy.ndarray:
+    """ Render a waveform as float32, phase is in cycles"""
+    cycles = phase + numpy.arange(frames, dtype=numpy.float64) * (float(freq) / rate)
+    return shape(wave, cycles).astype(numpy.float32)
+
+def envelope(frames:int, attack:float=None, decay:float=None, rate:int=RATE) -> numpy.ndarray:
+    """ Linear attack and decay ramps, like tones.mixer applies them"""
+    env = numpy.ones(frames, dtype=numpy.float32)
+
+    if attack and (length := min(int(attack * rate), frames)):
+        env[:length] = numpy.arange(length, dtype=numpy.float32) / length
+
+    if decay and (length := min(int(decay * rate), frames)):
+        env[frames - length:] *= numpy.arange(length, 0, -1, dtype=numpy.float32) / length - 1 / length
+
+    return env
+
+def to_stereo(signal:numpy.ndarray) -> numpy.ndarray:
+    """ Float mono to s16 stereo frames, the format of the pulseaudio stream"""
+    samples = (numpy.clip(signal, -1.0, 1.0) * 32767).astype(numpy.int16)
+    return numpy.repeat(samples, 2).reshape(-1, 2)
+
+def to_pcm(signal:numpy.ndarray) -> bytes:
+    return to_stereo(signal).tobytes()
+
+class toneSynth():
+    """
+        Renders tones with NumPy in one pass instead of sample by sample.
+        Rendered tones are kept in an LRU cache keyed by everything that
+        shapes them, so a tone that is played again costs nothing.
+    """
+    log = logging.getLogger("Tone Synth")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('tones', {})
+        self.cache = pcmCache(int(config.get('cache_size', 8) * 1024 * 1024))
+        metrics.REGISTRY.collector(metrics.cache_collector("tones", self.cache.stats))
+
+    def render(self, wave, freq:float, duration:float, amplitude:float=1.0,
+               attack:float=None, decay:float=0.1) -> numpy.ndarray:
+        """ Render a tone as float32 mono"""
+        frames = int(duration * RATE)
+        return oscillator(wave, freq, frames) * envelope(frames, attack, decay) * amplitude
+
+    def tone(self, wave, freq:float, duration:float, amplitude:float=1.0,
+             attack:float=None, decay:float=0.1) -> bytes:
+        """ Return a tone as s16 stereo PCM, from the cache when possible"""
+        key = (WAVES[wave], float(freq), float(duration), float(amplitude), attack, decay)
+
+        if (pcm := self.cache.get(key)) is None:
+            pcm = to_pcm(self.render(wave, freq, duration, amplitude, attack, decay))
+            self.cache.put(key, pcm)
+
+        return pcm
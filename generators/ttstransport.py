@@ -0,0 +1,62 @@
+import logging
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class ttsTransport():
+    """
+        A pooled HTTP session for a TTS backend. Connections (and their
+        TLS sessions) are reused between utterances, every request has a
+        timeout and failed connections or 5xx responses are retried with
+        an exponential backoff.
+    """
+    log = logging.getLogger("TTS Transport")
+
+    def __init__(self, name:str, timeout:float=10.0, retries:int=2, backoff:float=0.3, pool_size:int=4) -> None:
+        self.name = name
+        self.timeout = timeout
+        self.requests = 0
+
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method:str, url:str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        self.requests += 1
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url:str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url:str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def download(self, url:str, chunk_size:int=64 * 1024, **kwargs) -> bytes:
+        """ Stream a file into a single buffer, returns None on errors"""
+        with self.request("GET", url, stream=True, **kwargs) as r:
+            if r.status_code != 200:
+                self.log.error(f"Download of {url} failed ({r.status_code})")
+                return None
+
+            data = bytearray()
+            for chunk in r.iter_content(chunk_size):
+                data += chunk
+
+            return bytes(data)
+
+transports = {}
+transports_lock = threading.Lock()
+
+def transport(name:str, **kwargs) -> ttsTransport:
+    """ Return the shared transport for a backend"""
+    with transports_lock:
+        if name not in transports:
+            transports[name] = ttsTransport(name, **kwargs)
+        return transports[name]
@@ -12,18 +12,18 @@
   </header>
     <h3>Upload samples</h3><br>
     <p class="fs-5">
-        {% if alert is defined %}
-            <div class="alert {{alert['type']}} role="alert">{{alert['msg']}}</div>
-        {% endif %}
+        {% for alert in alerts | default([]) %}
+            <div class="alert {{alert['type']}}" role="alert">{{alert['msg']}}</div>
+        {% endfor %}
         <form action="" enctype="multipart/form-data" method="POST">
             <p>Note that files should have no space in them, the name of the file corresponds to how it's being played and triggered.<br>
             Spaces will be automatically replaced with a underscore.    </p>
             <div class="input-group">
-                <input type="file" class="form-control"  name="sampleUpload" id="sampleUpload" aria-describedby="sampleUpload" aria-label="Upload">
+                <input type="file" class="form-control"  name="sampleUpload" id="sampleUpload" multiple aria-describedby="sampleUpload" aria-label="Upload">
                 <button class="btn btn-outline-secondary" type="submit" id="sampleSubmit">Upload</button>
               </div>
             <p>
-                <font color="red">*</font> Accepted formats are: wav, mp3, ogg, flac and the file limit is 5 MB.
+                <font color="red">*</font> Accepted formats are: {{extensions}}, files can be at most {{max_size}} and up to {{max_files}} can be uploaded at once.
             </p>
         </form>
     </p>
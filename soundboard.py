@@ -1,7 +1,5 @@
-import os
-import re
+import queue
 import yaml
-import json
 import logging
 import threading
 import tracemalloc
@@ -10,12 +8,24 @@ import paho.mqtt.client as mqtt
 
 import soundboard.mpdclient
 import soundboard.webserver
+import soundboard.catalogue
 import soundboard.themesongs
-import soundboard.pulseaudio
+import soundboard.output
+import soundboard.sampleindex
+import soundboard.ingest
+import soundboard.loudness
+import soundboard.samplebank
+import soundboard.mixer
+import soundboard.ducking
+import soundboard.mqttrouter
+import soundboard.scheduler
 
 import generators.samples
 import generators.tones
 import generators.speech
+import generators.speechpool
+import generators.speechcache
+import generators.prerender
 import generators.door
 
 # TODO:
@@ -26,27 +36,48 @@ import generators.door
 class soundBoard():
     log = logging.getLogger("Soundboard")
     threads = {}
-    playlock = threading.Lock()
     samplePlaying = None
     running = False
 
-    def __init__(self) -> None:
-        self.load_config()
+    def __init__(self, config:dict=None, pulse=None) -> None:
+        """ config and pulse (an output backend) can be given to run without config.yml or a pulseaudio daemon"""
+        if config is None:
+            self.load_config()
+        else:
+            self.config = config
+
         self.mqtt = mqtt.Client()
-        self.pulse = soundboard.pulseaudio.pulseaudio()
+        self.pulse = pulse or soundboard.output.open_output(self.config.get('output', {}))
+        self.mixer = soundboard.mixer.mixer(self)
+        self.sampleIndex = soundboard.sampleindex.sampleIndex(self)
+        self.loudness = soundboard.loudness.loudnessIndex(self)
+        self.ingest = soundboard.ingest.sampleIngest(self)
+        self.sampleBank = soundboard.samplebank.sampleBank(self)
+        self.catalogue = soundboard.catalogue.sampleCatalogue(self)
+        self.log.info(f"Samples available: {len(self.sampleIndex.files('samples'))}")
 
         self.mpd = soundboard.mpdclient.mpdclient(self)
+        self.ducking = soundboard.ducking.duckingController(self)
+        self.scheduler = soundboard.scheduler.playbackScheduler(self)
         self.themeSongs = soundboard.themesongs.themeSongs(self)
-        self.webserver = soundboard.webserver.webserver("0.0.0.0", self.config['webserver'], self)
+        webserver = self.config['webserver'] if isinstance(self.config['webserver'], dict) else {"port": self.config['webserver']}
+        self.webserver = soundboard.webserver.webserver(webserver.get('host', "0.0.0.0"), webserver['port'], self)
 
         self.speech = generators.speech.speechGenerator(self)
+        self.speechPool = generators.speechpool.speechPool(self)
         self.samplePlayer = generators.samples.samplePlayer(self)
+        self.speechCache = generators.speechcache.speechCache(self)
+        self.speechPrerender = generators.prerender.speechPrerender(self)
         self.toneGenerator = generators.tones.toneGenerator(self)
         self.door = generators.door.door(self)
 
-        self.mqtt.enable_logger(logging.getLogger("MQTT"))
-        self.mqtt.connect(self.config['mqtt']['host'], self.config['mqtt']['port'], 60)
+        self.router = soundboard.mqttrouter.mqttRouter()
+        for subsystem in (self.themeSongs, self.door, self.speechPool, self.samplePlayer, self.toneGenerator):
+            subsystem.register_mqtt(self.router)
+        self.router.register("soundboard/stop", lambda payload: self.log.info(f"Stopped playback ({self.stop()})"))
+        self.router.register("soundboard/skip", lambda payload: self.log.info(f"Skipped playback ({self.skip()})"))
 
+        self.mqtt.enable_logger(logging.getLogger("MQTT"))
         self.mqtt.on_connect = self.on_mqtt_connect
         self.mqtt.on_message = self.on_mqtt_message
 
@@ -55,23 +86,36 @@ class soundBoard():
         with open("config.yml", "r") as f:
             self.config = yaml.load(f, Loader=yaml.FullLoader)
 
-        self.log.info(f"Samples available: {len(os.listdir(self.config['sample_path']))}")
-
     def start(self) -> None:
         """ Start the threads and then use the main thread for the MQTT loop"""
+        self.start_threads()
+        self.mqtt.connect(self.config['mqtt']['host'], self.config['mqtt']['port'], 60)
+        self.mqtt.loop_forever()
+
+    def start_threads(self, webserver:bool=True) -> None:
+        """ Start everything except the MQTT loop"""
         self.threads = {
             threading.Thread(name="Webserver", target=self.webserver.webserver_thread),
+            threading.Thread(name="Mixer", target=self.mixer.mix_thread),
+            threading.Thread(name="Ducking", target=self.ducking.ducking_thread),
             threading.Thread(name="Sample Thread", target=self.samplePlayer.sample_thread),
-            threading.Thread(name="Tone Thread", target=self.toneGenerator.tone_thread)
-            }
+            threading.Thread(name="Tone Thread", target=self.toneGenerator.tone_thread),
+            threading.Thread(name="Sample Index", target=self.sampleIndex.index_thread),
+            threading.Thread(name="Ingest", target=self.ingest.ingest_thread),
+            threading.Thread(name="Loudness", target=self.loudness.analysis_thread),
+            threading.Thread(name="Sample Bank", target=self.sampleBank.bank_thread)
+            } | {threading.Thread(name=f"Speech {i}", target=self.speechPool.worker_thread)
+                for i in range(self.speechPool.workers)}
 
         for thread in self.threads:
+            if thread.name == "Webserver" and not webserver:
+                continue
+
             self.log.debug(thread)
             thread.daemon = True
             thread.start()
 
         self.log.debug(self.threads)
-        self.mqtt.loop_forever()
 
     def on_mqtt_connect(self, client:mqtt.Client, userdata:any, flags:dict, rc:int) -> None:
         """ When we succesfully connected to MQTT, we can subscribe"""
@@ -95,76 +139,29 @@ class soundBoard():
             self.log.error(f"Error during on_mqtt_message: {e}")
             traceback.print_exc()
 
+    def stop(self) -> float:
+        """ Stop everything that is playing or queued, returns the stop latency"""
+        self.scheduler.clear()
+        try:
+            while True:
+                self.toneGenerator.toneQueue.get_nowait()
+        except queue.Empty:
+            pass
+
+        return self.mixer.stop()
+
+    def skip(self) -> float:
+        """ Skip the sound that is playing, returns the stop latency"""
+        return self.mixer.skip()
+
     def find_sample(self, sample_name: str) -> None:
         """ Search in the sample folder and return a sample if found"""
-        for file in os.listdir(self.config['sample_path']):
-            if re.search(sample_name, file, re.IGNORECASE):
-                return os.path.join(self.config['sample_path'], file)
+        return self.sampleIndex.find("samples", sample_name)
 
     def on_mqtt_message_handle(self, client:mqtt.Client, userdata:any, msg: mqtt.MQTTMessage) -> None:
         """ Handle MQTT message events"""
-        self.log.debug(f"MQTT {msg.topic} >> {msg.payload.decode('utf-8')}")
-
-        if msg.topic == "space/door/front": # send to themesongs
-            self.themeSongs.mqtt_trigger(msg.payload.decode("utf-8"))
-
-        if msg.topic == "deurbel":
-            self.door.doorbell_mqtt_trigger(msg.payload.decode("utf-8"))
-        
-        if msg.topic == "door/door_closed":
-            self.door.door_mqtt_trigger(msg.payload.decode("utf-8"))
-
-        # Handle all the speech events
-        # Takes a json dict with the following parameters
-        #  {"method": "15ai", "text": "Hello World", "name": "GlaDOS"}
-        if msg.topic.startswith("soundboard/speech"):
-            payload = json.loads(msg.payload.decode("utf-8"))
-            if "method" in payload and "text" in payload and "name" in payload:
-                # Allow these options to not be required
-                regenCache = False
-                cache = True
-
-                if "cache" in payload:
-                    cache = bool(payload['cache'])
-                if "regenCache" in payload:
-                    regenCache = bool(payload['cache'])
-
-                # Fire it off as a thread, speech samples should be played via
-                # the sampleQueue or if needed, by using the playlock
-                speechThread = threading.Thread(target=self.speech.speech,
-                    args=(payload['method'], payload['name'], payload['text'], None,
-                        cache, regenCache))
-                speechThread.daemon = True
-                speechThread.start()
-
-        # Handle incoming play
-        if msg.topic == "soundboard/play":
-            payload = msg.payload.decode("utf-8")
-
-            # Split playload by space to allow multiple sounds
-            for payload_split in payload.split(" "):
-
-                # Generate tone for example: 100hzsw0.1 will generate
-                # a 100 hz saw for 0.1 seconds (100hzsw or 100hz works too)
-                if freq_match := re.search("([0-9]+)hz", payload_split, re.IGNORECASE):
-                    tone = {"freq": freq_match.group(1), "type": "sine", "duration": 1.0}
-
-                    if wave_match := re.search("[0-9]+.hz(sw|si|tri|sq)", payload_split, re.IGNORECASE):
-                        tonemap = {"sw": "saw", "si": "sine", "tri": "triangle", "sq": "square"}
-                        tone['type'] = tonemap[wave_match.group(1)]
-
-                    if durr_match := re.search("[0-9]+.hz(sw|si|tri|sq)([0-9]+\.[0-9]+)", payload_split, re.IGNORECASE):
-                        duration = float(durr_match.group(2))
-                        if duration > 5.0:
-                            duration = 5.0
-                        tone['duration'] = duration
-                    
-                    # Disable the tone generator for now
-                    #self.toneGenerator.toneQueue.put(tone)
-
-                # Pay sample if we can find it
-                if sample := self.find_sample(payload_split):
-                    self.samplePlayer.sampleQueue.put(sample)
+        if not self.router.route(msg.topic, msg.payload):
+            self.log.debug(f"MQTT {msg.topic} has no handlers")
 
         self.running = True
 
@@ -0,0 +1,114 @@
+import os
+import gzip
+import time
+import bottle
+import hashlib
+import logging
+import mimetypes
+
+from email.utils import formatdate, parsedate_to_datetime
+from typing import NamedTuple
+
+# Only these are worth compressing, images and fonts already are
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+def etag_matches(etags:tuple) -> bool:
+    """ Whether If-None-Match of the request matches one of etags"""
+    if (match := bottle.request.headers.get("If-None-Match")) is None:
+        return False
+
+    tags = [tag.strip() for tag in match.split(",")]
+    tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+    return "*" in tags or any(etag in tags for etag in etags)
+
+class asset(NamedTuple):
+    body: bytes
+    gzipped: bytes # None when compressing doesn't pay off
+    content_type: str
+    etag: str
+    modified: float
+    last_modified: str
+
+class staticAssets():
+    """
+        Serves the files under the asset directories from memory. Every
+        file is read, hashed and gzipped once at startup, so a request is
+        a dict lookup: a 304 when the browser already has it, otherwise
+        the gzipped body when the browser accepts it.
+    """
+    log = logging.getLogger("Assets")
+
+    def __init__(self, roots:dict, max_age:int=604800, min_gzip:int=1024) -> None:
+        self.roots = roots
+        self.max_age = max_age
+        self.min_gzip = min_gzip
+        self.load()
+
+    def load(self) -> None:
+        """ (Re)read every asset from disk"""
+        assets = {}
+        start = time.monotonic()
+
+        for kind, root in self.roots.items():
+            for path, _, files in os.walk(root):
+                for file in files:
+                    full_path = os.path.join(path, file)
+                    assets[(kind, os.path.relpath(full_path, root).replace(os.sep, "/"))] = self.read(full_path)
+
+        self.assets = assets
+        self.log.info(f"Loaded {len(assets)} assets in {time.monotonic() - start:.3f}s, "
+                      f"{sum(a.gzipped is not None for a in assets.values())} gzipped")
+
+    def read(self, path:str) -> asset:
+        with open(path, "rb") as f:
+            body = f.read()
+
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+
+        gzipped = None
+        if len(body) >= self.min_gzip and content_type.startswith(COMPRESSIBLE):
+            gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gzipped) >= len(body):
+                gzipped = None
+
+        modified = int(os.path.getmtime(path))
+        return asset(body, gzipped, content_type, f'"{hashlib.sha1(body).hexdigest()[:20]}"',
+                     modified, formatdate(modified, usegmt=True))
+
+    def not_modified(self, item:asset, etag:str) -> bool:
+        """ Whether the browser's copy is still current, If-None-Match wins over If-Modified-Since"""
+        if "If-None-Match" in bottle.request.headers:
+            return etag_matches((etag, item.etag))
+
+        if (since := bottle.request.headers.get("If-Modified-Since")) is not None:
+            try:
+                return item.modified <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+
+        return False
+
+    def serve(self, kind:str, filepath:str):
+        if (item := self.assets.get((kind, filepath))) is None:
+            return bottle.HTTPError(404, "File does not exist.")
+
+        gzipped = item.gzipped is not None and "gzip" in bottle.request.headers.get("Accept-Encoding", "")
+        # The gzipped body is another representation, so it gets its own tag
+        etag = item.etag[:-1] + '-gz"' if gzipped else item.etag
+
+        headers = {"ETag": etag, "Last-Modified": item.last_modified,
+                   "Cache-Control": f"public, max-age={self.max_age}"}
+        if item.gzipped is not None:
+            headers["Vary"] = "Accept-Encoding"
+
+        if self.not_modified(item, etag):
+            return bottle.HTTPResponse(status=304, **headers)
+
+        body = item.gzipped if gzipped else item.body
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+
+        return bottle.HTTPResponse(body, status=200, Content_Type=item.content_type,
+                                   Content_Length=str(len(body)), **headers)
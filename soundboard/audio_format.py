@@ -1,6 +1,7 @@
 """Helper functions for working with audio files in NumPy."""
 """some code borrowed from https://github.com/mgeier/python-audio/blob/master/audio-files/utility.py"""
 """https://gist.github.com/HudsonHuang/fbdf8e9af7993fe2a91620d3fb86a182"""
+import io
 import numpy as np
 import contextlib
 #import librosa
@@ -79,6 +80,35 @@ def float2pcm(sig, dtype='int16'):
     offset = i.min + abs_max
     return (sig * abs_max + offset).clip(i.min, i.max).astype(dtype)
 
+def resample(sig, from_rate, to_rate):
+    """Resample a (frames, channels) float signal with linear interpolation."""
+    if from_rate == to_rate or len(sig) == 0:
+        return sig
+
+    frames = int(round(len(sig) * to_rate / from_rate))
+    positions = np.arange(frames) * (from_rate / to_rate)
+    source = np.arange(len(sig))
+    return np.stack([np.interp(positions, source, sig[:, c]) for c in range(sig.shape[1])],
+                    axis=1).astype(sig.dtype)
+
+def to_channels(sig, channels):
+    """Up- or downmix a (frames, channels) signal."""
+    if sig.shape[1] == channels:
+        return sig
+    if sig.shape[1] == 1:
+        return np.repeat(sig, channels, axis=1)
+    return np.repeat(sig.mean(axis=1, keepdims=True), channels, axis=1)
+
+def decode_to_pcm(data, rate=44100, channels=2):
+    """Decode an audio file held in memory to interleaved s16 PCM.
+    The signal is resampled to *rate* and mixed to *channels*, its level
+    is left alone, loudness is applied when it's played like for samples.
+    Raises RuntimeError when libsndfile can't decode the data.
+    """
+    sig, sig_rate = soundfile.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    sig = to_channels(resample(sig, sig_rate, rate), channels)
+    return float_to_byte(sig)
+
 @contextlib.contextmanager
 def printoptions(*args, **kwargs):
     """Context manager for temporarily setting NumPy print options.
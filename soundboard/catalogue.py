@@ -0,0 +1,100 @@
+import time
+import bisect
+import logging
+import threading
+
+from typing import NamedTuple
+
+class catalogueSnapshot(NamedTuple):
+    version: int
+    etag: str
+    samples: list # Sorted by filename like sampleIndex.files
+    by_name: dict
+    lowered: list # Lowercase names, in the order of samples
+    keys: list # Sorted (lowercase name, position) for prefix searches
+    memo: dict # Search results and resolved names of this version
+
+class sampleCatalogue():
+    """
+        The sample listing the web interface and API work on. It is only
+        rebuilt when the version of the sample index changes, in between
+        names resolve with a dict lookup, prefixes with a bisect and the
+        results of substring searches are remembered.
+    """
+    log = logging.getLogger("Catalogue")
+
+    def __init__(self, soundboard, key:str="samples") -> None:
+        self.soundboard = soundboard
+        self.key = key
+        self.lock = threading.Lock()
+        # Versions restart at 0, keep ETags of an earlier run from matching
+        self.boot = f"{int(time.time()):x}"
+        self.snapshot = self.build(self.soundboard.sampleIndex.version)
+
+    def build(self, version:int) -> catalogueSnapshot:
+        samples = self.soundboard.sampleIndex.files(self.key)
+        lowered = [sample['name'].lower() for sample in samples]
+        by_name = {}
+        for sample in samples:
+            by_name.setdefault(sample['name'], sample)
+
+        self.log.debug(f"Built catalogue version {version} with {len(samples)} samples")
+        return catalogueSnapshot(version, f'"{self.boot}-{version}"', samples, by_name, lowered,
+                                 sorted((name, i) for i, name in enumerate(lowered)), {})
+
+    def current(self) -> catalogueSnapshot:
+        """ Return the catalogue, rebuilding it when the sample index changed"""
+        version = self.soundboard.sampleIndex.version
+        if self.snapshot.version != version:
+            with self.lock:
+                if self.snapshot.version != version:
+                    self.snapshot = self.build(version)
+
+        return self.snapshot
+
+    def search(self, prefix:str="", query:str="") -> list:
+        """ Return the samples whose name starts with prefix and contains query, case insensitive"""
+        snapshot = self.current()
+        prefix, query = prefix.lower(), query.lower()
+        if not prefix and not query:
+            return snapshot.samples
+
+        if (found := snapshot.memo.get(("search", prefix, query))) is not None:
+            return found
+
+        if prefix:
+            start = bisect.bisect_left(snapshot.keys, (prefix,))
+            end = bisect.bisect_left(snapshot.keys, (prefix + "\U0010ffff",), start)
+            positions = sorted(i for _, i in snapshot.keys[start:end])
+        else:
+            positions = range(len(snapshot.samples))
+
+        found = [snapshot.samples[i] for i in positions if query in snapshot.lowered[i]]
+        self.remember(snapshot, ("search", prefix, query), found)
+        return found
+
+    def page(self, offset:int=0, limit:int=None, prefix:str="", query:str="") -> dict:
+        """ A page of the search results, all of them when limit is None"""
+        found = self.search(prefix, query)
+        end = len(found) if limit is None else offset + limit
+        return {"samples": found[offset:end], "total": len(found), "offset": offset, "limit": limit}
+
+    def resolve(self, name:str) -> dict:
+        """
+            Return the sample called name, or like before the first one
+            whose name contains it
+        """
+        snapshot = self.current()
+        if (sample := snapshot.by_name.get(name)) is not None:
+            return sample
+
+        lookup = ("resolve", name)
+        if lookup not in snapshot.memo:
+            self.remember(snapshot, lookup, next((s for s in snapshot.samples if name in s['name']), None))
+
+        return snapshot.memo[lookup]
+
+    def remember(self, snapshot:catalogueSnapshot, key:tuple, value) -> None:
+        if len(snapshot.memo) >= 1024:
+            snapshot.memo.clear()
+        snapshot.memo[key] = value
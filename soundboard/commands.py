@@ -0,0 +1,32 @@
+import re
+
+from typing import NamedTuple, Union
+
+# 100hz, 100hzsw or 100hzsw0.1 for a 100 hz saw for 0.1 seconds
+TONE_TOKEN = re.compile(r"([0-9]+)hz(?:(sw|si|tri|sq)([0-9]+\.[0-9]+)?)?", re.IGNORECASE)
+TONE_WAVES = {"sw": "saw", "si": "sine", "tri": "triangle", "sq": "square"}
+MAX_TONE_DURATION = 5.0
+
+class toneCommand(NamedTuple):
+    wave: str
+    freq: float
+    duration: float
+
+    def as_tone(self) -> dict:
+        """ The tone as the toneGenerator queues it"""
+        return {"type": self.wave, "freq": self.freq, "duration": self.duration}
+
+class sampleCommand(NamedTuple):
+    name: str
+
+def parse_token(token:str) -> Union[toneCommand, sampleCommand]:
+    if match := TONE_TOKEN.fullmatch(token):
+        freq, wave, duration = match.groups()
+        return toneCommand(TONE_WAVES[wave.lower()] if wave else "sine", float(freq),
+                           min(float(duration), MAX_TONE_DURATION) if duration else 1.0)
+
+    return sampleCommand(token)
+
+def parse_play(payload:str) -> list:
+    """ Parse a soundboard/play payload, tokens are separated by spaces"""
+    return [parse_token(token) for token in payload.split()]
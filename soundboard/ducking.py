@@ -0,0 +1,140 @@
+import time
+import logging
+import threading
+
+from soundboard import metrics
+
+DUCK_SECONDS = metrics.histogram_metric("soundboard_duck_seconds", "Time from a duck request until MPD is ducked")
+
+class duckingController():
+    """
+        Turns the MPD volume down (or pauses MPD) while the soundboard is
+        playing. Ramps run on their own thread so playback never waits for
+        MPD, the music stays ducked while samples are queued or voices are
+        playing and is restored once everything has been idle for the hold
+        time. A duck that arrives during a ramp up turns it around.
+    """
+    log = logging.getLogger("Ducking")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        ramp = self.soundboard.config['mpd'].get('ramp', {})
+        self.enabled = ramp.get('enabled', True)
+        self.amount = ramp.get('amount', 20)
+        self.steps_down = ramp.get('down', 10)
+        self.steps_up = ramp.get('up', 10)
+        self.delay = ramp.get('delay', 0.05)
+        self.hold = ramp.get('hold', 1.0)
+
+        self.condition = threading.Condition()
+        self.requested = False
+        self.requested_at = None
+        self.pause_requested = False
+        self.ducked = False
+        self.paused = False
+        self.playing = False
+        self.original = None
+        self.current = None
+        self.idle_since = None
+
+    def duck(self, pause:bool=False) -> None:
+        """ Request the music to be ducked, returns immediately"""
+        with self.condition:
+            if not self.requested:
+                self.requested_at = time.monotonic()
+            self.requested = True
+            self.pause_requested = self.pause_requested or pause
+            self.idle_since = None
+            self.condition.notify()
+
+    def busy(self) -> bool:
+        """ True while samples are queued or voices are playing"""
+        return self.soundboard.scheduler.pending() > 0 or self.soundboard.mixer.active() > 0
+
+    def ramp_to(self, volume:int, steps:int, interruptible:bool) -> bool:
+        """ Ramp towards volume, returns False when a duck interrupted it"""
+        if self.current is None or self.current == volume:
+            return True
+
+        step_list = self.soundboard.mpd.ramp(max(steps, 2), self.current, volume)[1:]
+
+        if not self.delay:
+            self.soundboard.mpd.command_list([("setvol", (step,)) for step in step_list])
+            self.current = volume
+            return True
+
+        for step in step_list:
+            with self.condition:
+                if interruptible and self.requested:
+                    return False
+
+            self.soundboard.mpd.volume(step)
+            self.current = step
+
+            with self.condition:
+                self.condition.wait(self.delay)
+
+        return True
+
+    def apply_duck(self) -> None:
+        with self.condition:
+            self.requested, pause = False, self.pause_requested
+            self.pause_requested = False
+            requested_at = self.requested_at
+
+        if not self.ducked:
+            status = self.soundboard.mpd.mpd_status()
+            self.ducked = True
+            self.original = int(status['volume']) if "volume" in status else None
+            self.current = self.original
+            self.playing = status.get('state') == "play"
+
+        if pause and not self.paused and self.playing:
+            self.soundboard.mpd.mpd_should_pause()
+            self.paused = True
+
+        elif self.enabled and self.original is not None and self.original > self.amount:
+            self.ramp_to(self.amount, self.steps_down, False)
+
+        DUCK_SECONDS.observe(time.monotonic() - requested_at)
+
+    def apply_restore(self) -> None:
+        if self.paused:
+            self.soundboard.mpd.mpd_should_resume()
+            self.paused = False
+
+        if self.original is not None and not self.ramp_to(self.original, self.steps_up, True):
+            return # Ducked again halfway, stay ducked
+
+        self.log.debug(f"Restored MPD volume to {self.original}")
+        self.ducked = False
+        self.original = None
+        self.current = None
+
+    def ducking_thread(self) -> None:
+        while True:
+            try:
+                with self.condition:
+                    if not self.requested:
+                        self.condition.wait(0.05 if self.ducked else None)
+                    requested = self.requested
+
+                if requested:
+                    self.apply_duck()
+                    continue
+
+                if not self.ducked:
+                    continue
+
+                if self.busy():
+                    self.idle_since = None
+                elif self.idle_since is None:
+                    self.idle_since = time.monotonic()
+                elif time.monotonic() - self.idle_since >= self.hold + (self.soundboard.pulse.latency() or 0.0):
+                    # What's still buffered in the output is still heard
+                    self.idle_since = None
+                    self.apply_restore()
+
+            except Exception as e:
+                self.log.error(f"Error while ducking MPD ({e})")
+                time.sleep(1)
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import wave
+import yaml
+import queue
+import types
+import pydub
+import numpy
+import shutil
+import logging
+import argparse
+import itertools
+import threading
+
+from collections import OrderedDict
+
+from soundboard.loudness import loudnessIndex
+
+INGEST_DIR = ".ingest"
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+# Bumped when converted samples change, older ones are converted again
+VERSION = 2
+
+class sampleIngest():
+    """
+        Converts samples once to the format the pulseaudio stream is opened
+        with (44.1 kHz, stereo, s16) so that playing them doesn't need any
+        decoding or resampling. The converted wav is stored in a hidden
+        .ingest directory next to the original, together with a json
+        sidecar that describes it. Once the sample bank has packed the
+        PCM the wav is removed, only the sidecar stays.
+
+        Every submitted sample is a job whose status can be polled, the
+        last ingest.history jobs are remembered.
+    """
+    log = logging.getLogger("Ingest")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('ingest', {})
+        self.ingestQueue = queue.Queue(config.get('queue_depth', 64))
+        self.history = config.get('history', 256)
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.queued = {} # sample path -> job id, so a sample is only queued once
+        self.job_ids = itertools.count(1)
+
+    def paths(self, sample:str) -> tuple:
+        """ Return the (wav, sidecar) paths of the converted sample"""
+        directory, file = os.path.split(sample)
+        base = os.path.join(directory, INGEST_DIR, file)
+        return f"{base}.wav", f"{base}.json"
+
+    def sidecar(self, sample:str) -> dict:
+        """ Return the sidecar of a sample if it matches the current file"""
+        meta_path = self.paths(sample)[1]
+
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            stat = os.stat(sample)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if meta.get("source_mtime") != stat.st_mtime_ns or meta.get("source_size") != stat.st_size:
+            return None
+
+        # Version 1 stored peak normalized audio, loudness is applied when playing now
+        if meta.get("version") != VERSION:
+            return None
+
+        return meta
+
+    def metadata(self, sample:str) -> dict:
+        """ Return the sidecar of a sample if it's current and its PCM is stored, as wav or in the bank"""
+        if (meta := self.sidecar(sample)) is None:
+            return None
+
+        if not os.path.exists(self.paths(sample)[0]) and not self.soundboard.sampleBank.contains(sample):
+            return None
+
+        return meta
+
+    def in_library(self, sample:str) -> bool:
+        """ Only samples in the sample library are ingested"""
+        return os.path.realpath(os.path.dirname(sample)) == os.path.realpath(self.soundboard.config['sample_path'])
+
+    def read_pcm(self, sample:str) -> bytes:
+        """ Return the PCM of the converted sample, None if it isn't ingested"""
+        if self.sidecar(sample) is None:
+            return None
+
+        try:
+            with wave.open(self.paths(sample)[0], "rb") as f:
+                return f.readframes(f.getnframes())
+        except FileNotFoundError:
+            # Removed once it was packed
+            return self.soundboard.sampleBank.get(sample)
+
+    def packed(self, sample:str, mtime_ns:int, size:int) -> None:
+        """ The bank holds the PCM of this version of the sample, its wav isn't needed anymore"""
+        if not os.path.exists(self.paths(sample)[0]):
+            return
+
+        if (meta := self.sidecar(sample)) is None or (meta['source_mtime'], meta['source_size']) != (mtime_ns, size):
+            return
+
+        try:
+            os.remove(self.paths(sample)[0])
+        except FileNotFoundError:
+            pass
+
+    def convert(self, sample:str) -> dict:
+        """ Decode, convert and store a sample, returns the sidecar"""
+        stat = os.stat(sample)
+        sound = pydub.AudioSegment.from_file(sample, os.path.splitext(sample)[-1].split(".")[-1])
+
+        if sound.channels != CHANNELS:
+            sound = sound.set_channels(CHANNELS)
+
+        if sound.frame_rate != SAMPLE_RATE:
+            sound = sound.set_frame_rate(SAMPLE_RATE)
+
+        if sound.sample_width != SAMPLE_WIDTH:
+            sound = sound.set_sample_width(SAMPLE_WIDTH)
+
+        pcm = sound.raw_data
+        samples = numpy.frombuffer(pcm, dtype=numpy.int16)
+        analysis = self.soundboard.loudness.analyse(sample, pcm)
+
+        meta = {"version": VERSION,
+                "source": os.path.basename(sample),
+                "source_mtime": stat.st_mtime_ns,
+                "source_size": stat.st_size,
+                "rate": SAMPLE_RATE,
+                "channels": CHANNELS,
+                "sample_width": SAMPLE_WIDTH,
+                "samples": len(samples) // CHANNELS,
+                "duration": len(samples) / CHANNELS / SAMPLE_RATE,
+                "peak": int(numpy.abs(samples.astype(numpy.int32)).max()) if len(samples) else 0,
+                "loudness": analysis['integrated'],
+                "true_peak": analysis['true_peak']}
+
+        wav_path, meta_path = self.paths(sample)
+        os.makedirs(os.path.dirname(wav_path), exist_ok=True)
+
+        # Write to a temporary file first so that a half written file is never played
+        with wave.open(f"{wav_path}.tmp", "wb") as f:
+            f.setnchannels(CHANNELS)
+            f.setsampwidth(SAMPLE_WIDTH)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm)
+        os.replace(f"{wav_path}.tmp", wav_path)
+
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+        self.log.info(f"Ingested {os.path.basename(sample)} ({meta['duration']:.2f}s, {meta['loudness']:.1f} LUFS)")
+        return meta
+
+    def submit(self, sample:str, source:str=None) -> int:
+        """
+            Queue a sample for conversion in the background. source is a
+            file that is moved to sample first, like an upload. Returns the
+            job id, or None when the queue is full.
+        """
+        with self.lock:
+            if source is None and sample in self.queued:
+                return self.queued[sample]
+
+            job_id = next(self.job_ids)
+            try:
+                self.ingestQueue.put_nowait((job_id, sample, source))
+            except queue.Full:
+                self.log.warning(f"Ingest queue is full, not queueing {sample}")
+                return None
+
+            self.queued[sample] = job_id
+            self.jobs[job_id] = {"id": job_id, "sample": os.path.basename(sample), "status": "queued",
+                                 "error": None, "duration": None, "submitted": time.time(), "finished": None}
+            while len(self.jobs) > self.history:
+                self.jobs.popitem(last=False)
+
+        return job_id
+
+    def job(self, job_id:int) -> dict:
+        """ Return the status of a job, None when it's unknown or forgotten"""
+        with self.lock:
+            if (job := self.jobs.get(job_id)) is not None:
+                return dict(job)
+
+    def update(self, job_id:int, **status) -> None:
+        with self.lock:
+            if (job := self.jobs.get(job_id)) is not None:
+                job.update(status)
+
+    def place(self, source:str, sample:str) -> None:
+        """ Move an uploaded file into the library, never over an existing sample"""
+        if os.path.exists(sample):
+            raise FileExistsError(f"There already is a sample called {os.path.basename(sample)}")
+        shutil.move(source, sample)
+
+    def ingest_thread(self) -> None:
+        while True:
+            job_id, sample, source = self.ingestQueue.get()
+            self.update(job_id, status="processing")
+            placed = False
+            try:
+                if source is not None:
+                    self.place(source, sample)
+                    placed = True
+
+                meta = self.metadata(sample) or self.convert(sample)
+                self.update(job_id, status="done", duration=meta['duration'], finished=time.time())
+                self.soundboard.sampleBank.changed.set()
+            except Exception as e:
+                self.log.error(f"Failed to ingest {sample} ({e})")
+                # An upload that can't be decoded doesn't belong in the library
+                for path in (sample if placed else None, source):
+                    if path is not None and os.path.exists(path):
+                        os.remove(path)
+                self.update(job_id, status="failed", error=str(e), finished=time.time())
+            finally:
+                with self.lock:
+                    if self.queued.get(sample) == job_id:
+                        del self.queued[sample]
+
+    def reingest_all(self, force:bool=False) -> int:
+        """ Convert every sample in the library, returns the amount converted"""
+        converted = 0
+        for file in sorted(os.listdir(self.soundboard.config['sample_path'])):
+            sample = os.path.join(self.soundboard.config['sample_path'], file)
+            if os.path.isdir(sample):
+                continue
+
+            if not force and self.metadata(sample) is not None:
+                continue
+
+            try:
+                self.convert(sample)
+                converted += 1
+            except Exception as e:
+                self.log.error(f"Failed to ingest {sample} ({e})")
+
+        return converted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the sample library to the playback format")
+    parser.add_argument("--config", default="config.yml")
+    parser.add_argument("--force", action="store_true", help="Also convert samples that are up to date")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    with open(args.config, "r") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    # Imported here, samplebank imports this module
+    from soundboard.samplebank import sampleBank
+
+    soundboard = types.SimpleNamespace(config=config)
+    soundboard.loudness = loudnessIndex(soundboard)
+    soundboard.sampleBank = sampleBank(soundboard)
+    ingest = sampleIngest(soundboard)
+    print(f"Ingested {ingest.reingest_all(args.force)} samples")
@@ -0,0 +1,297 @@
+import os
+import time
+import queue
+import numpy
+import sqlite3
+import hashlib
+import logging
+import threading
+
+RATE = 44100
+# Bumped when the analysis changes, older rows are analysed again
+ANALYSIS_VERSION = 1
+# How long a file that isn't analysed yet is taken at its word
+MISS_SECONDS = 5.0
+
+def biquad_response(b:tuple, a:tuple, n:int) -> numpy.ndarray:
+    """ The frequency response of a biquad at the bins of an rfft of length n"""
+    z = numpy.exp(-2j * numpy.pi * numpy.arange(n // 2 + 1) / n)
+    return (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+
+def k_weighting(n:int, rate:int=RATE) -> numpy.ndarray:
+    """ The BS.1770 K filter (high shelf and high pass) at the bins of an rfft of length n"""
+    # High shelf, +4dB above ~1.5kHz
+    A = 10 ** (4.0 / 40)
+    w0 = 2 * numpy.pi * 1500 / rate
+    alpha = numpy.sin(w0) / (2 * (1 / numpy.sqrt(2)))
+    cos = numpy.cos(w0)
+    shelf = biquad_response(
+        (A * ((A + 1) + (A - 1) * cos + 2 * numpy.sqrt(A) * alpha),
+         -2 * A * ((A - 1) + (A + 1) * cos),
+         A * ((A + 1) + (A - 1) * cos - 2 * numpy.sqrt(A) * alpha)),
+        ((A + 1) - (A - 1) * cos + 2 * numpy.sqrt(A) * alpha,
+         2 * ((A - 1) - (A + 1) * cos),
+         (A + 1) - (A - 1) * cos - 2 * numpy.sqrt(A) * alpha), n)
+
+    # High pass at 38Hz
+    w0 = 2 * numpy.pi * 38 / rate
+    alpha = numpy.sin(w0) / (2 * 0.5)
+    cos = numpy.cos(w0)
+    highpass = biquad_response(((1 + cos) / 2, -(1 + cos), (1 + cos) / 2),
+                               (1 + alpha, -2 * cos, 1 - alpha), n)
+
+    return shelf * highpass
+
+def integrated_loudness(samples:numpy.ndarray, rate:int=RATE) -> float:
+    """
+        Gated integrated loudness in LUFS like EBU R128: K weighted mean
+        square over 400ms blocks with 75% overlap, an absolute gate at
+        -70 LUFS and a relative gate 10 LU below the ungated loudness.
+        The filters are applied in the frequency domain, with enough
+        zero padding that the IIR tail doesn't wrap around.
+    """
+    frames = len(samples)
+    if not frames:
+        return float("-inf")
+
+    n = frames + rate // 4
+    response = k_weighting(n, rate)
+    power = numpy.zeros(frames)
+    for channel in range(samples.shape[1]):
+        weighted = numpy.fft.irfft(numpy.fft.rfft(samples[:, channel] / 32768.0, n) * response, n)[:frames]
+        power += weighted ** 2
+
+    block, step = int(0.4 * rate), int(0.1 * rate)
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(power)))
+    if frames < block:
+        starts, block = numpy.array([0]), frames # Too short, one block of everything
+    else:
+        starts = numpy.arange(0, frames - block + 1, step)
+    blocks = (cumulative[starts + block] - cumulative[starts]) / block
+
+    with numpy.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * numpy.log10(blocks)
+
+    gated = blocks[loudness > -70.0]
+    if not len(gated):
+        return float("-inf")
+
+    relative = -0.691 + 10 * numpy.log10(gated.mean()) - 10.0
+    gated = blocks[(loudness > -70.0) & (loudness > relative)]
+    return float(-0.691 + 10 * numpy.log10(gated.mean()))
+
+def true_peak(samples:numpy.ndarray, oversample:int=4, block:int=65536, overlap:int=64) -> float:
+    """
+        The peak in dBTP after 4x band limited oversampling, done per
+        block by zero padding the spectrum. The overlap on both sides of
+        a block hides the edges of the circular interpolation.
+    """
+    peak = 0.0
+    frames = len(samples)
+    for start in range(0, frames, block):
+        lo, hi = max(start - overlap, 0), min(start + block + overlap, frames)
+        chunk = samples[lo:hi] / 32768.0
+        upsampled = numpy.fft.irfft(numpy.fft.rfft(chunk, axis=0), (hi - lo) * oversample, axis=0) * oversample
+        inner = upsampled[(start - lo) * oversample:(min(start + block, frames) - lo) * oversample]
+        peak = max(peak, float(numpy.abs(inner).max()) if len(inner) else 0.0)
+
+    return float(20 * numpy.log10(peak)) if peak > 0 else float("-inf")
+
+def silence_bounds(samples:numpy.ndarray, threshold:float=-50.0, window:int=441) -> tuple:
+    """
+        The first and last frame that aren't silent, in windows of 10ms
+        whose RMS is below threshold dBFS. One window is kept on both
+        sides so fades aren't cut off. A silent sample isn't trimmed.
+    """
+    frames = len(samples)
+    windows = frames // window
+    if not windows:
+        return 0, frames
+
+    power = (samples[:windows * window].astype(numpy.float64) / 32768.0) ** 2
+    rms = numpy.sqrt(power.reshape(windows, -1).mean(axis=1))
+    loud = numpy.flatnonzero(rms > 10 ** (threshold / 20))
+    if not len(loud):
+        return 0, frames
+
+    start = max(int(loud[0]) - 1, 0) * window
+    end = min((int(loud[-1]) + 2) * window, frames)
+    if loud[-1] == windows - 1:
+        end = frames # Don't cut the partial window at the end
+
+    return start, end
+
+def analyse(pcm, silence:float=-50.0) -> dict:
+    """ Analyse s16 stereo PCM at 44.1kHz"""
+    samples = numpy.frombuffer(pcm, dtype=numpy.int16).reshape(-1, 2)
+    start, end = silence_bounds(samples, silence)
+    return {"integrated": integrated_loudness(samples), "true_peak": true_peak(samples),
+            "start": start, "end": end, "frames": len(samples)}
+
+class loudnessIndex():
+    """
+        Loudness analysis of every sample, stored in a sqlite database
+        keyed by the hash of the file content so it survives renames and
+        restarts. Playback applies the gain as a scalar in the mixer and
+        skips the leading and trailing silence, instead of normalizing
+        the peak of every decoded buffer. Samples that are played before
+        they're analysed are analysed in the background, until then only
+        their silence is trimmed.
+    """
+    log = logging.getLogger("Loudness")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('loudness', {})
+        self.target = config.get('target', -16.0)
+        self.ceiling = config.get('ceiling', -1.0)
+        self.max_gain = config.get('max_gain', 12.0)
+        self.silence = config.get('silence', -50.0)
+        self.trim = config.get('trim', True)
+
+        path = config.get('database', "cache/loudness.sqlite")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS analysis (hash TEXT PRIMARY KEY, version INTEGER, "
+                            "integrated REAL, true_peak REAL, start INTEGER, end INTEGER, frames INTEGER, analysed REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, "
+                            "size INTEGER, hash TEXT)")
+        self.memo = {}
+        self.digests = {}
+        self.misses = {}
+        self.analysisQueue = queue.Queue(config.get('queue_depth', 64))
+        self.queued = set()
+
+    def file_hash(self, path:str) -> str:
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def digest(self, key:tuple) -> str:
+        """ The content hash of a (path, mtime_ns, size), hashed once per version of the file"""
+        if (digest := self.digests.get(key)) is not None:
+            return digest
+
+        with self.lock:
+            row = self.db.execute("SELECT hash FROM files WHERE path = ? AND mtime_ns = ? AND size = ?", key).fetchone()
+
+        if len(self.digests) >= 4096:
+            self.digests = {}
+        digest = self.digests[key] = row[0] if row else self.file_hash(key[0])
+        return digest
+
+    def lookup(self, path:str) -> dict:
+        """ Return the analysis of a file, None when it hasn't been analysed"""
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if (analysis := self.memo.get(key)) is not None:
+            return analysis
+
+        # Played again before its analysis is done, don't ask the database every time
+        if time.monotonic() < self.misses.get(key, 0.0):
+            return None
+
+        digest = self.digest(key)
+        with self.lock:
+            row = self.db.execute("SELECT integrated, true_peak, start, end, frames FROM analysis "
+                                  "WHERE hash = ? AND version = ?", (digest, ANALYSIS_VERSION)).fetchone()
+            if row is None:
+                if len(self.misses) >= 4096:
+                    self.misses = {}
+                self.misses[key] = time.monotonic() + MISS_SECONDS
+                return None
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", key + (digest,))
+
+        analysis = self.remember(key, dict(zip(("integrated", "true_peak", "start", "end", "frames"), row)))
+        return analysis
+
+    def measure(self, pcm) -> dict:
+        """ Analyse PCM that has no file, like speech that isn't cached"""
+        return analyse(pcm, self.silence)
+
+    def analyse(self, path:str, pcm) -> dict:
+        """ Analyse the converted PCM of a file and store it"""
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self.digest(key)
+
+        start = time.monotonic()
+        analysis = analyse(pcm, self.silence)
+        self.log.debug(f"Analysed {os.path.basename(path)} in {time.monotonic() - start:.3f}s: "
+                       f"{analysis['integrated']:.1f} LUFS, {analysis['true_peak']:.1f} dBTP")
+
+        with self.lock, self.db:
+            # sqlite has no infinity, silence is stored as NULL
+            self.db.execute("INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (digest, ANALYSIS_VERSION,
+                             analysis['integrated'] if numpy.isfinite(analysis['integrated']) else None,
+                             analysis['true_peak'] if numpy.isfinite(analysis['true_peak']) else None,
+                             analysis['start'], analysis['end'], analysis['frames'], time.time()))
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", key + (digest,))
+
+        return self.remember(key, analysis)
+
+    def remember(self, key:tuple, analysis:dict) -> dict:
+        if len(self.memo) >= 4096:
+            self.memo = {}
+        self.memo[key] = analysis
+        self.misses.pop(key, None)
+        return analysis
+
+    def gain(self, analysis:dict) -> float:
+        """ The linear gain that brings a sample to the target without passing the ceiling"""
+        integrated, peak = analysis['integrated'], analysis['true_peak']
+        if integrated is None or peak is None or not numpy.isfinite(integrated):
+            return 1.0
+
+        gain = min(self.target - integrated, self.ceiling - peak, self.max_gain)
+        return float(10 ** (gain / 20))
+
+    def sample_gain(self, path:str) -> float:
+        analysis = self.lookup(path)
+        return self.gain(analysis) if analysis is not None else 1.0
+
+    def prepare(self, path:str, pcm):
+        """ Return the PCM to play without its silence"""
+        analysis = self.lookup(path)
+        if analysis is None or analysis['frames'] * 4 != len(pcm):
+            # Not analysed yet, or from another conversion of the file
+            self.submit(path, pcm)
+            if not self.trim:
+                return pcm
+            start, end = silence_bounds(numpy.frombuffer(pcm, dtype=numpy.int16).reshape(-1, 2), self.silence)
+            analysis = {"start": start, "end": end}
+
+        return self.trimmed(pcm, analysis)
+
+    def trimmed(self, pcm, analysis:dict):
+        """ The PCM between the silence of an analysis"""
+        return memoryview(pcm)[analysis['start'] * 4:analysis['end'] * 4] if self.trim else pcm
+
+    def submit(self, path:str, pcm) -> None:
+        with self.lock:
+            if path in self.queued:
+                return
+            try:
+                self.analysisQueue.put_nowait((path, pcm))
+            except queue.Full:
+                return
+            self.queued.add(path)
+
+    def analysis_thread(self) -> None:
+        while True:
+            path, pcm = self.analysisQueue.get()
+            try:
+                analysis = self.lookup(path)
+                if analysis is None or analysis['frames'] * 4 != len(pcm):
+                    self.analyse(path, pcm)
+            except Exception as e:
+                self.log.error(f"Failed to analyse {path} ({e})")
+            finally:
+                with self.lock:
+                    self.queued.discard(path)
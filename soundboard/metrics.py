@@ -0,0 +1,131 @@
+import bisect
+import threading
+
+# Seconds, from a period of the mixer to a slow TTS service
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(names:tuple, values:tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class counter():
+    def __init__(self, name:str, help:str, labels:tuple=()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount:float=1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self.lock:
+            values = dict(self.values)
+
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"] + \
+               [f"{self.name}{format_labels(self.labels, labels)} {value}" for labels, value in values.items()]
+
+class histogram():
+    def __init__(self, name:str, help:str, labels:tuple=(), buckets:tuple=LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value:float, *labels) -> None:
+        """ Record a value, only a bisect and a few additions"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if (series := self.values.get(labels)) is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        with self.lock:
+            values = {labels: (list(counts), total, count) for labels, (counts, total, count) in self.values.items()}
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, amount in zip(self.buckets + ("+Inf",), counts):
+                cumulative += amount
+                lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+
+        return lines
+
+class registry():
+    """
+        Counters and histograms are updated where things happen, values
+        that already exist elsewhere (queue depths, cache statistics) are
+        only read by collectors when the metrics are scraped.
+    """
+
+    def __init__(self) -> None:
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def collector(self, collect) -> None:
+        """ collect() returns a list of (name, type, help, [(labels dict, value)])"""
+        with self.lock:
+            self.collectors.append(collect)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics, collectors = list(self.metrics.values()), list(self.collectors)
+
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+
+        # Collectors can report the same metric with other labels, a
+        # metric may only be described once
+        families = {}
+        for collect in collectors:
+            for name, kind, help, samples in collect():
+                families.setdefault(name, (kind, help, []))[2].extend(samples)
+
+        for name, (kind, help, samples) in families.items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}"
+                      for labels, value in samples]
+
+        return "\n".join(lines) + "\n"
+
+REGISTRY = registry()
+
+def counter_metric(name:str, help:str, labels:tuple=()) -> counter:
+    return REGISTRY.register(counter(name, help, labels))
+
+def histogram_metric(name:str, help:str, labels:tuple=(), buckets:tuple=LATENCY_BUCKETS) -> histogram:
+    return REGISTRY.register(histogram(name, help, labels, buckets))
+
+# When the MQTT message that is being handled arrived, so that jobs it
+# queues can be traced back to it. Only set for sampled messages.
+received = threading.local()
+
+def message_received() -> float:
+    return getattr(received, "time", None)
+
+def cache_collector(name:str, stats):
+    """ Expose the stats() of a cache as gauges labelled with its name"""
+    def collect() -> list:
+        values = stats()
+        return [(f"soundboard_cache_{key}", "gauge", f"Cache {key.replace('_', ' ')}", [({"cache": name}, values[key])])
+                for key in ("entries", "bytes", "hits", "misses", "evictions", "hit_ratio") if key in values]
+
+    return collect
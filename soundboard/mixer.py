@@ -0,0 +1,298 @@
+import time
+import numpy
+import logging
+import threading
+
+from collections import deque
+
+from soundboard import metrics
+from soundboard.output import outputError
+from soundboard.scheduler import STAGE_SECONDS
+
+# Seconds to wait after a failed write, doubled while the output keeps failing
+WRITE_BACKOFF = (0.1, 2.0)
+
+LATENCY_SECONDS = metrics.histogram_metric("soundboard_latency_seconds",
+    "Time from an MQTT message (or the job being queued) to its first pulse write")
+
+class voice():
+    """ A single sound that is being played by the mixer"""
+
+    def __init__(self, pcm, gain:float=1.0, channels:int=2, name:str=None) -> None:
+        samples = numpy.frombuffer(pcm, dtype=numpy.int16) if not isinstance(pcm, numpy.ndarray) else pcm
+
+        if channels == 1:
+            samples = numpy.repeat(samples, 2)
+
+        self.samples = samples.reshape(-1, 2)
+        self.gain = gain
+        self.name = name
+        self.position = 0
+        self.done = threading.Event()
+        self.trace = None
+        self.started = False
+
+    def read(self, frames:int) -> numpy.ndarray:
+        """ Return the next frames, fewer when the voice runs out"""
+        chunk = self.samples[self.position:self.position + frames]
+        self.position += len(chunk)
+        return chunk
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self.samples)
+
+    def stop(self) -> None:
+        self.position = len(self.samples)
+
+    def wait(self, timeout:float=None) -> bool:
+        return self.done.wait(timeout)
+
+class streamVoice(voice):
+    """
+        A voice that is fed while it plays, for sounds that are still being
+        rendered. Running out of data before close() plays silence.
+    """
+
+    def __init__(self, gain:float=1.0, name:str=None) -> None:
+        super().__init__(b"", gain, 2, name)
+        self.pending = deque()
+        self.closed = False
+        self.stopped = False
+
+    def feed(self, pcm) -> None:
+        """ Queue s16 stereo PCM, arrays are played without being copied"""
+        if not isinstance(pcm, numpy.ndarray):
+            pcm = numpy.frombuffer(pcm, dtype=numpy.int16)
+        self.pending.append(pcm.reshape(-1, 2))
+
+    def close(self) -> None:
+        self.closed = True
+
+    def read(self, frames:int) -> numpy.ndarray:
+        chunks = []
+        while frames > 0 and not self.stopped:
+            if self.position >= len(self.samples):
+                if not self.pending:
+                    break
+                self.samples, self.position = self.pending.popleft(), 0
+
+            chunk = super().read(frames)
+            chunks.append(chunk)
+            frames -= len(chunk)
+
+        return numpy.concatenate(chunks) if len(chunks) > 1 else chunks[0] if chunks else self.samples[:0]
+
+    @property
+    def finished(self) -> bool:
+        return self.stopped or (self.closed and not self.pending and self.position >= len(self.samples))
+
+    def stop(self) -> None:
+        self.stopped = True
+
+class mixer():
+    """
+        Owns the pulseaudio stream and mixes every active voice into it.
+        Voices are summed per period into int32 and soft clipped back to
+        s16, so that sounds overlap instead of waiting for each other.
+    """
+    log = logging.getLogger("Mixer")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('mixer', {})
+        self.period = config.get('period', 1024)
+        self.max_voices = config.get('max_voices', 8)
+        self.knee = config.get('knee', 0.8)
+        self.voices = []
+        self.condition = threading.Condition()
+        self.stopRequest = None
+        self.stopDone = threading.Event()
+        self.stop_latency = None
+        self.started = []
+        metrics.REGISTRY.collector(self.collect)
+
+    def play(self, pcm, gain:float=1.0, channels:int=2, name:str=None, trace:dict=None) -> voice:
+        """
+            Start playing s16 PCM, returns the voice. trace holds the start
+            and decoded time to measure the latency to the first write.
+        """
+        new_voice = voice(pcm, gain, channels, name)
+        new_voice.trace = trace
+        return self.add_voice(new_voice)
+
+    def stream(self, gain:float=1.0, name:str=None) -> streamVoice:
+        """ Start playing a voice that is fed with s16 stereo PCM as it's rendered"""
+        return self.add_voice(streamVoice(gain, name))
+
+    def sequence(self, segments:list, gain:float=1.0, name:str=None) -> streamVoice:
+        """ Play s16 stereo segments back to back without joining them"""
+        new_voice = streamVoice(gain, name)
+        for segment in segments:
+            new_voice.feed(segment)
+        new_voice.close()
+
+        return self.add_voice(new_voice)
+
+    def add_voice(self, new_voice:voice) -> voice:
+        with self.condition:
+            while len(self.voices) >= self.max_voices:
+                stolen = self.voices.pop(0)
+                self.log.info(f"Max polyphony reached, stopping {stolen.name}")
+                stolen.stop()
+                stolen.done.set()
+
+            self.voices.append(new_voice)
+            self.condition.notify()
+
+        return new_voice
+
+    def active(self) -> int:
+        """ Return the amount of voices that are playing"""
+        with self.condition:
+            return len(self.voices)
+
+    def mix(self, frames:int) -> numpy.ndarray:
+        """
+            Mix the next period of all voices into s16. A single voice that
+            needs no gain or clipping is returned as it is, a view on its
+            PCM (and so on the sample bank) instead of a mixed copy.
+        """
+        with self.condition:
+            voices = list(self.voices)
+
+        mixed = None
+        for playing in voices:
+            if not playing.started:
+                playing.started = True
+                if playing.trace is not None:
+                    self.started.append(playing)
+
+            chunk = playing.read(frames)
+            if len(voices) == 1 and self.passthrough(playing, chunk, frames):
+                mixed = chunk
+                break
+
+            if mixed is None:
+                mixed = numpy.zeros((frames, 2), dtype=numpy.int32)
+            if playing.gain == 1.0:
+                mixed[:len(chunk)] += chunk
+            else:
+                mixed[:len(chunk)] += (chunk * playing.gain).astype(numpy.int32)
+
+        with self.condition:
+            for playing in voices:
+                if playing.finished and playing in self.voices:
+                    self.voices.remove(playing)
+                    playing.done.set()
+
+        if mixed is None:
+            return numpy.zeros((frames, 2), dtype=numpy.int16)
+        return mixed if mixed.dtype == numpy.int16 else self.soft_clip(mixed)
+
+    def passthrough(self, playing:voice, chunk:numpy.ndarray, frames:int) -> bool:
+        """ Whether a chunk would come out of mixing unchanged"""
+        if playing.gain != 1.0 or len(chunk) != frames or chunk.dtype != numpy.int16 or not chunk.flags.c_contiguous:
+            return False
+
+        # Reductions, unlike abs() they don't allocate
+        knee = self.knee * 32767
+        return int(chunk.max()) <= knee and -int(chunk.min()) <= knee
+
+    def soft_clip(self, mixed:numpy.ndarray) -> numpy.ndarray:
+        """ Compress everything above the knee instead of hard clipping"""
+        knee = self.knee * 32767
+        peak = numpy.abs(mixed).max() if len(mixed) else 0
+        if peak <= knee:
+            return mixed.astype(numpy.int16)
+
+        signal = mixed.astype(numpy.float32)
+        magnitude = numpy.abs(signal)
+        over = magnitude > knee
+        headroom = 32767 - knee
+        magnitude[over] = knee + headroom * numpy.tanh((magnitude[over] - knee) / headroom)
+        return (numpy.sign(signal) * magnitude).astype(numpy.int16)
+
+    def periods(self):
+        """ Generate mixed periods until a stop or skip is requested"""
+        while True:
+            with self.condition:
+                while not self.voices and self.stopRequest is None:
+                    self.condition.wait()
+
+                if self.stopRequest is not None:
+                    return
+
+            yield self.mix(self.period)
+
+    def request_stop(self, everything:bool, timeout:float=1.0) -> float:
+        """ Ask the mixer thread to stop voices, returns the time it took"""
+        with self.condition:
+            self.stopDone.clear()
+            self.stopRequest = {"time": time.monotonic(), "everything": everything}
+            self.condition.notify()
+
+        if self.stopDone.wait(timeout):
+            return self.stop_latency
+
+    def stop(self, timeout:float=1.0) -> float:
+        """ Stop all voices within one period and flush pulse"""
+        return self.request_stop(True, timeout)
+
+    def skip(self, timeout:float=1.0) -> float:
+        """ Stop the oldest voice within one period"""
+        return self.request_stop(False, timeout)
+
+    def handle_stop(self) -> None:
+        with self.condition:
+            request, self.stopRequest = self.stopRequest, None
+            stopped = self.voices if request['everything'] else self.voices[:1]
+            self.voices = [v for v in self.voices if v not in stopped]
+
+        for playing in stopped:
+            self.log.info(f"Stopping {playing.name}")
+            playing.stop()
+            playing.done.set()
+
+        # Drop whatever pulse still has buffered
+        try:
+            self.soundboard.pulse.flush()
+        except outputError as e:
+            self.log.warning(f"Couldn't flush the output ({e})")
+
+        self.stop_latency = time.monotonic() - request['time']
+        self.log.debug(f"Stopped {len(stopped)} voices in {self.stop_latency * 1000:.1f}ms")
+        self.stopDone.set()
+
+    def trace_started(self) -> None:
+        """ Record the latency of voices whose first period was just written"""
+        now = time.monotonic()
+        for playing in self.started:
+            STAGE_SECONDS.observe(now - playing.trace['decoded'], "output")
+            LATENCY_SECONDS.observe(now - playing.trace['start'])
+        self.started = []
+
+    def collect(self) -> list:
+        latency = self.soundboard.pulse.latency()
+        return [("soundboard_output_latency_seconds", "gauge", "Audio buffered between the mixer and the speakers",
+                 [({"backend": self.soundboard.pulse.name}, latency)] if latency is not None else [])]
+
+    def mix_thread(self) -> None:
+        backoff = WRITE_BACKOFF[0]
+        while True:
+            try:
+                # The stop flag is checked between every period
+                for chunk in self.periods():
+                    # Written without a copy, periods can be views on the sample bank
+                    self.soundboard.pulse.write(memoryview(chunk).cast("B"))
+                    backoff = WRITE_BACKOFF[0]
+
+                    if self.started:
+                        self.trace_started()
+
+                self.handle_stop()
+            except Exception as e:
+                # Don't spin on an output that keeps failing
+                self.log.error(f"Error while mixing ({e}), retrying in {backoff:.1f}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, WRITE_BACKOFF[1])
@@ -1,55 +1,130 @@
 import time
-import mpd 
+import mpd
 import logging
 import threading
 
 from mpd import MPDClient
 
+from soundboard import metrics
+
+ROUND_TRIPS = metrics.counter_metric("soundboard_mpd_round_trips_total", "Commands (or command lists) sent to MPD")
+COMMAND_SECONDS = metrics.histogram_metric("soundboard_mpd_command_seconds", "Time of a round trip to MPD")
+
 class mpdclient():
+    """
+        The single gateway to MPD. It keeps one persistent connection that
+        is shared by every thread, reconnects with an exponential backoff
+        and sends multi-step operations as command lists so they only cost
+        a single round trip.
+    """
     log = logging.getLogger("MPD Client")
-    mpd_lock = threading.Lock()
 
     def __init__(self, soundboard) -> None:
         self.soundboard = soundboard
         self.host = self.soundboard.config['mpd']['host']
         self.port = self.soundboard.config['mpd']['port']
-        
+
+        reconnect = self.soundboard.config['mpd'].get('reconnect', {})
+        self.backoff_min = reconnect.get('min', 0.5)
+        self.backoff_max = reconnect.get('max', 30.0)
+        self.backoff = self.backoff_min
+        self.next_attempt = 0.0
+
+        self.mpd_lock = threading.RLock()
         self.client = MPDClient()
-        self.client.connect(self.host, self.port)
-        
-        threading.Thread(target=self.mpd_keepalive).start()
+        self.client.timeout = self.soundboard.config['mpd'].get('timeout', 5)
+        self.connected = False
+        self.round_trips = 0
+        self.last_status = {}
+
+        try:
+            self.connect()
+        except (mpd.base.ConnectionError, OSError) as e:
+            self.log.error(f"Failed to connect to MPD ({e})")
+
+        threading.Thread(name="MPD Keepalive", target=self.mpd_keepalive, daemon=True).start()
+
+    def connect(self) -> None:
+        """ (Re)connect to MPD, respecting the backoff"""
+        with self.mpd_lock:
+            if self.connected:
+                return
+
+            if time.monotonic() < self.next_attempt:
+                raise mpd.base.ConnectionError(f"Not reconnecting to MPD for {self.next_attempt - time.monotonic():.1f}s")
 
-    def mpd_keepalive(self):
+            try:
+                self.client.connect(self.host, self.port)
+            except (mpd.base.ConnectionError, OSError):
+                self.next_attempt = time.monotonic() + self.backoff
+                self.backoff = min(self.backoff * 2, self.backoff_max)
+                raise
+
+            self.log.info(f"Connected to MPD at {self.host}:{self.port}")
+            self.connected = True
+            self.backoff = self.backoff_min
+
+    def disconnect(self) -> None:
+        with self.mpd_lock:
+            self.connected = False
+            try:
+                self.client.disconnect()
+            except (mpd.base.ConnectionError, OSError):
+                pass
+
+    def execute(self, command):
+        """
+            Run command(client) while holding the connection, reconnecting
+            once when the connection turns out to be dead.
+        """
+        with self.mpd_lock:
+            for attempt in range(2):
+                self.connect()
+                try:
+                    self.round_trips += 1
+                    ROUND_TRIPS.inc()
+                    start = time.monotonic()
+                    result = command(self.client)
+                    COMMAND_SECONDS.observe(time.monotonic() - start)
+                    return result
+                except (mpd.base.ConnectionError, OSError) as e:
+                    self.log.warning(f"MPD connection lost ({e})")
+                    self.disconnect()
+                    if attempt == 1:
+                        raise
+
+    def command_list(self, commands:list) -> list:
+        """ Send a list of (command, args) in a single round trip"""
+        def batch(client):
+            client.command_list_ok_begin()
+            for command, args in commands:
+                getattr(client, command)(*args)
+            return client.command_list_end()
+
+        return self.execute(batch)
+
+    def mpd_keepalive(self) -> None:
         """ Keep MPD connection alive or reconnect when an error happens."""
         self.log.info("MPD client keep alive started")
         while True:
             try:
-                self.mpd_lock.acquire()
-                self.client.status()
-                self.mpd_lock.release()
-            except mpd.base.ConnectionError:
-                self.client.connect(self.host, self.port)
+                self.mpd_status()
+            except (mpd.base.ConnectionError, OSError):
+                pass
             finally:
                 time.sleep(1)
 
     def mpd_togglepause(self) -> None:
         """ Pause MPD """
-        self.mpd_lock.acquire()
-        self.client.pause()
-        self.mpd_lock.release()
+        self.execute(lambda client: client.pause())
 
     def mpd_status(self) -> dict:
         """ Return MPD status"""
-
-        if self.client._sock == None:
-            self.client.connect(self.host, self.port)
-        status = self.client.status()
-        return status
+        self.last_status = self.execute(lambda client: client.status())
+        return self.last_status
 
     def volume(self, volume:int) -> None:
-        self.mpd_lock.acquire()
-        self.client.setvol(volume)
-        self.mpd_lock.release()
+        self.execute(lambda client: client.setvol(volume))
 
     def ramp(self, size:int, start:int, end:int) -> list:
         self.log.debug(f"size: {size} | start: {start} | end: {end}")
@@ -61,41 +136,11 @@ class mpdclient():
 
         return result
 
-    def volume_ramp_up(self, endvolume):
-        self.volume_ramp(endvolume, False)
-
-    def volume_ramp_down(self, endvolume):
-        self.volume_ramp(endvolume, True)
-
-    def volume_ramp(self, endvolume, down=False):
-        status = self.mpd_status()
-        if "volume" in status:
-            startvolume = int(status['volume'])
-            
-            if down is False and startvolume == endvolume:
-                print("endvolume matches startvolume")
-                return endvolume, startvolume
-            
-            elif endvolume == startvolume:
-                return endvolume, startvolume
-            
-            # TODO add back config
-            step_list = [s for s in reversed(self.ramp(5, endvolume, startvolume))]
-            
-            for step in step_list:
-                self.volume(step)
-                #time.sleep(self.soundboard.config['mpd']['ramp']['delay'])
-                # TODO add back config
-                time.sleep(0.025)
-            return int(self.mpd_status()['volume']), startvolume
-
-
     def mpd_should_pause(self) -> None:
         """ Will only pause MPD if it's actually playing"""
-        if self.mpd_status()['state'] == "play":
-            self.mpd_togglepause()
+        # pause 1 is a no-op unless MPD is playing, so no status is needed
+        self.execute(lambda client: client.pause(1))
 
     def mpd_should_resume(self) -> None:
         """ Will only resume MPD if it's actually paused"""
-        if self.mpd_status()['state'] == "pause":
-            self.mpd_togglepause()
\ No newline at end of file
+        self.execute(lambda client: client.pause(0))
@@ -0,0 +1,107 @@
+import time
+import logging
+import threading
+
+from soundboard import metrics
+
+HANDLE_SECONDS = metrics.histogram_metric("soundboard_mqtt_handle_seconds", "Time spent in the handlers of a sampled message")
+# Timing and tracing every message costs more than routing it
+SAMPLE_EVERY = 16
+
+class mqttRouter():
+    """
+        Dispatches MQTT messages to the handlers that subsystems register
+        for a topic filter. Filters are compiled into a trie on their topic
+        levels, with the MQTT + and # wildcards, and the handlers a topic
+        resolves to are remembered so a known topic costs a dict lookup.
+        The payload is decoded once and handed to every handler. Every
+        SAMPLE_EVERY-th message is timed and traced through the stages of
+        the jobs it queues.
+    """
+    log = logging.getLogger("MQTT Router")
+
+    def __init__(self) -> None:
+        self.trie = {"children": {}, "handlers": []}
+        self.resolved = {}
+        self.lock = threading.Lock()
+        self.routed = 0
+        self.unrouted = 0
+
+        metrics.REGISTRY.collector(self.collect)
+
+    def register(self, topic_filter:str, handler) -> None:
+        """ Call handler(payload) for every message matching the filter"""
+        levels = topic_filter.split("/")
+        if "#" in levels[:-1]:
+            raise ValueError(f"# must be the last level of {topic_filter}")
+
+        with self.lock:
+            node = self.trie
+            for level in levels:
+                node = node['children'].setdefault(level, {"children": {}, "handlers": []})
+
+            node['handlers'].append(handler)
+            self.resolved = {}
+
+        self.log.debug(f"Registered {topic_filter}")
+
+    def match(self, node:dict, levels:list, handlers:list) -> list:
+        if not levels:
+            handlers += node['handlers']
+            # a/# matches a as well
+            if "#" in node['children']:
+                handlers += node['children']['#']['handlers']
+            return handlers
+
+        # Topics starting with $ aren't matched by wildcards on the first level
+        wildcards = not (node is self.trie and levels[0].startswith("$"))
+
+        if wildcards and "#" in node['children']:
+            handlers += node['children']['#']['handlers']
+        if levels[0] in node['children']:
+            self.match(node['children'][levels[0]], levels[1:], handlers)
+        if wildcards and "+" in node['children']:
+            self.match(node['children']['+'], levels[1:], handlers)
+
+        return handlers
+
+    def handlers(self, topic:str) -> list:
+        """ Return the handlers for a topic"""
+        if (handlers := self.resolved.get(topic)) is None:
+            with self.lock:
+                # Wildcard subscriptions can bring in any topic, don't grow forever
+                if len(self.resolved) >= 1024:
+                    self.resolved = {}
+                handlers = self.resolved[topic] = self.match(self.trie, topic.split("/"), [])
+
+        return handlers
+
+    def route(self, topic:str, payload:bytes) -> int:
+        """ Hand a message to its handlers, returns how many there were"""
+        handlers = self.handlers(topic)
+        if not handlers:
+            self.unrouted += 1
+            return 0
+
+        payload = payload.decode("utf-8") if isinstance(payload, bytes) else payload
+        self.log.debug("MQTT %s >> %s", topic, payload)
+
+        self.routed += 1
+        if self.routed % SAMPLE_EVERY:
+            for handler in handlers:
+                handler(payload)
+            return len(handlers)
+
+        received = metrics.received.time = time.monotonic()
+        try:
+            for handler in handlers:
+                handler(payload)
+        finally:
+            metrics.received.time = None
+
+        HANDLE_SECONDS.observe(time.monotonic() - received)
+        return len(handlers)
+
+    def collect(self) -> list:
+        return [("soundboard_mqtt_messages_total", "counter", "MQTT messages received",
+                 [({"handled": "true"}, self.routed), ({"handled": "false"}, self.unrouted)])]
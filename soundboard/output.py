@@ -0,0 +1,186 @@
+import time
+import wave
+import numpy
+import ctypes
+import logging
+import threading
+
+class outputError(Exception):
+    pass
+
+class outputBackend():
+    """
+        Where the mixer writes its periods of s16 PCM. write() takes any
+        bytes-like object, and blocks while the device buffer is full, so
+        the mixer runs in real time.
+    """
+    name = None
+
+    def write(self, buffer) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """ Drop everything that is buffered but not played yet"""
+
+    def drain(self) -> None:
+        """ Block until everything that is buffered has been played"""
+
+    def latency(self) -> float:
+        """ Seconds until a write is heard, None when unknown"""
+        return None
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "latency": self.latency()}
+
+class nullOutput(outputBackend):
+    """
+        Discards the audio. With pacing, writes block like a real sink with
+        a small buffer that plays in real time, without it audio is consumed
+        as fast as it's written.
+    """
+    name = "null"
+
+    def __init__(self, pacing:bool=True, samplerate:int=44100, channels:int=2, buffer_time:float=0.05) -> None:
+        self.pacing = pacing
+        self.bytes_per_second = samplerate * channels * 2
+        self.buffer_time = buffer_time
+        self.lock = threading.Lock()
+        self.played_until = 0.0
+        self.writes = 0
+        self.bytes = 0
+        self.flushes = 0
+
+    def store(self, buffer) -> None:
+        pass
+
+    def write(self, buffer) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.played_until = max(now, self.played_until) + len(buffer) / self.bytes_per_second
+            self.writes += 1
+            self.bytes += len(buffer)
+            self.store(buffer)
+            wait = self.played_until - now - self.buffer_time
+
+        # Block until the buffer has room again, like pa_simple_write
+        if self.pacing and wait > 0:
+            time.sleep(wait)
+
+    def flush(self) -> None:
+        with self.lock:
+            self.played_until = time.monotonic()
+            self.flushes += 1
+
+    def drain(self) -> None:
+        if self.pacing:
+            time.sleep(max(self.latency(), 0.0))
+
+    def latency(self) -> float:
+        return max(self.played_until - time.monotonic(), 0.0) if self.pacing else 0.0
+
+    def stats(self) -> dict:
+        return {**super().stats(), "writes": self.writes, "bytes": self.bytes, "flushes": self.flushes}
+
+class wavOutput(nullOutput):
+    """ Like nullOutput, but keeps the audio in a wav file"""
+    name = "wav"
+
+    def __init__(self, path:str, pacing:bool=True, samplerate:int=44100, channels:int=2, buffer_time:float=0.05) -> None:
+        super().__init__(pacing, samplerate, channels, buffer_time)
+        self.path = path
+        self.wav = wave.open(path, "wb")
+        self.wav.setnchannels(channels)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(samplerate)
+
+    def store(self, buffer) -> None:
+        self.wav.writeframes(buffer)
+
+    def close(self) -> None:
+        with self.lock:
+            self.wav.close()
+
+SND_PCM_STREAM_PLAYBACK = 0
+SND_PCM_FORMAT_S16_LE = 2
+SND_PCM_ACCESS_RW_INTERLEAVED = 3
+
+class alsaOutput(outputBackend):
+    """ Plays directly on an ALSA device through libasound, for machines without pulseaudio"""
+    name = "alsa"
+    log = logging.getLogger("ALSA")
+
+    def __init__(self, device:str="default", samplerate:int=44100, channels:int=2, latency:float=0.08) -> None:
+        self.device = device
+        self.samplerate = samplerate
+        self.frame_size = channels * 2
+
+        self.asound = ctypes.cdll.LoadLibrary("libasound.so.2")
+        self.asound.snd_strerror.restype = ctypes.c_char_p
+        self.asound.snd_pcm_writei.restype = ctypes.c_long
+        self.asound.snd_pcm_writei.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong]
+
+        self.pcm = ctypes.c_void_p()
+        self.check(self.asound.snd_pcm_open(ctypes.byref(self.pcm), device.encode("utf-8"),
+                                            SND_PCM_STREAM_PLAYBACK, 0), f"Opening {device}")
+        self.check(self.asound.snd_pcm_set_params(self.pcm, SND_PCM_FORMAT_S16_LE, SND_PCM_ACCESS_RW_INTERLEAVED,
+                                                  channels, samplerate, 1, int(latency * 1000000)),
+                   f"Configuring {device}")
+        self.log.info(f"Opened {device}, latency {self.latency() * 1000:.1f}ms")
+
+    def check(self, result:int, action:str) -> int:
+        if result < 0:
+            raise outputError(f"{action} failed ({self.asound.snd_strerror(result).decode('utf-8', 'replace')})")
+        return result
+
+    def write(self, buffer) -> None:
+        # Passed by address, read only buffers aren't copied either
+        data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        address, frames = data.ctypes.data, len(data) // self.frame_size
+        while frames:
+            written = self.asound.snd_pcm_writei(self.pcm, address, frames)
+            if written < 0:
+                # Underruns and suspends are recovered by preparing the device again
+                self.check(self.asound.snd_pcm_recover(self.pcm, int(written), 1), f"Writing to {self.device}")
+                continue
+            address += written * self.frame_size
+            frames -= written
+
+    def flush(self) -> None:
+        self.check(self.asound.snd_pcm_drop(self.pcm), "Dropping")
+        self.check(self.asound.snd_pcm_prepare(self.pcm), "Preparing")
+
+    def drain(self) -> None:
+        self.check(self.asound.snd_pcm_drain(self.pcm), "Draining")
+        self.check(self.asound.snd_pcm_prepare(self.pcm), "Preparing")
+
+    def latency(self) -> float:
+        delay = ctypes.c_long(0)
+        if self.asound.snd_pcm_delay(self.pcm, ctypes.byref(delay)) < 0:
+            return None
+        return max(delay.value, 0) / self.samplerate
+
+    def close(self) -> None:
+        self.asound.snd_pcm_close(self.pcm)
+
+def open_output(config:dict, samplerate:int=44100, channels:int=2) -> outputBackend:
+    """ Open the backend configured in the output section"""
+    backend = config.get('backend', "pulseaudio")
+
+    if backend == "pulseaudio":
+        # Only load libpulse when it's used
+        from soundboard.pulseaudio import pulseaudio
+        return pulseaudio(samplerate, channels, config, config.get('reconnect', {}))
+
+    if backend == "alsa":
+        return alsaOutput(config.get('device', "default"), samplerate, channels, config.get('tlength', 0.08))
+
+    if backend == "wav":
+        return wavOutput(config.get('path', "output.wav"), config.get('pacing', True), samplerate, channels)
+
+    if backend == "null":
+        return nullOutput(config.get('pacing', True), samplerate, channels)
+
+    raise ValueError(f"Unknown output backend {backend}, use pulseaudio, alsa, wav or null")
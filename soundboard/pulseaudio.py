@@ -1,4 +1,16 @@
+import time
+import numpy
 import ctypes
+import logging
+import threading
+
+from soundboard.output import outputBackend, outputError
+
+PA_STREAM_PLAYBACK = 1
+PA_SAMPLE_S16LE = 3
+# (uint32_t) -1, let the server pick
+PA_UNSET = 0xFFFFFFFF
+PA_USEC_INVALID = 0xFFFFFFFFFFFFFFFF
 
 class struct_pa_sample_spec(ctypes.Structure):
     __slots__ = [
@@ -7,30 +19,144 @@ class struct_pa_sample_spec(ctypes.Structure):
         'channels',
     ]
 
-struct_pa_sample_spec._fields_ = [ ('format', ctypes.c_int), 
+struct_pa_sample_spec._fields_ = [ ('format', ctypes.c_int),
     ('rate', ctypes.c_uint32), ('channels', ctypes.c_uint8)]
-    
+
 pa_sample_spec = struct_pa_sample_spec
-error = ctypes.c_int(0)
+
+class struct_pa_buffer_attr(ctypes.Structure):
+    _fields_ = [('maxlength', ctypes.c_uint32), ('tlength', ctypes.c_uint32),
+                ('prebuf', ctypes.c_uint32), ('minreq', ctypes.c_uint32), ('fragsize', ctypes.c_uint32)]
 
 #TODO fix name showing up correctly
-class pulseaudio():
-    ss = struct_pa_sample_spec(3, 44100, 2)
+class pulseaudio(outputBackend):
+    """
+        A pa_simple playback stream. The buffer attributes keep the server
+        side buffer short (tlength), so a flush or ducking is in sync with
+        what is heard. When the daemon goes away the stream is opened again
+        with a backoff. The handle is only used while holding the lock,
+        other threads ask for the latency while the mixer reconnects.
+    """
+    name = "pulseaudio"
+    log = logging.getLogger("Pulseaudio")
+
+    def __init__(self, samplerate=44100, channels=2, buffer_attr:dict=None, reconnect:dict=None):
+        self.ss = struct_pa_sample_spec(PA_SAMPLE_S16LE, samplerate, channels)
+        self.bytes_per_second = samplerate * channels * 2
+        self.attr = self.buffer_attr(buffer_attr or {})
+        self.error = ctypes.c_int(0)
 
-    def __init__(self, samplerate=44100, channels=2):
-        self.ss.rate = samplerate
-        self.ss.channels = channels
+        reconnect = reconnect or {}
+        self.backoff_min = reconnect.get('min', 0.5)
+        self.backoff_max = reconnect.get('max', 30)
+        self.backoff = self.backoff_min
 
         self.pa = ctypes.cdll.LoadLibrary('libpulse-simple.so.0')
-        self.pa.strerror.restype = ctypes.c_char_p
-        
-        self.stream = self.pa.pa_simple_new(None,"Soundboard".encode("ascii"), 1, 
-        None, "Soundboard playback".encode("ascii"), ctypes.byref(self.ss), None, None,
-        ctypes.byref(error))
-        self.pa.pa_simple_flush(self.stream)
+        self.pa.pa_strerror.restype = ctypes.c_char_p
+        self.pa.pa_simple_new.restype = ctypes.c_void_p
+        self.pa.pa_simple_get_latency.restype = ctypes.c_uint64
+
+        self.stream = None
+        self.lock = threading.RLock()
+        try:
+            self.connect()
+        except outputError as e:
+            # Keep running, the first write tries again
+            self.log.error(f"{e}, retrying when something plays")
+
+    def buffer_attr(self, config:dict) -> struct_pa_buffer_attr:
+        """ Buffer attributes from seconds, unset ones are left to the server"""
+        def size(key:str, default:float) -> int:
+            seconds = config.get(key, default)
+            if seconds is None:
+                return PA_UNSET
+            # Whole frames
+            return int(seconds * self.bytes_per_second) // 4 * 4
+
+        return struct_pa_buffer_attr(maxlength=PA_UNSET, tlength=size('tlength', 0.08),
+                                     prebuf=size('prebuf', None), minreq=size('minreq', 0.02),
+                                     fragsize=PA_UNSET)
+
+    def strerror(self) -> str:
+        return self.pa.pa_strerror(self.error).decode("utf-8", "replace")
+
+    def connect(self) -> None:
+        stream = self.pa.pa_simple_new(None,"Soundboard".encode("ascii"), PA_STREAM_PLAYBACK,
+        None, "Soundboard playback".encode("ascii"), ctypes.byref(self.ss), None, ctypes.byref(self.attr),
+        ctypes.byref(self.error))
+        if not stream:
+            raise outputError(f"Couldn't connect to pulseaudio ({self.strerror()})")
+
+        with self.lock:
+            self.stream = ctypes.c_void_p(stream)
+            self.pa.pa_simple_flush(self.stream, ctypes.byref(self.error))
+        self.log.info(f"Connected, tlength {self.attr.tlength / self.bytes_per_second * 1000:.0f}ms, "
+                      f"latency {(self.latency() or 0.0) * 1000:.1f}ms")
+
+    def disconnect(self) -> None:
+        with self.lock:
+            if self.stream is not None:
+                self.pa.pa_simple_free(self.stream)
+                self.stream = None
+
+    def reconnect(self) -> None:
+        """ Open the stream again, waiting longer after every failure"""
+        time.sleep(self.backoff)
+        try:
+            self.connect()
+        except outputError:
+            self.backoff = min(self.backoff * 2, self.backoff_max)
+            raise
+
+        self.backoff = self.backoff_min
+
+    def check(self, result:int, action:str) -> None:
+        """ A failing stream is closed, the next write reconnects. Called with the lock held"""
+        if result < 0:
+            error = self.strerror()
+            self.disconnect()
+            raise outputError(f"{action} failed ({error})")
+
+    def chunks(self, buffer, size=4096):
+        """ Split a buffer into period sized (address, length) pairs"""
+        # The address works for read only buffers too, like views on the sample bank
+        data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        address = data.ctypes.data
+        for offset in range(0, len(data), size):
+            yield ctypes.c_void_p(address + offset), min(size, len(data) - offset)
 
     def write(self, buffer):
-        self.pa.pa_simple_write(self.stream, buffer, len(buffer), ctypes.byref(error))
-    
+        """ Write any bytes-like object, it's handed to pulseaudio without a copy"""
+        if self.stream is None:
+            self.reconnect()
+
+        for address, length in self.chunks(buffer):
+            # Per chunk, so latency() never waits longer than one chunk
+            with self.lock:
+                if self.stream is None:
+                    raise outputError("Write failed (disconnected)")
+                self.check(self.pa.pa_simple_write(self.stream, address, ctypes.c_size_t(length), ctypes.byref(self.error)), "Write")
+
     def flush(self):
-        self.pa.pa_simple_flush(self.stream)
\ No newline at end of file
+        with self.lock:
+            if self.stream is not None:
+                self.check(self.pa.pa_simple_flush(self.stream, ctypes.byref(self.error)), "Flush")
+
+    def drain(self) -> None:
+        with self.lock:
+            if self.stream is not None:
+                self.check(self.pa.pa_simple_drain(self.stream, ctypes.byref(self.error)), "Drain")
+
+    def latency(self) -> float:
+        """ Seconds of audio buffered in the server and the sink, None while disconnected"""
+        with self.lock:
+            if self.stream is None:
+                return None
+
+            usec = self.pa.pa_simple_get_latency(self.stream, ctypes.byref(self.error))
+        if usec == PA_USEC_INVALID:
+            return None
+        return usec / 1000000
+
+    def close(self) -> None:
+        self.disconnect()
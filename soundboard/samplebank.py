@@ -0,0 +1,310 @@
+import os
+import json
+import mmap
+import time
+import yaml
+import types
+import logging
+import argparse
+import threading
+
+from soundboard import ingest, metrics
+
+ALIGN = mmap.PAGESIZE
+
+class sampleBank():
+    """
+        Every converted sample of the library packed into one file that is
+        memory mapped, with an index of (offset, length) per sample. Playing
+        a sample is a slice of the mapping, so no PCM is read or copied and
+        other processes that map the bank share it through the page cache.
+        Once a sample is packed its converted wav is removed, the bank is
+        where the ingested PCM is kept.
+
+        The bank is only written by its own thread: new and changed samples
+        are appended, removed ones leave a hole until the holes make up
+        more than the compact ratio and the bank is rewritten. Readers keep
+        the old file mapped until they pick up the new index.
+    """
+    log = logging.getLogger("Sample Bank")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('samplebank', {})
+        self.enabled = config.get('enabled', True)
+        self.compact_ratio = config.get('compact', 0.5)
+        self.poll_interval = self.soundboard.config.get('sampleindex', {}).get('poll_interval', 2.0)
+        self.sample_path = os.path.normpath(self.soundboard.config['sample_path'])
+        self.directory = os.path.realpath(self.sample_path)
+        self.path = config.get('path', os.path.join(self.sample_path, ingest.INGEST_DIR, "bank.pcm"))
+        self.index_path = f"{os.path.splitext(self.path)[0]}.json"
+
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.entries = {}
+        self.size = 0
+        self.dead = 0
+        self.mapping = None
+        self.view = None
+        self.index_mtime = None
+        self.checked = 0.0
+        self.hits = 0
+        self.misses = 0
+        metrics.REGISTRY.collector(metrics.cache_collector("bank", self.stats))
+
+        if self.enabled:
+            self.load()
+
+    def load(self) -> None:
+        """ Map the bank as described by its index"""
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        if index.get('ingest_version') != ingest.VERSION:
+            self.log.info("Bank was built from older conversions, it will be rebuilt")
+            return
+
+        try:
+            entries = {name: tuple(entry) for name, entry in index['entries'].items()}
+            mapping, view = self.map(index['size'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # It's only a cache, play from the sample cache until it's packed again
+            self.log.warning(f"Couldn't map the bank ({e}), it will be rebuilt")
+            self.reset()
+            self.index_mtime = mtime
+            self.changed.set()
+            return
+
+        with self.lock:
+            self.entries, self.size, self.dead = entries, index['size'], index.get('dead', 0)
+            self.mapping, self.view, self.index_mtime = mapping, view, mtime
+
+        self.log.info(f"Mapped {len(entries)} samples, {self.size / 1024 / 1024:.1f}MiB")
+
+    def map(self, size:int) -> tuple:
+        if not size:
+            return None, None
+
+        with open(self.path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        return mapping, memoryview(mapping)
+
+    def refresh(self) -> None:
+        """ Pick up a bank rewritten by another process, at most once a second"""
+        now = time.monotonic()
+        if now - self.checked < 1.0:
+            return
+
+        self.checked = now
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+
+        if mtime != self.index_mtime:
+            self.load()
+
+    def find(self, sample:str) -> tuple:
+        """ Return the (entry, view) of a sample, (None, None) when it isn't in the bank"""
+        if not self.enabled:
+            return None, None
+
+        self.refresh()
+        directory, name = os.path.split(sample)
+        with self.lock:
+            entry, view = self.entries.get(name), self.view
+
+        if entry is None or view is None or (directory != self.sample_path and os.path.realpath(directory) != self.directory):
+            return None, None
+
+        offset, length, mtime_ns, size = entry
+        try:
+            stat = os.stat(sample)
+        except FileNotFoundError:
+            stat = None
+
+        if stat is None or (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size) or offset + length > len(view):
+            return None, None # Changed since it was packed
+
+        return entry, view
+
+    def contains(self, sample:str) -> bool:
+        return self.find(sample)[0] is not None
+
+    def get(self, sample:str) -> memoryview:
+        """ Return the PCM of a sample as a view on the bank, None when it isn't in it"""
+        entry, view = self.find(sample)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        offset, length = entry[:2]
+        return view[offset:offset + length]
+
+    def current(self, name:str, entry:tuple) -> bool:
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) == entry[2:]
+
+    def sync(self) -> int:
+        """ Bring the bank up to date with the ingested library, returns the samples added"""
+        if self.size and not os.path.exists(self.path):
+            self.log.warning(f"{self.path} disappeared, packing everything again")
+            self.reset()
+
+        entries = dict(self.entries)
+        dead = self.dead
+        for name, entry in list(entries.items()):
+            if not self.current(name, entry):
+                del entries[name]
+                dead += entry[1]
+
+        added = []
+        for sample in self.soundboard.sampleIndex.files("samples"):
+            name = os.path.basename(sample['path'])
+            if name in entries:
+                # Converted again while it was packed
+                self.soundboard.ingest.packed(sample['path'], *entries[name][2:])
+                continue
+
+            if (meta := self.soundboard.ingest.sidecar(sample['path'])) is None:
+                continue
+
+            if (pcm := self.soundboard.ingest.read_pcm(sample['path'])) is not None:
+                added.append((sample['path'], name, pcm, meta['source_mtime'], meta['source_size']))
+            else:
+                # Its wav was removed when it was packed and the bank lost it
+                self.soundboard.ingest.submit(sample['path'])
+
+        if not added and dead == self.dead:
+            return 0
+
+        size = self.size
+        if not size and os.path.exists(self.path):
+            # Stale or unindexed, readers may still map it so it isn't truncated
+            os.remove(self.path)
+
+        with open(self.path, "r+b" if size else "wb") as f:
+            # Anything past the index is from an interrupted sync
+            f.truncate(size)
+            f.seek(size)
+            for path, name, pcm, mtime_ns, source_size in added:
+                # Page aligned, so a sample starts on its own page
+                padding = -size % ALIGN
+                f.write(bytes(padding))
+                entries[name] = (size + padding, len(pcm), mtime_ns, source_size)
+                f.write(pcm)
+                size += padding + len(pcm)
+
+        live = size - dead
+        if dead and dead > live * self.compact_ratio:
+            entries, size, dead = self.compact(entries)
+
+        self.publish(entries, size, dead)
+        for path, name, pcm, mtime_ns, source_size in added:
+            self.soundboard.ingest.packed(path, mtime_ns, source_size)
+
+        self.log.info(f"Added {len(added)} samples, {len(entries)} in the bank, "
+                      f"{size / 1024 / 1024:.1f}MiB of which {dead / 1024 / 1024:.1f}MiB unused")
+        return len(added)
+
+    def compact(self, entries:dict) -> tuple:
+        """ Rewrite the bank without the holes of removed samples"""
+        with open(self.path, "rb") as f:
+            old = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        compacted = {}
+        size = 0
+        with old, open(f"{self.path}.tmp", "wb") as f:
+            for name, (offset, length, mtime_ns, source_size) in sorted(entries.items(), key=lambda e: e[1][0]):
+                padding = -size % ALIGN
+                f.write(bytes(padding))
+                f.write(old[offset:offset + length])
+                compacted[name] = (size + padding, length, mtime_ns, source_size)
+                size += padding + length
+
+        # Mappings of the old file stay valid, replacing it doesn't touch them
+        os.replace(f"{self.path}.tmp", self.path)
+        self.log.info(f"Compacted the bank to {size / 1024 / 1024:.1f}MiB")
+        return compacted, size, 0
+
+    def publish(self, entries:dict, size:int, dead:int) -> None:
+        """ Write the index and map the bank in its new size"""
+        with open(f"{self.index_path}.tmp", "w") as f:
+            json.dump({"ingest_version": ingest.VERSION, "size": size, "dead": dead,
+                       "entries": entries}, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+
+        mapping, view = self.map(size)
+        with self.lock:
+            # Views handed out earlier keep the old mapping alive
+            self.entries, self.size, self.dead = entries, size, dead
+            self.mapping, self.view = mapping, view
+            self.index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    def reset(self) -> None:
+        with self.lock:
+            self.entries, self.size, self.dead = {}, 0, 0
+            self.mapping, self.view = None, None
+
+    def clear(self) -> None:
+        """ Remove the bank, its samples are converted and packed again"""
+        for path in (self.path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.reset()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"enabled": self.enabled, "entries": len(self.entries), "bytes": self.size, "unused": self.dead,
+                "hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+    def bank_thread(self) -> None:
+        """ Sync when the library changes or a sample was ingested"""
+        if not self.enabled:
+            return
+
+        version = None
+        while True:
+            try:
+                if self.soundboard.sampleIndex.version != version or self.changed.is_set():
+                    version = self.soundboard.sampleIndex.version
+                    self.changed.clear()
+                    self.sync()
+            except Exception as e:
+                self.log.error(f"Error while updating the sample bank ({e})")
+
+            self.changed.wait(self.poll_interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack the ingested sample library into the sample bank")
+    parser.add_argument("--config", default="config.yml")
+    parser.add_argument("--rebuild", action="store_true", help="Start from an empty bank")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    with open(args.config, "r") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    # Imported here, the sample index isn't needed to read the bank
+    from soundboard.loudness import loudnessIndex
+    from soundboard.sampleindex import sampleIndex
+
+    soundboard = types.SimpleNamespace(config=config)
+    soundboard.sampleIndex = sampleIndex(soundboard)
+    soundboard.loudness = loudnessIndex(soundboard)
+    soundboard.ingest = ingest.sampleIngest(soundboard)
+    soundboard.sampleBank = bank = sampleBank(soundboard)
+    if args.rebuild:
+        bank.clear()
+
+    # Samples that were only kept in the bank are converted again, there's no ingest thread here
+    soundboard.ingest.reingest_all()
+    print(f"Packed {bank.sync()} samples")
@@ -0,0 +1,115 @@
+import os
+import logging
+import threading
+
+from collections import OrderedDict
+
+class pcmCache():
+    """
+        A byte bounded LRU cache of PCM buffers. Entries are keyed by
+        anything hashable and can carry a version, a lookup with another
+        version is a miss that drops the entry. The least recently used
+        entries are evicted once the byte budget is exceeded.
+    """
+    log = logging.getLogger("PCM Cache")
+
+    def __init__(self, max_bytes:int) -> None:
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version=None) -> bytes:
+        """ Return the cached PCM, None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return entry[1]
+
+                # Changed since it was cached
+                self._remove(key)
+            self.misses += 1
+
+    def put(self, key, pcm:bytes, version=None) -> bytes:
+        """ Store a buffer and evict the least recently used ones if needed, returns the stored buffer"""
+        if isinstance(pcm, memoryview):
+            # A trimmed slice keeps the whole decoded buffer alive, only keep what's played
+            pcm = bytes(pcm)
+
+        if len(pcm) > self.max_bytes:
+            self.log.debug(f"Not caching {key}, {len(pcm)} bytes is over the budget")
+            return pcm
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (version, pcm)
+            self.size += len(pcm)
+
+            while self.size > self.max_bytes:
+                evicted = next(iter(self.entries))
+                self.log.debug(f"Evicting {evicted}")
+                self._remove(evicted)
+                self.evictions += 1
+
+        return pcm
+
+    def invalidate(self, key) -> None:
+        """ Drop an entry from the cache"""
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": self.size,
+                    "max_bytes": self.max_bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+    def _remove(self, key) -> None:
+        _, pcm = self.entries.pop(key)
+        self.size -= len(pcm)
+
+class sampleCache(pcmCache):
+    """
+        Keeps fully prepared (44.1 kHz, stereo, s16) PCM buffers in memory
+        so that playing the same sample twice doesn't decode it twice.
+        Entries are keyed by path and validated against the mtime and size
+        of the file.
+    """
+    log = logging.getLogger("Sample Cache")
+
+    def __init__(self, loader, max_bytes:int=64 * 1024 * 1024) -> None:
+        super().__init__(max_bytes)
+        self.loader = loader
+
+    def file_key(self, path:str) -> tuple:
+        """ Return the key that identifies the current version of a file"""
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path:str) -> bytes:
+        """ Return the prepared PCM for path, decoding it on a miss"""
+        version = self.file_key(path)
+        if (pcm := super().get(path, version)) is None:
+            pcm = self.put(path, self.loader(path), version)
+
+        return pcm
+
+    def warm(self, path:str) -> None:
+        """ Decode a sample into the cache without playing it"""
+        self.get(path)
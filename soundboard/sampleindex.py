@@ -0,0 +1,235 @@
+import os
+import re
+import time
+import struct
+import select
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+class inotify():
+    """ Minimal ctypes wrapper around the linux inotify API"""
+
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+
+    def add_watch(self, path:str, mask:int=WATCH_MASK) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, path.encode("utf-8"), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read(self, timeout:float) -> list:
+        """ Return a list of (wd, mask, name) events, waits at most timeout"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+            offset += length
+            events.append((wd, mask, name))
+
+        return events
+
+class sampleIndex():
+    """
+        In-memory index of the sample directories. Every directory is
+        scanned once and kept up to date with inotify, or by polling the
+        directory mtime when inotify is not available. The version counter
+        is bumped on every change so that callers can key caches on it.
+    """
+    log = logging.getLogger("Sample Index")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        self.lock = threading.Lock()
+        self.version = 0
+        self.directories = {}
+        self.entries = {}
+        self.sorted = {}
+        self.dir_mtimes = {}
+        self.watches = {}
+        self.found = {}
+        self.poll_interval = self.soundboard.config.get('sampleindex', {}).get('poll_interval', 2.0)
+
+        try:
+            self.inotify = inotify()
+        except (OSError, AttributeError, TypeError) as e:
+            self.log.warning(f"inotify not available, falling back to polling ({e})")
+            self.inotify = None
+
+        config = self.soundboard.config
+        self.add_directory("samples", config['sample_path'])
+
+        if "themesongs" in config:
+            self.add_directory("themesongs", config['themesongs'])
+
+        if "door" in config:
+            self.add_directory("door", config['door']['samples'])
+            self.add_directory("doorbell", os.path.join(config['door']['samples'], "doorbell"))
+
+    def add_directory(self, key:str, path:str) -> None:
+        """ Add a directory to the index and scan it"""
+        self.directories[key] = path
+        self.scan(key)
+        self.watch(key)
+
+    def watch(self, key:str) -> None:
+        if self.inotify is None or key in self.watches.values():
+            return
+
+        try:
+            wd = self.inotify.add_watch(self.directories[key])
+        except OSError:
+            return # Picked up by polling once the directory exists
+
+        self.watches[wd] = key
+
+    def scan(self, key:str) -> None:
+        """ (Re)scan a complete directory"""
+        path = self.directories[key]
+        entries = {}
+
+        try:
+            self.dir_mtimes[key] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                for dirent in it:
+                    if not dirent.is_dir():
+                        entries[dirent.name] = self.make_entry(path, dirent.name, dirent.stat())
+        except FileNotFoundError:
+            self.dir_mtimes[key] = None
+
+        with self.lock:
+            if entries != self.entries.get(key):
+                self.entries[key] = entries
+                self.sorted.pop(key, None)
+                self.version += 1
+
+    def make_entry(self, path:str, file:str, stat:os.stat_result) -> dict:
+        return {"name": os.path.splitext(file)[0],
+                "ext": os.path.splitext(file)[-1],
+                "path": os.path.join(path, file),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime}
+
+    def update_file(self, key:str, file:str) -> None:
+        """ Update a single file after an inotify event"""
+        path = self.directories[key]
+
+        try:
+            stat = os.stat(os.path.join(path, file))
+            entry = None if os.path.isdir(os.path.join(path, file)) else self.make_entry(path, file, stat)
+        except FileNotFoundError:
+            entry = None
+
+        with self.lock:
+            entries = self.entries.setdefault(key, {})
+            if entry is None:
+                if entries.pop(file, None) is None:
+                    return
+            elif entries.get(file) == entry:
+                return
+            else:
+                entries[file] = entry
+
+            self.sorted.pop(key, None)
+            self.version += 1
+
+    def files(self, key:str) -> list:
+        """ Return the entries of a directory, sorted by filename"""
+        with self.lock:
+            if key not in self.sorted:
+                entries = self.entries.get(key, {})
+                self.sorted[key] = [entries[file] for file in sorted(entries)]
+            return self.sorted[key]
+
+    def exists(self, key:str) -> bool:
+        return self.dir_mtimes.get(key) is not None
+
+    def find(self, key:str, pattern:str) -> str:
+        """ Return the path of the first file matching pattern"""
+        # Lookups are remembered until the index changes
+        lookup = (self.version, key, pattern)
+        if lookup in self.found:
+            return self.found[lookup]
+
+        if len(self.found) >= 1024:
+            self.found = {}
+
+        match = None
+        for entry in self.files(key):
+            if re.search(pattern, os.path.basename(entry['path']), re.IGNORECASE):
+                match = entry['path']
+                break
+
+        self.found[lookup] = match
+        return match
+
+    def poll(self) -> None:
+        """ Rescan directories whose mtime changed, or that aren't watched"""
+        for key, path in self.directories.items():
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+
+            if mtime != self.dir_mtimes.get(key):
+                self.log.debug(f"{path} changed, rescanning")
+                self.scan(key)
+                self.watch(key)
+
+    def index_thread(self) -> None:
+        """ Keep the index up to date"""
+        while True:
+            try:
+                if self.inotify is None:
+                    time.sleep(self.poll_interval)
+                    self.poll()
+                    continue
+
+                events = self.inotify.read(self.poll_interval)
+                if not events:
+                    # Nothing happened, catch directories we can't watch
+                    self.poll()
+
+                for wd, mask, name in events:
+                    key = self.watches.get(wd)
+                    if key is None:
+                        continue
+
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        del self.watches[wd]
+                        self.scan(key)
+                    elif name:
+                        self.update_file(key, name)
+
+            except Exception as e:
+                self.log.error(f"Error while updating sample index ({e})")
+                time.sleep(self.poll_interval)
@@ -0,0 +1,165 @@
+import time
+import logging
+import threading
+
+from collections import deque
+from typing import NamedTuple, Union
+
+from soundboard import metrics
+
+# Highest priority first
+PRIORITIES = ("doorbell", "door", "themesong", "speech", "play")
+
+DEFAULTS = {
+    "doorbell": {"depth": 2, "overflow": "drop_newest", "coalesce": 5.0, "voices": 1, "preempt": True},
+    "door": {"depth": 2, "overflow": "drop_oldest", "coalesce": 2.0, "voices": 1, "preempt": False},
+    "themesong": {"depth": 4, "overflow": "drop_oldest", "coalesce": 10.0, "voices": 1, "preempt": False},
+    "speech": {"depth": 8, "overflow": "drop_oldest", "coalesce": 0.0, "voices": 1, "preempt": False},
+    "play": {"depth": 8, "overflow": "drop_newest", "coalesce": 0.5, "voices": 4, "preempt": False},
+}
+
+STAGE_SECONDS = metrics.histogram_metric("soundboard_stage_seconds",
+    "Time between two stages of playing a sample (enqueue, queue, decode, output)", ("stage",))
+QUEUE_WAIT_SECONDS = metrics.histogram_metric("soundboard_queue_wait_seconds",
+    "Time jobs waited in the scheduler", ("priority",))
+
+class playbackJob(NamedTuple):
+    priority: str
+    sample: Union[str, bytes] # A path or s16 stereo PCM
+    pause: bool
+    name: str
+    enqueued: float
+    received: float # When the MQTT message arrived, None for other sources
+    gain: float = None # Measured by whoever made the PCM, None lets the sample player decide
+
+class playbackScheduler():
+    """
+        Decides what the sample player plays next. Every priority class
+        (doorbell > door > themesong > speech > play) has its own queue with
+        a maximum depth, an overflow policy and a window in which duplicate
+        jobs are coalesced, and a limit on how many of its voices play at
+        the same time. A class can preempt the voices of lower classes.
+    """
+    log = logging.getLogger("Scheduler")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('scheduler', {})
+        self.classes = {priority: {**DEFAULTS[priority], **config.get(priority, {})} for priority in PRIORITIES}
+
+        self.condition = threading.Condition()
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.playing = {priority: [] for priority in PRIORITIES}
+        self.recent = {priority: {} for priority in PRIORITIES}
+        self.counters = {priority: {"submitted": 0, "played": 0, "dropped": 0, "coalesced": 0,
+                                    "preempted": 0, "wait_total": 0.0, "wait_max": 0.0}
+                         for priority in PRIORITIES}
+
+        metrics.REGISTRY.collector(self.collect)
+
+    def submit(self, sample, priority:str="play", pause:bool=False, name:str=None, gain:float=None) -> bool:
+        """ Queue a path or PCM, returns False when it was dropped or coalesced"""
+        settings = self.classes[priority]
+        counters = self.counters[priority]
+        name = name or (sample if isinstance(sample, str) else None)
+        now = time.monotonic()
+
+        if (received := metrics.message_received()) is not None:
+            STAGE_SECONDS.observe(now - received, "enqueue")
+
+        with self.condition:
+            counters['submitted'] += 1
+
+            coalesce = name is not None and settings['coalesce']
+            if coalesce and now - self.recent[priority].get(name, float("-inf")) < settings['coalesce']:
+                counters['coalesced'] += 1
+                self.log.debug(f"Coalesced {name} ({priority})")
+                return False
+
+            queue = self.queues[priority]
+            if len(queue) >= settings['depth']:
+                counters['dropped'] += 1
+                if settings['overflow'] == "drop_newest":
+                    self.log.info(f"{priority} queue is full, dropping {name}")
+                    return False
+
+                dropped = queue.popleft()
+                self.log.info(f"{priority} queue is full, dropping {dropped.name}")
+
+            queue.append(playbackJob(priority, sample, pause, name, now, received, gain))
+            self.condition.notify()
+
+            # Only queued jobs start a window, a dropped one didn't play
+            if coalesce:
+                recent = self.recent[priority]
+                recent[name] = now
+                if len(recent) > 256:
+                    self.recent[priority] = {k: t for k, t in recent.items() if now - t < settings['coalesce']}
+
+        return True
+
+    def active(self, priority:str) -> int:
+        """ Return the amount of voices of a class that are still playing"""
+        self.playing[priority] = [v for v in self.playing[priority] if not v.done.is_set()]
+        return len(self.playing[priority])
+
+    def ready(self) -> playbackJob:
+        """ Return the next job that is allowed to play, without blocking"""
+        for priority in PRIORITIES:
+            if self.queues[priority] and self.active(priority) < self.classes[priority]['voices']:
+                return self.queues[priority].popleft()
+
+    def next(self) -> playbackJob:
+        """ Block until a job is allowed to play"""
+        with self.condition:
+            while (job := self.ready()) is None:
+                # Voices finishing don't notify us, poll while jobs are waiting
+                self.condition.wait(0.02 if self.pending() else None)
+
+        wait = time.monotonic() - job.enqueued
+        STAGE_SECONDS.observe(wait, "queue")
+        QUEUE_WAIT_SECONDS.observe(wait, job.priority)
+        counters = self.counters[job.priority]
+        counters['wait_total'] += wait
+        counters['wait_max'] = max(counters['wait_max'], wait)
+        counters['played'] += 1
+        return job
+
+    def started(self, job:playbackJob, voice) -> None:
+        """ Track the voice of a job, preempting lower classes when configured"""
+        with self.condition:
+            self.playing[job.priority].append(voice)
+
+            if not self.classes[job.priority]['preempt']:
+                return
+
+            for priority in PRIORITIES[PRIORITIES.index(job.priority) + 1:]:
+                for preempted in self.playing[priority]:
+                    self.log.info(f"{job.name} ({job.priority}) preempts {preempted.name}")
+                    preempted.stop()
+                    self.counters[priority]['preempted'] += 1
+                self.playing[priority] = []
+
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def clear(self) -> None:
+        """ Drop everything that is queued"""
+        with self.condition:
+            for queue in self.queues.values():
+                queue.clear()
+
+    def collect(self) -> list:
+        stats = self.stats()
+        return [("soundboard_queue_depth", "gauge", "Jobs waiting per priority class",
+                 [({"priority": p}, s['queued']) for p, s in stats.items()])] + \
+               [(f"soundboard_jobs_{key}_total", "counter", f"Jobs {key} per priority class",
+                 [({"priority": p}, s[key]) for p, s in stats.items()])
+                for key in ("submitted", "played", "dropped", "coalesced", "preempted")]
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {priority: {"queued": len(self.queues[priority]), "playing": self.active(priority),
+                               "wait_avg": counters['wait_total'] / counters['played'] if counters['played'] else 0.0,
+                               **counters}
+                    for priority, counters in self.counters.items()}
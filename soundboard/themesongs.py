@@ -1,5 +1,4 @@
 import os
-import re
 import json
 import logging
 
@@ -9,6 +8,9 @@ class themeSongs():
     def __init__(self, soundboard) -> None:
         self.soundboard = soundboard
 
+    def register_mqtt(self, router) -> None:
+        router.register("space/door/front", self.mqtt_trigger)
+
     def mqtt_trigger(self, payload):
         try:
             payload_json = json.loads(payload)
@@ -17,13 +19,10 @@ class themeSongs():
             payload_json = None
 
         if payload_json and "name" in payload_json:
-            if not os.path.exists(self.soundboard.config['themesongs']):
+            if not self.soundboard.sampleIndex.exists("themesongs"):
                 self.log.error(f"Invalid path {self.soundboard.config['themesongs']}")
                 return
 
-            for file in os.listdir(self.soundboard.config['themesongs']):
-                if re.search(payload_json['name'], file, re.IGNORECASE):
-                    self.log.info(f"Theme song for {payload_json['name']} is {file}")
-
-                    return self.soundboard.samplePlayer.sampleQueue.put(
-                        os.path.join(self.soundboard.config['themesongs'], file))
\ No newline at end of file
+            if file := self.soundboard.sampleIndex.find("themesongs", payload_json['name']):
+                self.log.info(f"Theme song for {payload_json['name']} is {os.path.basename(file)}")
+                return self.soundboard.scheduler.submit(file, "themesong")
\ No newline at end of file
@@ -0,0 +1,210 @@
+import os
+import uuid
+import bottle
+import logging
+
+from email.message import Message
+
+CHUNK_SIZE = 64 * 1024
+MAX_HEADERS = 16 * 1024
+
+class uploadError(ValueError):
+    """ The request as a whole is rejected, status is the HTTP status to answer with"""
+
+    def __init__(self, status:int, message:str) -> None:
+        super().__init__(message)
+        self.status = status
+
+def header_params(value:str, header:str="content-type") -> Message:
+    """ Parse a header with parameters like boundary= or filename="..." """
+    message = Message()
+    message[header] = value
+    return message
+
+def multipart_events(stream, length:int, boundary:bytes, chunk_size:int=CHUNK_SIZE):
+    """
+        Read a multipart/form-data body in chunks and yield ("part",
+        headers), ("data", bytes) and ("end", None) events, so that parts
+        never have to fit in memory.
+    """
+    delimiter = b"\r\n--" + boundary
+    keep = len(delimiter) + 1
+    # The first boundary isn't preceded by a line break
+    buffer = bytearray(b"\r\n")
+    remaining = length
+
+    def fill() -> bool:
+        nonlocal remaining
+        if remaining <= 0:
+            return False
+        data = stream.read(min(chunk_size, remaining))
+        if not data:
+            raise uploadError(400, "Upload ended early")
+        remaining -= len(data)
+        buffer.extend(data)
+        return True
+
+    # Skip the preamble
+    while (index := buffer.find(delimiter)) < 0:
+        del buffer[:max(len(buffer) - keep, 0)]
+        if not fill():
+            raise uploadError(400, "Not a multipart body")
+    del buffer[:index + len(delimiter)]
+
+    while True:
+        while len(buffer) < 2 and fill():
+            pass
+        if buffer[:2] == b"--":
+            break # The closing boundary
+
+        while (end := buffer.find(b"\r\n\r\n")) < 0:
+            if len(buffer) > MAX_HEADERS or not fill():
+                raise uploadError(400, "Invalid multipart headers")
+
+        headers = {}
+        for line in buffer[:end].decode("utf-8", "replace").split("\r\n"):
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        del buffer[:end + 4]
+        yield "part", headers
+
+        while (index := buffer.find(delimiter)) < 0:
+            if len(buffer) > keep:
+                yield "data", bytes(buffer[:-keep])
+                del buffer[:-keep]
+            if not fill():
+                raise uploadError(400, "Upload ended in the middle of a file")
+
+        if index:
+            yield "data", bytes(buffer[:index])
+        del buffer[:index + len(delimiter)]
+        yield "end", None
+
+    # Read the epilogue so the connection stays usable
+    while fill():
+        buffer.clear()
+
+class uploadPart():
+    def __init__(self, filename:str, temp_path:str, sample_path:str) -> None:
+        self.filename = filename
+        self.temp_path = temp_path
+        self.sample_path = sample_path
+        self.file = open(temp_path, "wb")
+        self.size = 0
+
+    def discard(self) -> None:
+        self.file.close()
+        os.remove(self.temp_path)
+
+class uploadReceiver():
+    """
+        Streams uploaded samples to the temp directory while they arrive.
+        A file is dropped as soon as it grows past the size limit, a
+        request that can't fit the limits is refused before it's read.
+        Accepted files are handed to the ingest queue, which moves them
+        into the library once they decode.
+    """
+    log = logging.getLogger("Uploads")
+
+    def __init__(self, soundboard) -> None:
+        self.soundboard = soundboard
+        config = self.soundboard.config.get('upload', {})
+        self.max_size = int(config.get('max_size', 3) * 1024 * 1024)
+        self.max_files = config.get('max_files', 10)
+        self.extensions = tuple(ext.lower() for ext in config.get('extensions', (".flac", ".wav", ".mp3", ".ogg")))
+        self.temp_path = config.get('temp_path', "cache/uploads/")
+        os.makedirs(self.temp_path, exist_ok=True)
+
+    def receive(self) -> list:
+        """
+            Receive the files of the current request, returns a result for
+            every file: {"name", "job"} or {"name", "error"}
+        """
+        length = bottle.request.content_length
+        if length < 0:
+            raise uploadError(411, "Uploads need a Content-Length")
+
+        # Every file at the limit, plus room for the multipart headers
+        if length > self.max_files * (self.max_size + MAX_HEADERS):
+            raise uploadError(413, f"Upload is too big, at most {self.max_files} files of "
+                                   f"{self.max_size / 1024 / 1024:g}MiB are allowed")
+
+        # request.content_type is lowercased, the boundary is case sensitive
+        content_type = bottle.request.headers.get("Content-Type", "")
+        boundary = header_params(content_type).get_param("boundary")
+        if not content_type.lower().startswith("multipart/form-data") or not boundary:
+            raise uploadError(400, "Uploads must be multipart/form-data")
+
+        results = []
+        claimed = set()
+        part = None
+        try:
+            for event, value in multipart_events(bottle.request.environ['wsgi.input'], length, boundary.encode("latin-1")):
+                if event == "part":
+                    part = self.start(value, results, claimed)
+                elif event == "data" and part is not None:
+                    part = self.write(part, value, results)
+                elif event == "end" and part is not None:
+                    self.finish(part, results)
+                    part = None
+        finally:
+            if part is not None:
+                part.discard()
+
+        return results
+
+    def start(self, headers:dict, results:list, claimed:set) -> uploadPart:
+        """ Validate the name of a file before anything is written"""
+        filename = header_params(headers.get("content-disposition", ""), "content-disposition").get_param(
+            "filename", header="content-disposition")
+        if not filename:
+            return None # A normal form field
+
+        # Browsers may send a full path
+        filename = os.path.basename(filename.replace("\\", "/")).replace(" ", "_")
+        extension = os.path.splitext(filename)[1].lower()
+        sample_path = os.path.join(self.soundboard.config['sample_path'], filename)
+
+        if len(results) >= self.max_files:
+            error = f"At most {self.max_files} files can be uploaded at once"
+        elif extension not in self.extensions:
+            error = f"Filetype {extension} is not supported. Supported file types are {', '.join(self.extensions)}"
+        elif not filename.strip(".") or filename.startswith("."):
+            error = f"{filename} is not a valid name"
+        elif sample_path in claimed or os.path.exists(sample_path):
+            error = f"There is already a sample called {filename}, please choose a different name."
+        else:
+            claimed.add(sample_path)
+            return uploadPart(filename, os.path.join(self.temp_path, f"{uuid.uuid4().hex}{extension}"), sample_path)
+
+        results.append({"name": filename, "error": error})
+        return None
+
+    def write(self, part:uploadPart, data:bytes, results:list) -> uploadPart:
+        part.size += len(data)
+        if part.size > self.max_size:
+            # Skip the rest of it without writing
+            part.discard()
+            results.append({"name": part.filename,
+                            "error": f"{part.filename} is too big! Max allowed size is {self.max_size / 1024 / 1024:g}MiB"})
+            return None
+
+        part.file.write(data)
+        return part
+
+    def finish(self, part:uploadPart, results:list) -> None:
+        if part.size == 0:
+            part.discard()
+            results.append({"name": part.filename, "error": f"{part.filename} is empty"})
+            return
+
+        part.file.close()
+        job = self.soundboard.ingest.submit(part.sample_path, source=part.temp_path)
+        if job is None:
+            os.remove(part.temp_path)
+            results.append({"name": part.filename, "error": "Too many uploads are being processed, try again later"})
+            return
+
+        self.log.info(f"Received {part.filename} ({part.size} bytes), job {job}")
+        results.append({"name": part.filename, "job": job})
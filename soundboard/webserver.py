@@ -1,101 +1,217 @@
 import os
-import time
-import shutil
 import bottle
+import logging
+
+from soundboard import metrics
+from soundboard.assets import staticAssets, etag_matches
+from soundboard.wsgiserver import server_adapter
+from soundboard.uploads import uploadReceiver, uploadError
 
 # TODO handle logging
 
 class webserver(bottle.Bottle):
+    log = logging.getLogger("Webserver")
 
     def __init__(self, host, port, soundboard):
         self.soundboard = soundboard
         self.host = host
         self.port = port
+        config = self.soundboard.config.get('webserver')
+        self.options = config if isinstance(config, dict) else {}
         self._app = bottle.Bottle()
         bottle.TEMPLATE_PATH.append('./html/templates')
+        self.assets = staticAssets({kind: os.path.join("html", kind) for kind in ("js", "css", "img", "font")},
+                                   self.options.get('static_max_age', 604800))
+        self.index_cache = {} # The rendered index page of the current catalogue version
+        self.uploads = uploadReceiver(soundboard)
         self.setup_routes()
 
     def setup_routes(self):
         # static files
         self._app.route("/assets/js/<filepath:re:.*\.js>",
-                        callback=lambda filepath:bottle.static_file(filepath, root="html/js"))
+                        callback=lambda filepath:self.assets.serve("js", filepath))
         self._app.route("/assets/css/<filepath:re:.*\.(css|map)>",
-                        callback=lambda filepath:bottle.static_file(filepath, root="html/css"))
+                        callback=lambda filepath:self.assets.serve("css", filepath))
         self._app.route("/assets/img/<filepath:re:.*\.(jpg|png|gif|ico|svg)>",
-                         callback=lambda filepath:bottle.static_file(filepath, root="html/img"))
+                         callback=lambda filepath:self.assets.serve("img", filepath))
         self._app.route("/assets/font/<filepath:re:.*\.(eot|otf|svg|ttf|woff|woff2?)>",
-                        callback=lambda filepath:bottle.static_file(filepath, root="html/font"))
+                        callback=lambda filepath:self.assets.serve("font", filepath))
 
         self._app.route('/', callback=self.index)
         self._app.route('/upload', method="GET", callback=self.upload)
         self._app.route('/upload', method="POST", callback=self.upload)
         self._app.route('/api/threads', method="GET", callback=self.api_threads)
+        self._app.route('/api/upload', method="POST", callback=self.api_upload)
+        self._app.route('/api/upload/<job:int>', method="GET", callback=self.api_upload_job)
         self._app.route('/api/samples/list', method="GET", callback=self.api_get_samples)
         self._app.route('/api/samples/play/<name>', method="GET", callback=self.api_play_sample)
+        self._app.route('/api/samples/cache', method="GET", callback=self.api_sample_cache)
+        self._app.route('/api/speech/stats', method="GET", callback=self.api_speech_stats)
+        self._app.route('/api/speech/cache', method="GET", callback=self.api_speech_cache)
+        self._app.route('/api/speech/prerender', method="POST", callback=self.api_speech_prerender)
+        self._app.route('/api/speech/prerender/<job:int>', method="GET", callback=self.api_speech_prerender_job)
+        self._app.route('/api/scheduler', method="GET", callback=self.api_scheduler)
+        self._app.route('/api/output', method="GET", callback=self.api_output)
+        self._app.route('/api/metrics', method="GET", callback=self.api_metrics)
+        self._app.route('/api/stop', method="GET", callback=self.api_stop)
+        self._app.route('/api/skip', method="GET", callback=self.api_skip)
         self._app.route('/api/tones/play/square/<freq>', method="GET", callback=self.api_tone_square)
+        self._app.route('/api/tones/rtttl', method="POST", callback=self.api_tone_rtttl)
 
     def webserver_thread(self):
-        self._app.run(host=self.host, port=self.port, debug=True)
+        server = self.options.get('server', "threaded")
+        workers = self.options.get('workers', 8)
+        self.log.info(f"Serving on {self.host}:{self.port} with {server} ({workers} workers)")
+        self._app.run(server=server_adapter(server, self.host, self.port, workers),
+                      debug=self.options.get('debug', False), quiet=not self.options.get('debug', False))
 
     def index(self):
-        return bottle.jinja2_template('index.tpl', samples=self.get_samples())
+        snapshot = self.soundboard.catalogue.current()
+        if (page := self.index_cache.get(snapshot.version)) is None:
+            page = bottle.jinja2_template('index.tpl', samples=snapshot.samples)
+            self.index_cache.clear()
+            self.index_cache[snapshot.version] = page
+
+        return page
 
     def upload(self):
+        limits = {"max_size": f"{self.uploads.max_size / 1024 / 1024:g}MiB", "max_files": self.uploads.max_files,
+                  "extensions": ", ".join(ext.lstrip(".") for ext in self.uploads.extensions)}
         if bottle.request.method == "GET":
-            return bottle.jinja2_template("upload.tpl")
+            return bottle.jinja2_template("upload.tpl", **limits)
         if bottle.request.method == "POST":
-            uploaded_file = bottle.request.files.get('sampleUpload')
-            if not uploaded_file:
-                return bottle.jinja2_template("upload.tpl")
-
-            if os.path.splitext(uploaded_file.filename)[1].lower() not in ('.flac', '.wav', '.mp3', '.ogg'): # TODO config
-                return bottle.jinja2_template("upload.tpl", alert={"type": "alert-danger",
-                    "msg": f"Filetype {os.path.splitext(uploaded_file.filename)[1].lower()} is not supported.\
-                    Supported file types are wav, mp3, ogg and flac"})
-
-            if os.path.exists(os.path.join(self.soundboard.config['sample_path'], uploaded_file.filename)):
-                 return bottle.jinja2_template("upload.tpl", alert={"type": "alert-danger",
-                    "msg": f"There is already a sample called {uploaded_file.filename}, please choose a different name."})
-
-            temp_file = str(time.time()).split(".")[0] + os.path.splitext(uploaded_file.filename)[1]
-            temp_path = os.path.join("cache/", temp_file) #todo config
-            uploaded_file.save(temp_path)
-
-            if os.path.getsize(temp_path) >= 3145728: # TODO config
-                return bottle.jinja2_template("upload.tpl", alert={"type": "alert-danger",
-                    "msg": f"{os.path.basename(uploaded_file.filename)} is too big! Max allowed size is 3MiB"})
-
-            shutil.move(temp_path, os.path.join(self.soundboard.config['sample_path'], uploaded_file.filename.replace(" ", "_")))
-            return bottle.jinja2_template("upload.tpl", alert={"type": "alert-success",
-                    "msg": f"Upload successful!"})
+            try:
+                results = self.uploads.receive()
+            except uploadError as e:
+                bottle.response.status = e.status
+                return bottle.jinja2_template("upload.tpl", alerts=[{"type": "alert-danger", "msg": str(e)}], **limits)
+
+            alerts = [{"type": "alert-danger", "msg": result['error']} if "error" in result else
+                      {"type": "alert-success", "msg": f"Uploaded {result['name']}, it will be playable once it's "
+                                                       f"processed (/api/upload/{result['job']})"}
+                      for result in results]
+            return bottle.jinja2_template("upload.tpl", alerts=alerts, **limits)
 
     def get_samples(self):
-        samples = []
-        for sample in sorted(os.listdir(self.soundboard.config['sample_path'])):
-            if not os.path.isdir(os.path.join(self.soundboard.config['sample_path'], sample)):
-                samples.append({"name": os.path.splitext(sample)[0],
-                                "ext": os.path.splitext(sample)[-1],
-                                "path": os.path.join(self.soundboard.config['sample_path'], sample),
-                                "size": os.path.getsize(os.path.join(self.soundboard.config['sample_path'], sample))})
-        return samples
+        return self.soundboard.catalogue.current().samples
 
     # API
     def api_threads(self):
         return {"response": "OK", "threads":[str(t) for t in self.soundboard.threads]}
 
+    def api_upload(self):
+        try:
+            results = self.uploads.receive()
+        except uploadError as e:
+            bottle.response.status = e.status
+            return {"response": "FAIL", "MSG": str(e)}
+
+        return {"response": "OK" if results and all("job" in result for result in results) else "FAIL",
+                "files": results}
+
+    def api_upload_job(self, job):
+        status = self.soundboard.ingest.job(job)
+        if status is None:
+            return {"response": "FAIL", "MSG": f"Couldn't find job {job}"}
+
+        return {"response": "OK", "job": status}
+
     def api_get_samples(self):
-        return {"response": "OK", "samples": self.get_samples()}
+        """ ?offset=&limit= to page, ?prefix= and ?q= to filter"""
+        snapshot = self.soundboard.catalogue.current()
+        headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+        if etag_matches((snapshot.etag,)):
+            return bottle.HTTPResponse(status=304, **headers)
+
+        query = bottle.request.query
+        try:
+            offset = max(int(query.get('offset', 0)), 0)
+            limit = max(int(query['limit']), 0) if query.get('limit') else None
+        except ValueError:
+            return {"response": "FAIL", "MSG": "offset and limit must be numbers"}
+
+        for header, value in headers.items():
+            bottle.response.set_header(header, value)
+
+        return {"response": "OK", "version": snapshot.version,
+                **self.soundboard.catalogue.page(offset, limit, query.get('prefix', ""), query.get('q', ""))}
 
     def api_play_sample(self, name):
-        samples = self.get_samples()
+        sample = self.soundboard.catalogue.resolve(name)
+        if sample is None:
+            return {"response": "FAIL", "MSG": f"Couldn't find {name}"}
+
+        self.soundboard.samplePlayer.play_sample(sample['path'])
+        return {"response": "OK"}
+
+    def api_sample_cache(self):
+        return {"response": "OK", "cache": self.soundboard.samplePlayer.cache.stats()}
 
-        for sample in samples:
-            if name in sample['name']:
-                self.soundboard.samplePlayer.play_sample(sample['path'])
-                return {"response": "OK"}
+    def api_speech_stats(self):
+        return {"response": "OK", "pool": self.soundboard.speechPool.stats()}
 
-        return {"response": "FAIL", "MSG": f"Couldn't find {name}"}
+    def api_speech_cache(self):
+        return {"response": "OK", "cache": self.soundboard.speechCache.stats()}
+
+    def api_speech_prerender(self):
+        payload = bottle.request.json
+        if isinstance(payload, dict):
+            entries, parallelism = payload.get('entries'), payload.get('parallelism')
+        else:
+            entries, parallelism = payload, None
+
+        try:
+            job = self.soundboard.speechPrerender.start(entries, parallelism)
+        except ValueError as e:
+            return {"response": "FAIL", "MSG": str(e)}
+
+        return {"response": "OK", "job": job}
+
+    def api_speech_prerender_job(self, job):
+        status = self.soundboard.speechPrerender.job(job)
+        if status is None:
+            return {"response": "FAIL", "MSG": f"Couldn't find job {job}"}
+
+        return {"response": "OK", "job": status}
+
+    def api_scheduler(self):
+        return {"response": "OK", "scheduler": self.soundboard.scheduler.stats()}
+
+    def api_output(self):
+        return {"response": "OK", "output": self.soundboard.pulse.stats()}
+
+    def api_metrics(self):
+        bottle.response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        return metrics.REGISTRY.render()
+
+    def api_stop(self):
+        return {"response": "OK", "latency": self.soundboard.stop()}
+
+    def api_skip(self):
+        return {"response": "OK", "latency": self.soundboard.skip()}
 
     def api_tone_square(self, freq):
+        try:
+            freq = float(freq)
+        except ValueError:
+            freq = None
+
+        # Up to the Nyquist frequency of the output
+        if freq is None or not 0 < freq <= 22050:
+            bottle.response.status = 400
+            return {"response": "FAIL", "MSG": "freq must be a number between 0 and 22050"}
+
         self.soundboard.toneGenerator.toneQueue.put({"type": "square", "freq": freq, "duration": 1.0})
+        return {"response": "OK"}
+
+    def api_tone_rtttl(self):
+        payload = bottle.request.json
+        ringtone = payload.get('rtttl') if payload else bottle.request.body.read().decode("utf-8")
+
+        try:
+            self.soundboard.toneGenerator.ringtone.parse(ringtone or "")
+        except ValueError as e:
+            return {"response": "FAIL", "MSG": str(e)}
+
+        self.soundboard.toneGenerator.toneQueue.put({"type": "rttl", "rttl": ringtone})
         return {"response": "OK"}
\ No newline at end of file
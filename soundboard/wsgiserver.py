@@ -0,0 +1,76 @@
+import socket
+import logging
+import bottle
+
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+# Keyword that sets the amount of worker threads of other bottle backends
+WORKER_OPTIONS = {"waitress": "threads", "cheroot": "numthreads", "paste": "threadpool_workers"}
+
+class pooledWSGIServer(WSGIServer):
+    """
+        The wsgiref server, but every connection is handled by a bounded
+        pool of worker threads instead of one after the other, so a slow
+        upload or a large download doesn't block the API.
+    """
+    request_queue_size = 64
+    allow_reuse_address = True
+
+    def __init__(self, address:tuple, handler, workers:int) -> None:
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Webserver")
+        super().__init__(address, handler)
+
+    def process_request(self, request, client_address) -> None:
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+class quietHandler(WSGIRequestHandler):
+    log = logging.getLogger("Webserver")
+
+    def setup(self) -> None:
+        super().setup()
+        # Headers and body are separate writes, don't let Nagle delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format:str, *args) -> None:
+        self.log.debug(f"{self.address_string()} {format % args}")
+
+class threadedServer(bottle.ServerAdapter):
+    """ A bottle backend running pooledWSGIServer, options: workers"""
+
+    def run(self, app) -> None:
+        self.srv = pooledWSGIServer((self.host, self.port), quietHandler, self.options.get('workers', 8))
+        self.port = self.srv.server_port
+        self.srv.set_app(app)
+
+        try:
+            self.srv.serve_forever()
+        finally:
+            self.srv.server_close()
+
+def server_adapter(name:str, host:str, port:int, workers:int) -> bottle.ServerAdapter:
+    """
+        Return the bottle backend to run the webserver on. "threaded" is
+        our own pool, "wsgiref" the single threaded default and every
+        other name a backend bottle knows, like waitress or cheroot.
+    """
+    if name == "threaded":
+        return threadedServer(host=host, port=port, workers=workers)
+
+    if name not in bottle.server_names:
+        raise ValueError(f"Unknown webserver backend {name}, use threaded or one of {', '.join(bottle.server_names)}")
+
+    options = {WORKER_OPTIONS[name]: workers} if name in WORKER_OPTIONS else {}
+    return bottle.server_names[name](host=host, port=port, **options)
@@ -0,0 +1,62 @@
+""" Stopping and skipping voices on a paced output"""
+import time
+import types
+import threading
+
+import numpy
+import pytest
+
+from soundboard import mixer, output
+
+RATE = 44100
+
+@pytest.fixture
+def board():
+    board = types.SimpleNamespace(config={"mixer": {"period": 1024}})
+    board.pulse = output.nullOutput(pacing=True)
+    board.mixer = mixer.mixer(board)
+    threading.Thread(name="Mixer", target=board.mixer.mix_thread, daemon=True).start()
+    yield board
+    board.mixer.stop()
+
+def long_voice(seconds:float=10.0) -> bytes:
+    return (numpy.random.default_rng(1).integers(-1000, 1000, int(seconds * RATE) * 2)).astype(numpy.int16).tobytes()
+
+def max_latency(board) -> float:
+    """ The mixer may be blocked in one write, the request is handled in the period after it"""
+    return 2 * board.mixer.period / RATE
+
+def wait_for_playback(board) -> None:
+    # Paced, so by now the writes block like a full sink
+    time.sleep(0.2)
+    assert board.pulse.writes > 0
+
+def test_stop_drops_every_voice(board):
+    voices = [board.mixer.play(long_voice(), name=f"voice {i}") for i in range(3)]
+    wait_for_playback(board)
+
+    latency = board.mixer.stop()
+    assert latency is not None and latency < max_latency(board)
+    assert all(playing.done.is_set() for playing in voices)
+    assert board.mixer.active() == 0
+    assert board.pulse.flushes == 1
+    assert board.pulse.latency() < max_latency(board)
+
+def test_skip_drops_the_oldest_voice(board):
+    oldest = board.mixer.play(long_voice(), name="oldest")
+    newest = board.mixer.play(long_voice(), name="newest")
+    wait_for_playback(board)
+
+    latency = board.mixer.skip()
+    assert latency is not None and latency < max_latency(board)
+    assert oldest.done.is_set()
+    assert not newest.done.is_set()
+    assert board.mixer.active() == 1
+
+def test_plays_again_after_a_stop(board):
+    board.mixer.play(long_voice(), name="stopped")
+    wait_for_playback(board)
+    board.mixer.stop()
+
+    short = board.mixer.play(long_voice(0.1), name="short")
+    assert short.wait(2.0)
@@ -0,0 +1,108 @@
+""" The MPD gateway and the ducking controller against the fake MPD server"""
+import socket
+import types
+
+import mpd
+import pytest
+
+from benchmarks.fakempd import fakeMPD
+from soundboard.ducking import duckingController
+from soundboard.mpdclient import mpdclient
+
+@pytest.fixture
+def server():
+    server = fakeMPD().start()
+    yield server
+    server.stop()
+
+def soundboard(port:int, **mpd_config) -> types.SimpleNamespace:
+    config = {"host": "127.0.0.1", "port": port, "timeout": 2, **mpd_config}
+    return types.SimpleNamespace(config={"mpd": config})
+
+@pytest.fixture
+def gateway(server):
+    board = soundboard(server.port)
+    board.mpd = mpdclient(board)
+    yield board.mpd
+    board.mpd.disconnect()
+
+def round_trips(server:fakeMPD, gateway:mpdclient, function) -> int:
+    """ Round trips taken by function, the keepalive is held off meanwhile"""
+    with gateway.mpd_lock:
+        start = server.round_trips
+        function()
+        return server.round_trips - start
+
+def test_one_connection_is_shared(server, gateway):
+    for _ in range(10):
+        gateway.mpd_status()
+        gateway.volume(50)
+
+    assert server.connections == 1
+    assert server.volume == 50
+
+def test_command_list_is_one_round_trip(server, gateway):
+    commands = [("setvol", (volume,)) for volume in (70, 60, 50, 40)]
+    assert round_trips(server, gateway, lambda: gateway.command_list(commands)) == 1
+    assert server.commands["setvol"] == 4
+    assert server.volume == 40
+
+def test_pause_and_resume(server, gateway):
+    gateway.mpd_should_resume()
+    assert server.state == "play"
+
+    gateway.mpd_should_pause()
+    gateway.mpd_should_pause()
+    assert server.state == "pause"
+
+    gateway.mpd_should_resume()
+    assert server.state == "play"
+
+def test_reconnects_when_the_connection_drops(server, gateway):
+    gateway.mpd_status()
+    server.kick()
+
+    assert gateway.mpd_status()["state"] == "play"
+    assert server.connections == 2
+
+def test_backs_off_while_mpd_is_down():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    gateway = mpdclient(soundboard(port, reconnect={"min": 30.0, "max": 60.0}))
+    assert not gateway.connected
+    assert gateway.backoff == 60.0
+
+    # Within the backoff nothing is attempted
+    with pytest.raises(mpd.base.ConnectionError, match="Not reconnecting"):
+        gateway.mpd_status()
+
+def test_ramp_without_delay_is_one_command_list(server, gateway):
+    board = gateway.soundboard
+    board.config["mpd"]["ramp"] = {"delay": 0}
+    ducking = duckingController(board)
+    ducking.current = server.volume
+
+    assert round_trips(server, gateway, lambda: ducking.ramp_to(20, 10, False)) == 1
+    assert server.volume == 20
+    assert ducking.current == 20
+
+def test_ramp_with_delay_steps_the_volume(server, gateway):
+    board = gateway.soundboard
+    board.config["mpd"]["ramp"] = {"delay": 0.001}
+    ducking = duckingController(board)
+    ducking.current = server.volume
+
+    assert round_trips(server, gateway, lambda: ducking.ramp_to(20, 10, False)) == 9
+    assert server.volume == 20
+
+def test_duck_interrupts_a_ramp_up(server, gateway):
+    board = gateway.soundboard
+    board.config["mpd"]["ramp"] = {"delay": 0.001}
+    ducking = duckingController(board)
+    ducking.current = 20
+
+    ducking.duck()
+    assert ducking.ramp_to(80, 10, True) is False
+    assert ducking.current == 20
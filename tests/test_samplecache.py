@@ -0,0 +1,61 @@
+""" The byte budget of the sample cache"""
+import os
+
+from soundboard.samplecache import pcmCache, sampleCache
+
+def sample(tmp_path, name:str) -> str:
+    path = os.path.join(tmp_path, name)
+    with open(path, "wb") as f:
+        f.write(name.encode("utf-8"))
+    return path
+
+def test_trimmed_views_are_charged_for_what_they_keep(tmp_path):
+    def load(path):
+        # Silence around the sound, like loudness.trimmed
+        return memoryview(bytes(400000))[1000:5000]
+
+    cache = sampleCache(load, max_bytes=10000)
+    path = sample(tmp_path, "horn.wav")
+    pcm = cache.get(path)
+
+    assert isinstance(pcm, bytes) and len(pcm) == 4000
+    assert cache.stats()["bytes"] == 4000
+    assert cache.get(path) is pcm
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = sampleCache(lambda path: bytes(4000), max_bytes=10000)
+    one, two, three = (sample(tmp_path, name) for name in ("one.wav", "two.wav", "three.wav"))
+
+    cache.get(one)
+    cache.get(two)
+    cache.get(one)
+    cache.get(three)
+
+    assert list(cache.entries) == [one, three]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 8000
+
+def test_changed_files_are_loaded_again(tmp_path):
+    loads = []
+    cache = sampleCache(lambda path: loads.append(path) or bytes(4), max_bytes=10000)
+    path = sample(tmp_path, "one.wav")
+
+    cache.get(path)
+    cache.get(path)
+    with open(path, "ab") as f:
+        f.write(b"changed")
+    cache.get(path)
+
+    assert len(loads) == 2
+    assert cache.stats()["bytes"] == 4
+
+def test_other_versions_are_a_miss():
+    cache = pcmCache(max_bytes=100)
+    cache.put(("sine", 440.0), bytes(40))
+    cache.put("doorbell", bytes(40), version=1)
+
+    assert cache.get(("sine", 440.0)) == bytes(40)
+    assert cache.get("doorbell", 1) == bytes(40)
+    assert cache.get("doorbell", 2) is None
+    assert cache.get("doorbell", 1) is None
+    assert cache.stats()["bytes"] == 40
@@ -0,0 +1,102 @@
+""" Priority classes, overflow and coalescing of the playback scheduler"""
+import types
+import threading
+
+import pytest
+
+from soundboard.scheduler import playbackScheduler
+
+class fakeVoice():
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.done = threading.Event()
+
+    def stop(self) -> None:
+        self.done.set()
+
+@pytest.fixture
+def scheduler():
+    return playbackScheduler(types.SimpleNamespace(config={}))
+
+def queued(scheduler, priority:str) -> list:
+    return [job.name for job in scheduler.queues[priority]]
+
+def test_duplicates_are_coalesced(scheduler):
+    assert scheduler.submit("bell.wav", "doorbell")
+    assert not scheduler.submit("bell.wav", "doorbell")
+    assert queued(scheduler, "doorbell") == ["bell.wav"]
+    assert scheduler.stats()["doorbell"]["coalesced"] == 1
+
+def test_dropped_jobs_dont_start_a_coalesce_window(scheduler):
+    assert scheduler.submit("one.wav", "doorbell")
+    assert scheduler.submit("two.wav", "doorbell")
+
+    # drop_newest, the queue is full
+    assert not scheduler.submit("three.wav", "doorbell")
+    assert scheduler.next().name == "one.wav"
+
+    # three.wav was never queued, pressing it again isn't a duplicate
+    assert scheduler.submit("three.wav", "doorbell")
+    assert queued(scheduler, "doorbell") == ["two.wav", "three.wav"]
+    stats = scheduler.stats()["doorbell"]
+    assert (stats["dropped"], stats["coalesced"]) == (1, 0)
+
+def test_drop_oldest(scheduler):
+    for name in ("one.wav", "two.wav", "three.wav"):
+        assert scheduler.submit(name, "door")
+
+    assert queued(scheduler, "door") == ["two.wav", "three.wav"]
+    assert scheduler.stats()["door"]["dropped"] == 1
+
+def test_coalesce_window_is_configurable():
+    scheduler = playbackScheduler(types.SimpleNamespace(config={"scheduler": {"play": {"coalesce": 0}}}))
+    assert scheduler.submit("horn.wav")
+    assert scheduler.submit("horn.wav")
+    assert scheduler.classes["play"]["depth"] == 8
+
+def test_pcm_without_a_name_is_never_coalesced(scheduler):
+    assert scheduler.submit(bytes(4), "play")
+    assert scheduler.submit(bytes(4), "play")
+
+def test_highest_priority_plays_first(scheduler):
+    scheduler.submit("horn.wav", "play")
+    scheduler.submit(bytes(4), "speech", name="hello")
+    scheduler.submit("theme.wav", "themesong")
+    scheduler.submit("bell.wav", "doorbell")
+
+    assert [scheduler.next().priority for _ in range(4)] == ["doorbell", "themesong", "speech", "play"]
+    assert scheduler.pending() == 0
+
+def test_voice_limit_holds_back_its_class_only(scheduler):
+    scheduler.submit("one.wav", "themesong")
+    scheduler.submit("two.wav", "themesong")
+    scheduler.submit("horn.wav", "play")
+
+    job = scheduler.next()
+    voice = fakeVoice(job.name)
+    scheduler.started(job, voice)
+
+    # One themesong voice at a time, play isn't held back by it
+    assert scheduler.next().name == "horn.wav"
+    assert scheduler.ready() is None
+
+    voice.done.set()
+    assert scheduler.next().name == "two.wav"
+
+def test_doorbell_preempts_lower_classes(scheduler):
+    scheduler.submit("theme.wav", "themesong")
+    scheduler.submit("horn.wav", "play")
+    voices = []
+    for _ in range(2):
+        job = scheduler.next()
+        voices.append(fakeVoice(job.name))
+        scheduler.started(job, voices[-1])
+
+    scheduler.submit("bell.wav", "doorbell")
+    job = scheduler.next()
+    scheduler.started(job, fakeVoice(job.name))
+
+    assert all(voice.done.is_set() for voice in voices)
+    assert scheduler.stats()["themesong"]["preempted"] == 1
+    assert scheduler.stats()["play"]["preempted"] == 1
+    assert scheduler.stats()["doorbell"]["playing"] == 1
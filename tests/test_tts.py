@@ -0,0 +1,174 @@
+""" The TTS backends and their transport against a local stand-in server"""
+import os
+import json
+import time
+import threading
+
+from http.server import ThreadingHTTPServer
+from urllib import parse
+
+import pytest
+
+from benchmarks.tts import standInHandler
+from generators import ttstransport
+from generators.speech import AcapelaGroup, FifteenAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO = b"RIFF" + bytes(range(256)) * 4099
+
+class scriptedHandler(standInHandler):
+    """ The stand-in server, with the failures and stalls the tests ask for"""
+
+    def do_POST(self) -> None:
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        server.posts.append((self.path, parse.parse_qs(body)))
+
+        if server.stalls:
+            server.stalls -= 1
+            time.sleep(0.5)
+
+        if server.failures:
+            server.failures -= 1
+            self.send_error(503)
+            return
+
+        if self.path == "/getnonce":
+            server.nonces += 1
+            self.reply(json.dumps({"nonce": f"nonce-{server.nonces}"}).encode("utf-8"), "application/json")
+        elif self.path == "/synthesizer":
+            link = "" if server.no_link else f"snd_url={server.base}/audio/utterance.wav"
+            self.reply(link.encode("utf-8"), "text/plain")
+        else:
+            self.reply(json.dumps({"wavNames": ["utterance.wav"]}).encode("utf-8"), "application/json")
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+        else:
+            super().do_GET()
+
+class standInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        pass # The client hung up on a stalled request
+
+@pytest.fixture
+def server():
+    server = standInServer(("127.0.0.1", 0), scriptedHandler)
+    server.handshake = 0.0
+    server.connections = 0
+    server.audio = AUDIO
+    server.posts = []
+    server.nonces = 0
+    server.failures = 0
+    server.stalls = 0
+    server.no_link = False
+    server.base = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def transport():
+    return ttstransport.ttsTransport("test", timeout=0.2, retries=2, backoff=0.0)
+
+@pytest.fixture
+def fifteen(server, transport):
+    api = FifteenAPI(transport=transport)
+    api.tts_url = f"{server.base}/tts"
+    api.audio_url = f"{server.base}/audio/"
+    return api
+
+@pytest.fixture
+def acapela(server, transport, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(AcapelaGroup, "voices", None)
+    api = AcapelaGroup(nonce_ttl=600, transport=transport)
+    api.nonce_url = f"{server.base}/getnonce"
+    api.synthesizer_url = f"{server.base}/synthesizer"
+    return api
+
+def nonces(server) -> list:
+    return [body['req_comment'][0] for path, body in server.posts if path == "/synthesizer"]
+
+def test_connections_are_reused(server, fifteen):
+    for _ in range(5):
+        assert fifteen.get_tts_raw("GLaDOS", "Hello world")["status"] == "OK"
+
+    assert server.connections == 1
+
+def test_nonce_is_reused_until_it_expires(server, acapela):
+    for _ in range(3):
+        assert acapela.generate("Will", "Hello world") == AUDIO
+
+    assert server.nonces == 1
+    assert all("nonce-1" in comment for comment in nonces(server))
+
+    acapela.nonce_expires = 0.0
+    assert acapela.generate("Will", "Hello world") == AUDIO
+    assert server.nonces == 2
+    assert "nonce-2" in nonces(server)[-1]
+
+def test_nonce_is_renewed_when_synthesis_fails(server, acapela):
+    server.no_link = True
+    assert acapela.generate("Will", "Hello world") is None
+
+    server.no_link = False
+    assert acapela.generate("Will", "Hello world") == AUDIO
+    assert server.nonces == 2
+
+def test_failed_nonce_is_not_cached(server, acapela):
+    server.failures = 3
+    assert acapela.generate("Will", "Hello world") is None
+
+    assert acapela.generate("Will", "Hello world") == AUDIO
+    assert server.nonces == 1
+
+def test_retries_server_errors(server, fifteen):
+    server.failures = 2
+    assert fifteen.get_tts_raw("GLaDOS", "Hello world")["status"] == "OK"
+    assert [path for path, body in server.posts] == ["/tts"] * 3
+
+def test_gives_up_after_the_retries(server, fifteen):
+    server.failures = 3
+    response = fifteen.get_tts_raw("GLaDOS", "Hello world")
+    assert "503" in response["status"]
+    assert response["data"] is None
+    assert len(server.posts) == 3
+
+def test_retries_timeouts(server, fifteen):
+    server.stalls = 1
+    assert fifteen.get_tts_raw("GLaDOS", "Hello world")["status"] == "OK"
+    assert len(server.posts) == 2
+
+def test_timeouts_are_reported(server, fifteen):
+    server.stalls = 3
+    assert fifteen.get_tts_raw("GLaDOS", "Hello world")["status"].startswith("ConnectionError")
+
+def test_voice_map_is_read_once(acapela, transport, tmp_path, monkeypatch):
+    voices = AcapelaGroup.voices
+    assert acapela.map_voice(next(iter(voices)).upper()) == next(iter(voices.values()))
+    assert acapela.map_voice("Unknown") == "Unknown"
+
+    # acapellagroup.json can't be found from here, it must not be read again
+    monkeypatch.chdir(tmp_path)
+    assert AcapelaGroup(transport=transport).voices is voices
+
+def test_download_is_streamed(server, transport, monkeypatch):
+    requests = []
+    request = transport.session.request
+    monkeypatch.setattr(transport.session, "request", lambda *args, **kwargs: requests.append(kwargs) or request(*args, **kwargs))
+
+    assert transport.download(f"{server.base}/audio/utterance.wav", chunk_size=1000) == AUDIO
+    assert requests[0]["stream"] is True
+    assert requests[0]["timeout"] == transport.timeout
+
+def test_failed_download_returns_none(server, transport):
+    assert transport.download(f"{server.base}/missing.wav") is None
+
+def test_transports_are_shared_per_backend():
+    assert ttstransport.transport("tests") is ttstransport.transport("tests")
+    assert ttstransport.transport("tests") is not ttstransport.transport("tests-other")